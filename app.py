@@ -1,97 +1,173 @@
 # app.py
+import time
+
+# Время начала импорта: по нему create_app() логирует длительность холодного старта
+_import_started = time.perf_counter()
+
+import base64
+import hashlib
+import hmac
 import logging
 import os
 import shutil
-import time
+import signal
+import sys
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 from logging.handlers import RotatingFileHandler
-from threading import Thread
-
-from dotenv import load_dotenv
-from flask import Flask, jsonify, render_template, request, send_from_directory, session
+from threading import Event, Lock, Thread
+from typing import Annotated, Literal
+from urllib.parse import urljoin
+
+import msgspec
+from flask import (
+    Blueprint,
+    Flask,
+    Response,
+    abort,
+    current_app,
+    jsonify,
+    render_template,
+    request,
+    session,
+)
 from werkzeug.utils import secure_filename
 
-# Импортируем классы из существующего client_con.py
-from client_con import ConfigManager, FusionBrainAPI, ImageHandler
-from flask_session import Session
-
-# Загружаем переменные из .env
-load_dotenv()
+from cancellation import DEADLINE_EXCEEDED, CancelToken, TaskCancelledError
+from config import get_config, install_sighup_handler, on_reload, watch_env_file
+from debug_tools import (
+    create_debug_blueprint,
+    install_profile_signal_handler,
+    require_debug_token,
+)
+from eta import PREPARE, SAVE, UPSTREAM, EtaEstimator, time_progress
+from image_index import ImageIndex, shard_dir
+from log_context import LOG_FORMAT, TaskLogFilter
+from pipeline_router import PipelineRouter, is_disabled
+from scheduler import (
+    BATCH,
+    INTERACTIVE,
+    GenerationScheduler,
+    QueueFullError,
+    parse_weights,
+)
+from session_backend import init_session
+from storage import create_storage, stream_zip
+from task_journal import TaskJournal
+from task_store import ImageRef, Task, TaskParams, TaskStatus, TaskStore
+from webhooks import WebhookDispatcher, check_callback_url
+
+# Снимок конфигурации из переменных окружения и .env, загружается один раз
+config = get_config()
 
-# Получаем параметры логирования из .env
-log_file = os.getenv("LOG_FILE", "app.log")  # По умолчанию app.log
-log_max_size_mb = float(os.getenv("LOG_MAX_SIZE_MB", 1))  # По умолчанию 1 МБ
-log_backup_count = int(os.getenv("LOG_BACKUP_COUNT", 3))  # По умолчанию 3 файлов
+# Логгер для текущего модуля
+logger = logging.getLogger(__name__)
 
-# Преобразуем размер в байты (1 МБ = 1024 * 1024 байт)
-log_max_size = int(log_max_size_mb * 1024 * 1024)
+# Папка для сгенерированных изображений
+UPLOAD_FOLDER = "output"
 
-# Получаем параметр очистки output из .env
-output_cleanup_age_hours = float(
-    os.getenv("OUTPUT_CLEANUP_AGE_HOURS", 24)
-)  # По умолчанию 24 часа
+# Сколько устаревших задач выбирается из индекса изображений за один запрос
+CLEANUP_BATCH_SIZE = 1000
 
-# Настройка корневого логгера
-if not logging.getLogger("").handlers:
-    logging.getLogger("").setLevel(logging.INFO)
-    file_handler = RotatingFileHandler(
-        log_file, maxBytes=log_max_size, backupCount=log_backup_count, encoding="utf-8"
-    )
-    file_handler.setLevel(logging.INFO)
-    file_handler.setFormatter(
-        logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
-    )
-    logging.getLogger("").addHandler(file_handler)
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-    console_handler.setFormatter(
-        logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
-    )
-    logging.getLogger("").addHandler(console_handler)
 
-# Отключение логов Werkzeug для HTTP-запросов
-werkzeug_logger = logging.getLogger("werkzeug")
-werkzeug_logger.disabled = True  # Полностью отключаем логгер werkzeug
-werkzeug_logger.handlers = []  # Удаляем любые обработчики
-werkzeug_logger.propagate = False  # Не передаём сообщения корневому логгеру
+def configure_logging(config):
+    """
+    Настраивает корневой логгер: файл с ротацией и вывод в консоль.
 
-# Логгер для текущего модуля
-logger = logging.getLogger(__name__)
+    Повторный вызов ничего не меняет, если обработчики уже установлены.
 
-# Тестовое сообщение для проверки
-logger.info("Logging initialized")
+    Args:
+        config (AppConfig): Снимок конфигурации с параметрами логирования.
+    """
+    root = logging.getLogger("")
+    if not root.handlers:
+        root.setLevel(logging.INFO)
+        file_handler = RotatingFileHandler(
+            config.log_file,
+            maxBytes=config.log_max_size,
+            backupCount=config.log_backup_count,
+            encoding="utf-8",
+        )
+        file_handler.setLevel(logging.INFO)
+        file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        # Метка задачи [task=<id>] нужна log_analyzer для хронологии задач
+        file_handler.addFilter(TaskLogFilter())
+        root.addHandler(file_handler)
+        console_handler = logging.StreamHandler()
+        console_handler.setLevel(logging.INFO)
+        console_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        console_handler.addFilter(TaskLogFilter())
+        root.addHandler(console_handler)
+
+    # Отключение логов Werkzeug для HTTP-запросов
+    werkzeug_logger = logging.getLogger("werkzeug")
+    werkzeug_logger.disabled = True  # Полностью отключаем логгер werkzeug
+    werkzeug_logger.handlers = []  # Удаляем любые обработчики
+    werkzeug_logger.propagate = False  # Не передаём сообщения корневому логгеру
 
 
 def cleanup_output_folder():
     """
-    Очищает папку output от старых подкаталогов.
-
-    Подкаталоги удаляются, если они старше OUTPUT_CLEANUP_AGE_HOURS.
-    Логгирует информацию о процессе очистки.
+    Очищает хранилище изображений от старых задач.
+
+    Задачи, изображения которых старше OUTPUT_CLEANUP_AGE_HOURS, выбираются
+    по индексу изображений пачками по CLEANUP_BATCH_SIZE, пока устаревших
+    задач не останется, поэтому хранилище целиком не обходится.
+    Завершённые задачи того же возраста удаляются из памяти. Каталоги задач
+    в старой плоской раскладке (output/<task_id>) удаляются по времени
+    изменения. Логгирует информацию о процессе очистки.
     """
-    output_folder = os.path.abspath(app.config["UPLOAD_FOLDER"])
+    output_folder = os.path.abspath(UPLOAD_FOLDER)
+    output_cleanup_age_hours = get_config().output_cleanup_age_hours
     cleanup_age_seconds = output_cleanup_age_hours * 3600  # Конвертируем часы в секунды
     current_time = time.time()
 
     logger.info(
-        f"Starting cleanup of {output_folder} (age > {output_cleanup_age_hours} hours)"
+        f"Starting cleanup of stored images (age > {output_cleanup_age_hours} hours)"
     )
 
     try:
+        deleted_count = 0
+        # Задачи, которые не удалось удалить, остаются в индексе, поэтому
+        # пачка расширяется на их число и они не повторяются в этом обходе.
+        # Неполная пачка означает, что устаревших задач больше нет.
+        failed = set()
+        while not shutdown_event.is_set():
+            limit = CLEANUP_BATCH_SIZE + len(failed)
+            batch = image_index.expired_tasks(
+                current_time - cleanup_age_seconds, limit=limit
+            )
+            for task_id in batch:
+                if task_id in failed:
+                    continue
+                try:
+                    storage.delete_prefix(shard_dir(task_id))
+                    image_index.delete_task(task_id)
+                    deleted_count += 1
+                except Exception as e:
+                    failed.add(task_id)
+                    logger.error(f"Failed to delete images of task {task_id}: {e}")
+            if len(batch) < limit:
+                break
+
+        # Записи завершённых задач того же возраста больше не нужны: их
+        # изображения удалены. Вместе с задачей уходит и её JSON из кэша.
+        cutoff = datetime.fromtimestamp(current_time - cleanup_age_seconds)
+        evicted = tasks.evict_finished(cutoff.isoformat())
+        if evicted:
+            logger.info(f"Evicted {evicted} finished tasks from memory")
+
         # Проверяем, существует ли каталог
         if not os.path.exists(output_folder):
-            logger.info(
-                f"Output folder {output_folder} does not exist, skipping cleanup"
-            )
+            logger.info(f"Cleanup completed: deleted {deleted_count} tasks")
             return
 
-        # Перебираем подкаталоги
-        deleted_count = 0
+        # Каталоги задач, сохранённые до перехода на шардированную раскладку.
+        # Имена каталогов шардов состоят из двух символов.
         for subdir in os.listdir(output_folder):
             subdir_path = os.path.join(output_folder, subdir)
             # Проверяем, что это каталог
-            if not os.path.isdir(subdir_path):
+            if len(subdir) <= 2 or not os.path.isdir(subdir_path):
                 continue
 
             # Получаем время последней модификации каталога
@@ -111,7 +187,7 @@ def cleanup_output_folder():
                 except Exception as e:
                     logger.error(f"Failed to delete directory {subdir_path}: {e}")
 
-        logger.info(f"Cleanup completed: deleted {deleted_count} directories")
+        logger.info(f"Cleanup completed: deleted {deleted_count} tasks")
 
     except Exception as e:
         logger.error(f"Error during output folder cleanup: {e}")
@@ -119,32 +195,235 @@ def cleanup_output_folder():
 
 def schedule_cleanup():
     """
-    Запускает функцию cleanup_output_folder каждые 10 минут в фоновом потоке.
+    Запускает функцию cleanup_output_folder каждые OUTPUT_CLEANUP_INTERVAL
+    секунд (по умолчанию 10 минут) в фоновом потоке.
 
-    Работает бесконечно в цикле.
+    Работает в цикле до остановки сервера.
     """
     while True:
         cleanup_output_folder()
-        time.sleep(600)  # Ждём 10 минут (600 секунд)
+        # Ждём до следующей очистки или сигнала остановки
+        if shutdown_event.wait(get_config().output_cleanup_interval):
+            break
 
 
-app = Flask(__name__)
-app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "fusionbrain-flask-app-secret")
-app.config["SESSION_TYPE"] = "filesystem"
-app.config["SESSION_PERMANENT"] = False
-app.config["UPLOAD_FOLDER"] = "output"
-Session(app)
+# Маршруты веб-интерфейса и API; приложение собирается в create_app()
+bp = Blueprint("web", __name__)
 
 # Словарь для хранения статусов задач
-tasks = {}
+tasks = TaskStore()
+
+# Планировщик генераций: пул потоков с приоритетами и справедливой очередью
+scheduler = GenerationScheduler(
+    workers=config.generation_workers,
+    weights=parse_weights(config.scheduler_weights),
+    max_running_per_client=config.max_running_per_client,
+    max_queued_per_client=config.max_queued_per_client,
+    # Задача, срок которой истёк в очереди, отменяется, не дожидаясь запуска
+    on_expired=lambda task_id: mark_cancelled(task_id, DEADLINE_EXCEEDED),
+)
+
+# Оценка ожидания в очереди и времени завершения задач
+eta_estimator = EtaEstimator(config.generation_workers)
+
+# Устанавливается при остановке сервера: новые генерации не принимаются
+shutdown_event = Event()
+
+# Журнал незавершённых задач для продолжения генераций после перезапуска
+journal = TaskJournal(config.tasks_db)
+
+# Индекс сохранённых изображений: задача -> файлы в output с размерами и хешами
+image_index = ImageIndex(config.image_index_db)
+
+# Хранилище изображений: локальная папка output или S3-совместимый бакет
+storage = create_storage(config, UPLOAD_FOLDER)
+
+# Уведомления о завершении задач для API-клиентов: task_id -> параметры callback
+callbacks = {}
+
+# Флаги отмены незавершённых задач: task_id -> CancelToken
+cancel_tokens = {}
+webhooks = WebhookDispatcher(
+    max_attempts=config.webhook_max_attempts,
+    timeout=config.webhook_timeout,
+    dead_letter_path=config.webhook_dead_letter,
+    workers=config.webhook_workers,
+    max_per_host=config.webhook_max_per_host,
+)
+
+# Общий для всех задач пул ключей FusionBrain (создаётся при первой генерации)
+key_pool = None
+_key_pool_lock = Lock()
+_key_pool_credentials = None
+
+# Выбор pipeline по скорости и доступности (общий для всех задач)
+pipeline_router = PipelineRouter(
+    refresh_seconds=config.pipeline_refresh_seconds,
+    disable_seconds=config.pipeline_disable_seconds,
+)
+
+# Транспорт запросов к FusionBrain: HTTP, запись или воспроизведение кассеты
+transport = None
+_transport_lock = Lock()
+
+# PID процесса, в котором запущены фоновые службы
+_services_pid = None
+_services_lock = Lock()
+
+# Параметры, которые читаются только при старте процесса
+RESTART_REQUIRED_FIELDS = (
+    "log_file",
+    "log_max_size",
+    "log_backup_count",
+    "secret_key",
+    "flask_debug",
+    "tasks_db",
+    "image_index_db",
+    "fusionbrain_transport",
+    "fusionbrain_cassette",
+    "replay_speed",
+    "pipeline_refresh_seconds",
+    "pipeline_disable_seconds",
+    "storage_backend",
+    "s3_bucket",
+    "s3_endpoint_url",
+    "s3_region",
+    "s3_access_key",
+    "s3_secret_key",
+    "s3_presign_seconds",
+    "session_backend",
+    "session_db",
+    "session_max_entries",
+    "session_lifetime_hours",
+    "generation_workers",
+    "scheduler_weights",
+    "max_running_per_client",
+    "max_queued_per_client",
+    "webhook_max_attempts",
+    "webhook_timeout",
+    "webhook_dead_letter",
+    "webhook_workers",
+    "webhook_max_per_host",
+)
+
+
+def log_restart_required(old, new):
+    """Предупреждает об изменённых параметрах, которые применятся после перезапуска."""
+    fields = [f for f in new.changed_fields(old) if f in RESTART_REQUIRED_FIELDS]
+    if fields:
+        logger.warning(f"Config changes require restart to apply: {', '.join(fields)}")
+
+
+on_reload(log_restart_required)
+
+
+def start_background_services():
+    """
+    Запускает фоновые службы приложения: очистку папки output, наблюдение за
+    .env, планировщик генераций, доставку уведомлений и восстановление
+    незавершённых задач из журнала.
+
+    Безопасна для повторного вызова: службы запускаются один раз в каждом
+    процессе, поэтому её можно вызывать и после fork в воркере gunicorn.
+    """
+    global _services_pid
+    with _services_lock:
+        if _services_pid == os.getpid():
+            return
+        _services_pid = os.getpid()
+
+    cleanup_thread = Thread(target=schedule_cleanup, daemon=True)
+    cleanup_thread.start()
+    logger.info("Started output folder cleanup thread")
+
+    # Перезагрузка конфигурации при изменении .env
+    Thread(target=watch_env_file, args=(shutdown_event,), daemon=True).start()
+
+    scheduler.start()
+    webhooks.start()
+
+    Thread(target=maintain_journal, name="task-journal", daemon=True).start()
+
 
-# Запуск фоновой задачи очистки при старте приложения
-cleanup_thread = Thread(target=schedule_cleanup, daemon=True)
-cleanup_thread.start()
-logger.info("Started output folder cleanup thread")
+def maintain_journal():
+    """
+    Продлевает аренду задач процесса в журнале и забирает брошенные задачи.
+
+    Задачи процесса, который остановился без drain, освобождаются только по
+    истечении аренды, поэтому проверка повторяется, пока сервер работает.
+    """
+    while True:
+        recover_tasks()
+        if shutdown_event.wait(journal.lease_seconds / 4):
+            break
+        try:
+            journal.heartbeat()
+        except Exception as e:
+            logger.error(f"Failed to renew task journal lease: {e}")
+
+
+@bp.before_app_request
+def ensure_background_services():
+    """Запускает фоновые службы при первом запросе, если их ещё не запустили."""
+    if _services_pid != os.getpid():
+        start_background_services()
 
 
-def generate_image_task(task_id, prompt, width, height, style, negative_prompt):
+def drain(timeout=None):
+    """
+    Останавливает приём новых генераций и ждёт завершения текущих.
+
+    Args:
+        timeout (float, optional): Максимальное время ожидания в секундах.
+            По умолчанию DRAIN_TIMEOUT.
+
+    Возвращает:
+        bool: True, если все генерации завершились до истечения таймаута.
+    """
+    timeout = get_config().drain_timeout if timeout is None else timeout
+    shutdown_event.set()
+    logger.info(
+        f"Draining {scheduler.running_count()} in-flight tasks "
+        f"(timeout {timeout:.0f}s)"
+    )
+
+    # Задачи из очереди не запускаются: они остаются в журнале и будут
+    # запущены после перезапуска
+    unfinished = scheduler.shutdown(timeout)
+    try:
+        # Оставшиеся задачи сразу может забрать другой процесс
+        journal.release()
+    except Exception as e:
+        logger.error(f"Failed to release task journal: {e}")
+    # Уведомления о завершённых задачах отправляются до выхода процесса
+    webhooks.shutdown()
+    if unfinished:
+        logger.warning(
+            f"Drain timed out, {len(unfinished)} tasks left unfinished and kept "
+            f"in the task journal for resume: {unfinished}"
+        )
+        return False
+    logger.info("All in-flight tasks finished")
+    return True
+
+
+def handle_sigterm(signum, frame):
+    """Обработчик SIGTERM при запуске без gunicorn: дожидается задач и выходит."""
+    logger.info(f"Received signal {signum}, shutting down")
+    drain()
+    sys.exit(0)
+
+
+def generate_image_task(
+    task_id,
+    prompt,
+    width,
+    height,
+    style,
+    negative_prompt,
+    images_num=1,
+    pipeline=None,
+):
     """
     Фоновая задача для генерации изображения по заданному промпту.
 
@@ -155,123 +434,734 @@ def generate_image_task(task_id, prompt, width, height, style, negative_prompt):
         height (int): Высота изображения.
         style (str): Стиль генерации изображения.
         negative_prompt (str): Отрицательный промпт для ограничений.
+        images_num (int): Количество изображений в одной генерации (1-4).
+        pipeline (str, optional): Pipeline, выбранный клиентом; None или
+            "auto" - самый быстрый доступный pipeline.
 
     Возвращает:
         None. Результат сохраняется в tasks.
     """
+    cancel = cancel_tokens.get(task_id) or CancelToken()
     try:
-        # Обновляем статус задачи
-        tasks[task_id] = {"status": "initializing", "progress": 10}
+        # Срок выполнения мог истечь, пока задача ждала в очереди
+        cancel.check()
 
-        # Инициализация конфигурации
-        config = ConfigManager()
+        # Обновляем статус задачи
+        started = time.monotonic()
+        tasks.update(
+            task_id,
+            status=TaskStatus.INITIALIZING,
+            progress=10,
+            started_at=datetime.now().isoformat(),
+        )
 
-        # Переопределяем параметры из запроса
-        config.prompt = prompt
-        config.width = width
-        config.height = height
-        config.style = style
-        config.negative_prompt = negative_prompt
+        # client_con тянет за собой requests, поэтому импортируется при первой
+        # генерации, а не при старте приложения
+        from client_con import FusionBrainAPI
 
-        # Проверяем конфигурацию
+        # Текущий снимок конфигурации; параметры генерации берутся из запроса
+        config = get_config()
         config.validate()
 
         # Обновляем статус
-        tasks[task_id]["status"] = "connecting"
-        tasks[task_id]["progress"] = 20
+        tasks.update(task_id, status=TaskStatus.CONNECTING, progress=20)
 
-        # Инициализация API
+        # Инициализация API с общим пулом ключей
         api = FusionBrainAPI(
-            "https://api-key.fusionbrain.ai/", config.api_key, config.secret_key
+            config.api_url,
+            key_pool=get_key_pool(config),
+            transport=get_transport(config),
         )
 
-        # Получение pipeline ID
-        tasks[task_id]["status"] = "getting_pipeline"
-        tasks[task_id]["progress"] = 30
-        pipeline_id = api.get_pipeline()
-
-        # Проверка доступности сервиса
-        tasks[task_id]["status"] = "checking_availability"
-        tasks[task_id]["progress"] = 40
-        availability = api.check_availability(pipeline_id)
-        if availability.get("pipeline_status") == "DISABLED_BY_QUEUE":
-            tasks[task_id]["status"] = "unavailable"
-            tasks[task_id][
-                "message"
-            ] = "Сервис временно недоступен из-за высокой нагрузки"
+        # Кандидаты в порядке ожидаемой скорости генерации
+        tasks.update(task_id, status=TaskStatus.GETTING_PIPELINE, progress=30)
+        refresh_pipelines(api)
+        candidates = pipeline_router.candidates(pipeline)
+
+        # Проверка доступности: занятый pipeline уступает следующему
+        tasks.update(task_id, status=TaskStatus.CHECKING_AVAILABILITY, progress=40)
+        pipeline_id = None
+        errors = []
+        for candidate in candidates:
+            try:
+                availability = api.check_availability(candidate)
+            except Exception as e:
+                # Ошибка проверки одного pipeline не мешает выбрать другой
+                errors.append(e)
+                continue
+            pipeline_router.record_availability(candidate, availability.pipeline_status)
+            if not is_disabled(availability.pipeline_status):
+                pipeline_id = candidate
+                break
+        if pipeline_id is None and candidates and len(errors) == len(candidates):
+            raise errors[-1]
+        if pipeline_id is None:
+            tasks.update(
+                task_id,
+                status=TaskStatus.UNAVAILABLE,
+                message="Сервис временно недоступен из-за высокой нагрузки",
+            )
+            finish_task(task_id)
             return
 
+        # Отменённая задача не должна расходовать генерацию FusionBrain
+        cancel.check()
+
         # Генерация изображения
-        tasks[task_id]["status"] = "generating"
-        tasks[task_id]["progress"] = 50
-        generation_uuid = api.generate(
-            config.prompt,
-            pipeline_id,
-            config.width,
-            config.height,
-            style=config.style,
-            negative_prompt=config.negative_prompt,
+        tasks.update(task_id, status=TaskStatus.GENERATING, progress=50)
+        attempt = pipeline_router.start(pipeline_id)
+        try:
+            generation_uuid = api.generate(
+                prompt,
+                pipeline_id,
+                width,
+                height,
+                style=style,
+                negative_prompt=negative_prompt,
+                images_num=images_num,
+            )
+        except Exception:
+            attempt.finish(False)
+            raise
+
+        # Запоминаем UUID сразу: после перезапуска генерацию можно продолжить
+        journal.checkpoint(
+            task_id,
+            "checking_generation",
+            generation_uuid,
+            api.key_for(generation_uuid),
         )
 
-        # Проверка статуса генерации
-        tasks[task_id]["status"] = "checking_generation"
-        tasks[task_id]["progress"] = 70
-        files = api.check_generation(generation_uuid)
-
-        # Проверка наличия файлов
-        if not files:
-            tasks[task_id]["status"] = "no_files"
-            tasks[task_id][
-                "message"
-            ] = "Изображения не получены. Проверьте журнал ошибок."
-            return
+        eta_estimator.record(PREPARE, time.monotonic() - started)
+        poll_and_save_images(task_id, api, generation_uuid, cancel, attempt)
+
+    except TaskCancelledError as e:
+        mark_cancelled(task_id, str(e))
+    except Exception as e:
+        tasks.update(task_id, status=TaskStatus.ERROR, message=str(e))
+        logger.error(f"Error in task {task_id}: {e}")
+        finish_task(task_id)
 
-        # Сохранение изображений
-        tasks[task_id]["status"] = "saving"
-        tasks[task_id]["progress"] = 90
 
-        # Создаем папку output, если она не существует
-        os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
+def poll_and_save_images(task_id, api, generation_uuid, cancel, attempt=None):
+    """
+    Дожидается завершения генерации FusionBrain и сохраняет изображения.
 
-        # Создаем подпапку для задачи
-        task_folder = os.path.join(app.config["UPLOAD_FOLDER"], task_id)
-        os.makedirs(task_folder, exist_ok=True)
+    Args:
+        task_id (str): Идентификатор задачи.
+        api (FusionBrainAPI): Клиент API.
+        generation_uuid (str): UUID генерации FusionBrain.
+        cancel (CancelToken): Флаг отмены задачи.
+        attempt (PipelineAttempt, optional): Генерация на pipeline, время и
+            исход которой учитывает маршрутизатор.
 
-        image_handler = ImageHandler()
-        image_paths = []
+    Возвращает:
+        None. Результат сохраняется в tasks.
 
-        for i, file_data in enumerate(files):
-            filename = f"generated_{int(time.time())}_{i + 1}.png"
-            save_path = os.path.join(task_folder, filename)
-            image_handler.save_image(file_data, save_path)
-            image_path = f"{task_id}/{filename}"
-            image_url = f"/image/{task_id}/{filename}"
-            logger.info(f"Image saved: path={image_path}, url={image_url}")
-            image_paths.append(
-                {
-                    "path": image_path,
-                    "url": f"/image/{task_id}/{filename}",
-                }
+    Raises:
+        TaskCancelledError: Если задача отменена до сохранения изображений.
+    """
+    # Проверка статуса генерации
+    tasks.update(
+        task_id,
+        status=TaskStatus.CHECKING_GENERATION,
+        progress=70,
+        polling_started_at=datetime.now().isoformat(),
+    )
+    polling = time.monotonic()
+    try:
+        files = api.check_generation(
+            generation_uuid,
+            cancel=cancel,
+            on_done=attempt.mark_done if attempt is not None else None,
+        )
+    except Exception as e:
+        if attempt is not None:
+            # Отмена клиентом ничего не говорит о скорости pipeline
+            attempt.finish(None if isinstance(e, TaskCancelledError) else False)
+        raise
+    done = time.monotonic()
+    if attempt is not None:
+        attempt.finish(bool(files))
+        # Продолженная после перезапуска генерация опрашивается не с начала,
+        # поэтому в оценку времени FusionBrain не попадает
+        if files:
+            eta_estimator.record(UPSTREAM, done - polling)
+
+    # Результат отменённой задачи никому не нужен: не скачиваем и не сохраняем
+    cancel.check()
+
+    # Проверка наличия файлов
+    if not files:
+        tasks.update(
+            task_id,
+            status=TaskStatus.NO_FILES,
+            message="Изображения не получены. Проверьте журнал ошибок.",
+        )
+        finish_task(task_id)
+        return
+
+    # Сохранение изображений
+    tasks.update(task_id, status=TaskStatus.SAVING, progress=90)
+    journal.checkpoint(task_id, "saving")
+
+    # Каталог задачи в шардированной раскладке ab/cd/<task_id>
+    task_dir = shard_dir(task_id)
+
+    from client_con import ImageHandler
+
+    # Имена уникальны в пределах задачи и не зависят от времени сохранения
+    filenames = [f"generated_{task_id[:8]}_{i + 1}.png" for i in range(len(files))]
+
+    # Изображения загружаются параллельно, не больше
+    # IMAGE_DOWNLOAD_CONCURRENCY одновременно
+    keys = [f"{task_dir}/{filename}" for filename in filenames]
+    saved = ImageHandler.save_images(
+        list(zip(files, keys)),
+        get_config().image_download_concurrency,
+        storage,
+        api.transport,
+    )
+
+    image_paths = []
+    for filename, key, (size, sha256) in zip(filenames, keys, saved):
+        image_index.add(task_id, filename, key, size, sha256)
+        image_path = f"{task_id}/{filename}"
+        image_url = f"/image/{task_id}/{filename}"
+        logger.info(f"Image saved: path={image_path}, url={image_url}")
+        image_paths.append(ImageRef(image_path, image_url))
+
+    # Задача завершена успешно
+    eta_estimator.record(SAVE, time.monotonic() - done)
+    tasks.update(
+        task_id,
+        status=TaskStatus.COMPLETED,
+        progress=100,
+        image_paths=tuple(image_paths),
+    )
+    finish_task(task_id)
+
+
+def finish_task(task_id):
+    """
+    Отмечает окончание задачи в любом итоговом статусе.
+
+    Удаляет задачу из журнала и, если клиент передал callback_url, ставит
+    уведомление в очередь доставки. Поток генерации при этом не ждёт сети.
+
+    Args:
+        task_id (str): Идентификатор задачи.
+    """
+    task = tasks.update(task_id, finished_at=datetime.now().isoformat())
+    journal.finish(task_id)
+    cancel_tokens.pop(task_id, None)
+    logger.info(f"Task {task_id} finished: {task.status.value}")
+
+    callback = callbacks.pop(task_id, None)
+    if callback:
+        payload = build_webhook_payload(task_id, callback["base_url"])
+        if callback.get("signed") and not callback.get("secret"):
+            # Задача восстановлена из журнала, а секрет в журнал не пишется:
+            # неподписанное уведомление клиент принял бы за подделку
+            webhooks.discard(
+                task_id,
+                callback["url"],
+                payload,
+                "Callback secret is not kept across restarts",
             )
+        else:
+            webhooks.enqueue(task_id, callback["url"], payload, callback.get("secret"))
+
 
-        # Задача завершена успешно
-        tasks[task_id]["status"] = "completed"
-        tasks[task_id]["progress"] = 100
-        tasks[task_id]["image_paths"] = image_paths
+def mark_cancelled(task_id, reason):
+    """
+    Переводит задачу в статус cancelled и завершает её.
+
+    Args:
+        task_id (str): Идентификатор задачи.
+        reason (str): Причина отмены для поля message.
+    """
+    tasks.update(task_id, status=TaskStatus.CANCELLED, message=reason)
+    logger.info(f"Task {task_id} cancelled: {reason}")
+    finish_task(task_id)
+
+
+def create_cancel_token(task_id, deadline_at=None):
+    """
+    Регистрирует флаг отмены задачи.
+
+    Args:
+        task_id (str): Идентификатор задачи.
+        deadline_at (str, optional): Срок выполнения (ISO 8601).
+
+    Возвращает:
+        CancelToken: Флаг отмены задачи.
+    """
+    deadline = None
+    if deadline_at:
+        deadline = datetime.fromisoformat(deadline_at).timestamp()
+    token = cancel_tokens[task_id] = CancelToken(deadline)
+    return token
+
+
+def task_eta(task):
+    """
+    Оценивает время завершения незавершённой задачи.
+
+    Учитывает место в очереди, пропускную способность пула генераций и
+    накопленное время этапов (см. EtaEstimator).
+
+    Args:
+        task (Task): Снимок задачи.
+
+    Возвращает:
+        dict | None: eta_at (ISO 8601), remaining_seconds, progress - прогресс
+        по времени (0-99) и next_check_after - через сколько секунд
+        опросить статус снова; None для завершённой задачи.
+    """
+    if task.status.is_final:
+        return None
+    now = datetime.now()
+    position = scheduler.queue_position(task.task_id)
+    elapsed = upstream_elapsed = 0.0
+    if task.started_at:
+        elapsed = (now - datetime.fromisoformat(task.started_at)).total_seconds()
+    if task.polling_started_at:
+        upstream_elapsed = (
+            now - datetime.fromisoformat(task.polling_started_at)
+        ).total_seconds()
+    remaining = eta_estimator.remaining(
+        queued=position is not None,
+        position=position or 0,
+        running=scheduler.running_count(),
+        elapsed=elapsed,
+        upstream_elapsed=upstream_elapsed if task.polling_started_at else None,
+        saving=task.status == TaskStatus.SAVING,
+    )
+    age = (now - datetime.fromisoformat(task.created_at)).total_seconds()
+    return {
+        "eta_at": (now + timedelta(seconds=remaining)).isoformat(timespec="seconds"),
+        "remaining_seconds": round(remaining, 1),
+        "progress": time_progress(age, remaining),
+        "next_check_after": eta_estimator.next_check(remaining),
+    }
 
+
+def build_webhook_payload(task_id, base_url):
+    """
+    Собирает итоговую запись задачи для уведомления на callback_url.
+
+    Args:
+        task_id (str): Идентификатор задачи.
+        base_url (str): Адрес сервера, к которому обращался клиент.
+
+    Возвращает:
+        dict: Статус, абсолютные ссылки на изображения и времена этапов.
+    """
+    task = tasks.get(task_id)
+    payload = {
+        "task_id": task_id,
+        "status": task.status.value,
+        "message": task.message,
+        "images": [
+            {
+                "url": urljoin(base_url, img.url),
+                "download_url": urljoin(base_url, "/download/" + img.path),
+            }
+            for img in task.image_paths
+        ],
+        "created_at": task.created_at,
+        "started_at": task.started_at,
+        "finished_at": task.finished_at,
+    }
+    if task.finished_at:
+        payload["duration_seconds"] = round(
+            (
+                datetime.fromisoformat(task.finished_at)
+                - datetime.fromisoformat(task.created_at)
+            ).total_seconds(),
+            3,
+        )
+    return payload
+
+
+def resume_image_task(task_id, generation_uuid, key_id=None):
+    """
+    Продолжает генерацию, начатую до перезапуска процесса.
+
+    Повторно не вызывает FusionBrainAPI.generate, а возобновляет опрос
+    статуса по сохранённому UUID и сохраняет результат.
+
+    Args:
+        task_id (str): Идентификатор задачи.
+        generation_uuid (str): UUID генерации FusionBrain из журнала.
+        key_id (str, optional): Ключ API, которым генерация была создана.
+
+    Возвращает:
+        None. Результат сохраняется в tasks.
+    """
+    cancel = cancel_tokens.get(task_id) or CancelToken()
+    try:
+        from client_con import FusionBrainAPI
+
+        cancel.check()
+        tasks.update(task_id, started_at=datetime.now().isoformat())
+        config = get_config()
+        config.validate()
+        api = FusionBrainAPI(
+            config.api_url,
+            key_pool=get_key_pool(config),
+            transport=get_transport(config),
+        )
+        # Статус опрашивается тем же ключом, которым создана генерация
+        api.bind_job(generation_uuid, key_id)
+        poll_and_save_images(task_id, api, generation_uuid, cancel)
+    except TaskCancelledError as e:
+        mark_cancelled(task_id, str(e))
     except Exception as e:
-        tasks[task_id]["status"] = "error"
-        tasks[task_id]["message"] = str(e)
-        logger.error(f"Error in task {task_id}: {e}")
+        tasks.update(task_id, status=TaskStatus.ERROR, message=str(e))
+        logger.error(f"Error in resumed task {task_id}: {e}")
+        finish_task(task_id)
+
+
+def recover_tasks():
+    """
+    Восстанавливает незавершённые задачи из журнала после перезапуска.
+
+    Забираются задачи, аренда которых истекла (см. TaskJournal). Задачи с
+    известным UUID генерации продолжают опрос статуса FusionBrain, задачи,
+    не успевшие дойти до генерации, запускаются заново.
+    """
+    try:
+        claimed = journal.claim_unfinished()
+    except Exception as e:
+        logger.error(f"Failed to read task journal: {e}")
+        return
+
+    for record in claimed:
+        task_id = record["task_id"]
+        params = record["params"]
+        callback = params.pop("callback", None)
+        if callback:
+            callbacks[task_id] = callback
+        cancel = create_cancel_token(task_id, params.get("deadline_at"))
+        tasks.add(
+            Task(
+                task_id=task_id,
+                params=msgspec.convert(params, TaskParams),
+                created_at=record["created_at"],
+                status=TaskStatus.QUEUED,
+                progress=0,
+                version=0,
+                recovered=True,
+            ),
+            owner=params.get("client_id"),
+        )
+
+        if record["generation_uuid"]:
+            logger.info(
+                f"Resuming task {task_id} from stage {record['stage']}, "
+                f"UUID {record['generation_uuid']}"
+            )
+            target = resume_image_task
+            args = (task_id, record["generation_uuid"], record["key_id"])
+        else:
+            logger.info(f"Restarting task {task_id} from stage {record['stage']}")
+            target = generate_image_task
+            args = (
+                task_id,
+                params["prompt"],
+                params["width"],
+                params["height"],
+                params["style"],
+                params["negative_prompt"],
+                params.get("images_num", 1),
+                params.get("pipeline"),
+            )
+
+        scheduler.submit(
+            task_id,
+            params.get("client_id", "recovered"),
+            params.get("priority", INTERACTIVE),
+            target,
+            args,
+            deadline=cancel.deadline,
+        )
+
+    if claimed:
+        logger.info(f"Recovered {len(claimed)} unfinished tasks")
+
+
+def refresh_pipelines(api):
+    """
+    Обновляет список pipeline маршрутизатора, если он устарел.
+
+    Список запрашивается не чаще раза в PIPELINE_REFRESH_SECONDS; пока один
+    поток его загружает, остальные выбирают по старому списку. Если списка
+    ещё нет, они ждут первой загрузки, а если она не удалась - запрашивают
+    список сами, чтобы задача не завершилась из-за чужого обновления.
+
+    Args:
+        api (FusionBrainAPI): Клиент API.
+    """
+    if pipeline_router.claim_refresh():
+        try:
+            pipelines = api.list_pipelines()
+        except Exception:
+            # Ожидающие потоки и следующая задача повторят загрузку
+            pipeline_router.invalidate()
+            raise
+    elif pipeline_router.wait_pipelines():
+        return
+    else:
+        pipelines = api.list_pipelines()
+    pipeline_router.update_pipelines(
+        [msgspec.structs.asdict(pipeline) for pipeline in pipelines]
+    )
+
+
+def get_key_pool(config):
+    """
+    Возвращает общий пул ключей FusionBrain, создавая его при первом вызове.
+
+    Пул пересоздаётся, если после перезагрузки конфигурации изменился набор
+    ключей. Генерации, уже привязанные к ключу старого пула, дорабатывают
+    с ним.
+
+    Args:
+        config (AppConfig): Проверенный снимок конфигурации с ключами.
+
+    Возвращает:
+        KeyPool: Пул ключей процесса.
+    """
+    from client_con import KeyPool
+
+    global key_pool, _key_pool_credentials
+    credentials = config.credentials
+    if not credentials and config.fusionbrain_transport == "replay":
+        # При воспроизведении кассеты ключи в сеть не уходят
+        credentials = (("replay", "replay"),)
+    with _key_pool_lock:
+        if key_pool is None or _key_pool_credentials != credentials:
+            _key_pool_credentials = credentials
+            key_pool = KeyPool(credentials, config.key_eject_seconds)
+            logger.info(f"Key pool initialized with {len(credentials)} keys")
+        return key_pool
+
+
+def get_transport(config):
+    """
+    Возвращает общий транспорт запросов к FusionBrain.
+
+    Транспорт создаётся при первом вызове и не меняется до перезапуска.
+
+    Args:
+        config (AppConfig): Снимок конфигурации.
+
+    Возвращает:
+        HttpTransport | RecordingTransport | ReplayTransport: Транспорт
+        процесса (см. FUSIONBRAIN_TRANSPORT).
+    """
+    from transport import create_transport
+
+    global transport
+    with _transport_lock:
+        if transport is None:
+            transport = create_transport(config)
+        return transport
+
+
+CallbackUrl = Annotated[str, msgspec.Meta(pattern=r"^https?://[^/\s]+")]
+
+
+class GenerateRequest(msgspec.Struct, forbid_unknown_fields=False):
+    """Параметры запроса /generate."""
+
+    prompt: Annotated[str, msgspec.Meta(min_length=1, max_length=1000)]
+    width: Annotated[int, msgspec.Meta(ge=64, le=2048)] = 512
+    height: Annotated[int, msgspec.Meta(ge=64, le=2048)] = 512
+    style: str | None = None
+    negative_prompt: str | None = None
+    images_num: Annotated[int, msgspec.Meta(ge=1, le=4)] = 1
+    priority: Literal["interactive", "batch"] | None = None
+    callback_url: CallbackUrl | None = None
+    callback_secret: str | None = None
+    # Идентификатор pipeline или "auto" - самый быстрый доступный
+    pipeline: Annotated[str, msgspec.Meta(min_length=1, max_length=64)] | None = None
+    # Срок выполнения в секундах от создания задачи
+    deadline: Annotated[float, msgspec.Meta(gt=0, le=86400)] | None = None
 
 
-@app.route("/")
+class TaskVersionQuery(msgspec.Struct):
+    """Задача в запросе /tasks/status с версией, известной клиенту."""
+
+    task_id: str
+    since_version: int = 0
+
+
+# Максимальное число задач в одном запросе /tasks/status
+MAX_BULK_STATUS_TASKS = 1000
+
+
+class BulkStatusRequest(msgspec.Struct):
+    """
+    Тело запроса /tasks/status.
+
+    Элемент tasks - идентификатор задачи или объект с task_id и
+    since_version. since_version верхнего уровня применяется к задачам без
+    собственной версии.
+    """
+
+    tasks: Annotated[
+        list[str | TaskVersionQuery], msgspec.Meta(max_length=MAX_BULK_STATUS_TASKS)
+    ]
+    since_version: int = 0
+
+
+class TaskListQuery(msgspec.Struct):
+    """Параметры запроса GET /tasks и GET /debug/tasks."""
+
+    status: TaskStatus | None = None
+    # Только для /debug/tasks: задачи этого клиента
+    client_id: str | None = None
+    since: datetime | None = None
+    cursor: str | None = None
+    limit: Annotated[int, msgspec.Meta(ge=1, le=200)] = 50
+
+
+def encode_cursor(task):
+    """Кодирует ключ (created_at, task_id) задачи в непрозрачный курсор."""
+    raw = msgspec.json.encode((task.created_at, task.task_id))
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Декодирует курсор, выданный encode_cursor.
+
+    Raises:
+        msgspec.ValidationError: Если курсор повреждён.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        return msgspec.json.decode(raw, type=tuple[str, str])
+    except (ValueError, msgspec.DecodeError):
+        raise msgspec.ValidationError("Invalid cursor - at `$.cursor`")
+
+
+_generate_decoder = msgspec.json.Decoder(GenerateRequest)
+_bulk_status_decoder = msgspec.json.Decoder(BulkStatusRequest)
+_json_encoder = msgspec.json.Encoder()
+
+
+def parse_generate_request():
+    """
+    Разбирает параметры /generate из JSON-тела или данных формы.
+
+    Возвращает:
+        GenerateRequest: Проверенные параметры.
+
+    Raises:
+        msgspec.DecodeError: Если тело не JSON или параметры некорректны
+            (msgspec.ValidationError).
+    """
+    if request.is_json:
+        return _generate_decoder.decode(request.get_data())
+    # Пустое поле формы означает, что параметр не задан
+    form = {key: value for key, value in request.form.items() if value != ""}
+    return msgspec.convert(form, GenerateRequest, strict=False)
+
+
+def validation_error_response(error):
+    """
+    Формирует ответ 400 с описанием ошибки проверки параметров.
+
+    Args:
+        error (msgspec.DecodeError): Ошибка msgspec вида
+            "Expected `int`, got `str` - at `$.width`".
+
+    Возвращает:
+        Response: JSON с полями error, field и message.
+    """
+    message, _, path = str(error).partition(" - at ")
+    field = path.strip("`").removeprefix("$.") or None
+    if field is None and "missing required field" in message:
+        field = message.rpartition(" ")[2].strip("`")
+    return json_response(
+        {
+            "success": False,
+            "error": "validation_error",
+            "field": field,
+            "message": message,
+        },
+        400,
+    )
+
+
+def json_response(data, status=200):
+    """
+    Кодирует ответ через msgspec.
+
+    Снимки задач (msgspec.Struct) сериализуются напрямую, без промежуточных
+    словарей.
+    """
+    return current_app.response_class(
+        _json_encoder.encode(data), status=status, mimetype="application/json"
+    )
+
+
+def get_client_id(create_session=False):
+    """
+    Определяет клиента для справедливой очереди и владельца задач.
+
+    Приоритет: API-токен из заголовка X-API-Token или Authorization,
+    затем идентификатор из сессии браузера, затем IP-адрес. Принимаются
+    только токены из API_TOKENS: иначе каждый новый произвольный токен
+    давал бы новую очередь клиента. С неизвестным токеном запрос
+    завершается 401.
+
+    Сессия создаётся только по create_session, то есть для маршрутов
+    браузера: иначе каждый анонимный API-запрос заводил бы серверную сессию,
+    вытесняя сессии браузеров, и получал бы новую очередь.
+
+    Args:
+        create_session (bool): Выдать клиенту без сессии её идентификатор.
+
+    Возвращает:
+        tuple: (client_id, is_browser) - is_browser истинно для клиента с
+        сессией браузера.
+    """
+    token = request.headers.get("X-API-Token") or request.headers.get(
+        "Authorization", ""
+    ).removeprefix("Bearer ")
+    if token:
+        if not any(
+            hmac.compare_digest(token.encode(), known.encode())
+            for known in get_config().api_tokens
+        ):
+            abort(json_response({"success": False, "error": "Unknown API token"}, 401))
+        return f"token:{hashlib.sha256(token.encode()).hexdigest()[:16]}", False
+
+    if "client_id" in session:
+        return f"session:{session['client_id']}", True
+
+    # Первый запрос браузера учитываем по IP и выдаём идентификатор
+    # для следующих запросов; API-клиенты без cookie остаются по IP
+    if create_session:
+        session["client_id"] = uuid.uuid4().hex
+    return f"ip:{request.remote_addr}", False
+
+
+@bp.route("/")
 def index():
     """Главная страница приложения"""
+    # Идентификатор выдаётся сразу: задачи, созданные со страницы, с первой
+    # же генерации принадлежат сессии браузера, а не его IP-адресу
+    get_client_id(create_session=True)
     return render_template("index.html")
 
 
-@app.route("/generate", methods=["POST"])
+@bp.route("/generate", methods=["POST"])
 def generate():
     """
     Запускает задачу генерации изображения.
@@ -280,49 +1170,152 @@ def generate():
         request: POST-запрос с данными формы.
 
     Возвращает:
-        JSON: Статус задачи и task_id.
+        JSON: Статус задачи, task_id, место в очереди и оценка завершения.
     """
+    if shutdown_event.is_set():
+        response = jsonify(
+            {"success": False, "error": "Сервер перезапускается, повторите позже"}
+        )
+        response.headers["Retry-After"] = "30"
+        return response, 503
+
+    # Приоритет определяет сервер: interactive доступен только сессиям
+    # браузера, API-клиенты и клиенты без cookie всегда идут в batch.
+    # Сессию выдаёт только отправка формы со страницы, но не JSON API
+    client_id, is_browser = get_client_id(create_session=bool(request.form))
+
     try:
-        # Получаем параметры из формы
-        prompt = request.form["prompt"]
-        width = int(request.form.get("width", 512))
-        height = int(request.form.get("height", 512))
-        style = request.form.get("style") or None
-        negative_prompt = request.form.get("negative_prompt") or None
+        # Получаем и проверяем параметры из формы или JSON
+        try:
+            params = parse_generate_request()
+        except msgspec.DecodeError as e:
+            return validation_error_response(e)
+
+        prompt = params.prompt
+        width = params.width
+        height = params.height
+        style = params.style
+        negative_prompt = params.negative_prompt
+        images_num = params.images_num
+        priority = (params.priority or INTERACTIVE) if is_browser else BATCH
+
+        # Необязательный адрес для уведомления о завершении задачи
+        callback = None
+        if params.callback_url:
+            # Уведомления не должны уходить во внутреннюю сеть сервера
+            try:
+                check_callback_url(params.callback_url)
+            except (ValueError, OSError) as e:
+                return json_response(
+                    {
+                        "success": False,
+                        "error": "validation_error",
+                        "field": "callback_url",
+                        "message": str(e),
+                    },
+                    400,
+                )
+            callback = {
+                "url": params.callback_url,
+                "secret": params.callback_secret,
+                "base_url": request.host_url,
+            }
 
         # Создаем уникальный идентификатор задачи
         task_id = str(uuid.uuid4())
+        created_at = datetime.now()
+        deadline_at = None
+        if params.deadline:
+            deadline_at = (created_at + timedelta(seconds=params.deadline)).isoformat()
 
         # Инициализируем информацию о задаче
-        tasks[task_id] = {
-            "status": "created",
-            "progress": 0,
-            "created_at": datetime.now().isoformat(),
-            "params": {
-                "prompt": prompt,
-                "width": width,
-                "height": height,
-                "style": style,
-                "negative_prompt": negative_prompt,
-            },
-        }
+        task = tasks.add(
+            Task(
+                task_id=task_id,
+                params=TaskParams(
+                    prompt=prompt,
+                    width=width,
+                    height=height,
+                    style=style,
+                    negative_prompt=negative_prompt,
+                    images_num=images_num,
+                    priority=priority,
+                    pipeline=params.pipeline,
+                    deadline_at=deadline_at,
+                ),
+                created_at=created_at.isoformat(),
+                status=TaskStatus.QUEUED,
+                progress=0,
+                version=0,
+            ),
+            owner=client_id,
+        )
+
+        # Callback хранится отдельно от задачи: секрет не отдаётся в /task/<id>
+        if callback:
+            callbacks[task_id] = callback
+        cancel = create_cancel_token(task_id, deadline_at)
+
+        # Журнал пишется до постановки в очередь: поток генерации может взять
+        # задачу сразу, и его контрольные точки должны найти запись в журнале
+        journal_params = msgspec.structs.asdict(task.params)
+        journal_params["client_id"] = client_id
+        if callback:
+            # Секрет клиента хранится только в памяти процесса
+            journal_params["callback"] = {
+                "url": callback["url"],
+                "base_url": callback["base_url"],
+                "signed": bool(callback["secret"]),
+            }
+        journal.create(task_id, journal_params, task.created_at)
+
+        # Ставим задачу в очередь планировщика
+        position = scheduler.submit(
+            task_id,
+            client_id,
+            priority,
+            generate_image_task,
+            (
+                task_id,
+                prompt,
+                width,
+                height,
+                style,
+                negative_prompt,
+                images_num,
+                params.pipeline,
+            ),
+            deadline=cancel.deadline,
+        )
 
-        # Запускаем задачу в отдельном потоке
-        thread = Thread(
-            target=generate_image_task,
-            args=(task_id, prompt, width, height, style, negative_prompt),
+        return json_response(
+            {
+                "success": True,
+                "task_id": task_id,
+                "queue_position": position,
+                "eta": task_eta(task),
+            }
         )
-        thread.daemon = True
-        thread.start()
 
-        return jsonify({"success": True, "task_id": task_id})
+    except QueueFullError as e:
+        tasks.pop(task_id, None)
+        callbacks.pop(task_id, None)
+        cancel_tokens.pop(task_id, None)
+        journal.finish(task_id)
+        response = jsonify({"success": False, "error": str(e)})
+        response.headers["Retry-After"] = "60"
+        return response, 429
 
     except Exception as e:
         logger.error(f"Error starting generation task: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
 
-@app.route("/task/<task_id>", methods=["GET"])
+# Точность (в секундах), с которой время завершения входит в ETag статуса
+ETA_ETAG_SECONDS = 10
+
+
+@bp.route("/task/<task_id>", methods=["GET"])
 def task_status(task_id):
     """
     Возвращает статус текущей задачи.
@@ -331,28 +1324,264 @@ def task_status(task_id):
         task_id (str): Идентификатор задачи.
 
     Возвращает:
-        JSON: Статус задачи и связанные данные.
+        JSON: Статус задачи, связанные данные и оценка завершения (eta).
     """
-    if task_id not in tasks:
-        return jsonify({"success": False, "error": "Task not found"}), 404
+    # Задача с истёкшим в очереди сроком сразу показывается отменённой
+    scheduler.expire_overdue()
+    # Снимок задачи неизменяем, поэтому читается без блокировок, а его JSON
+    # кодируется один раз на версию
+    found = tasks.get_encoded(task_id)
+    if found is None:
+        return json_response({"success": False, "error": "Task not found"}, 404)
+    task, task_json = found
+
+    eta = task_eta(task)
+    response = current_app.response_class(
+        b'{"success":true,"task":'
+        + task_json
+        + b',"eta":'
+        + _json_encoder.encode(eta)
+        + b"}",
+        mimetype="application/json",
+    )
+    if eta is None:
+        response.set_etag(f"{task.version}")
+    else:
+        # Оставшееся время и прогресс меняются с каждой секундой, поэтому в
+        # ETag входит только время завершения с точностью до ETA_ETAG_SECONDS:
+        # пока оценка не сдвинулась, опрос получает 304. Свежие значения
+        # передаются в заголовках, которые браузер обновляет и при 304.
+        eta_at = datetime.fromisoformat(eta["eta_at"]).timestamp()
+        response.set_etag(
+            f"{task.version}-{int(eta_at // ETA_ETAG_SECONDS)}", weak=True
+        )
+        response.headers["X-Remaining-Seconds"] = str(eta["remaining_seconds"])
+        response.headers["X-Progress"] = str(eta["progress"])
+        response.headers["X-Next-Check-After"] = str(eta["next_check_after"])
+    # Браузер хранит ответ, но перепроверяет его при каждом опросе
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
-    task_data = tasks[task_id]
-    if "image_paths" in task_data:
-        for img in task_data["image_paths"]:
-            original_path = img["path"]
-            img["path"] = img["path"].replace("\\", "/")
-            logger.info(
-                f"Task {task_id} image path: original={original_path}, normalized={img['path']}"
-            )
-    # Логируем только завершение или ошибки
-    if task_data.get("status") in ["completed", "error"]:
-        logger.info(
-            f"Task {task_id} status: {task_data['status']}, progress: {task_data['progress']}"
+
+@bp.route("/task/<task_id>", methods=["DELETE"])
+def cancel_task(task_id):
+    """
+    Отменяет задачу.
+
+    Задача из очереди снимается сразу. У выполняемой задачи прерывается опрос
+    FusionBrain, изображения не скачиваются, а поток генерации освобождается;
+    статус cancelled появляется, когда поток заметит отмену. Отменить можно
+    только свою задачу: для чужой ответ такой же, как для несуществующей.
+
+    Args:
+        task_id (str): Идентификатор задачи.
+
+    Возвращает:
+        JSON: Снимок задачи; 202, если отмена ещё выполняется, 404 для
+        чужой или неизвестной задачи, 409, если задача уже завершена.
+    """
+    task = tasks.get(task_id)
+    if task is None or tasks.owner(task_id) != get_client_id()[0]:
+        return json_response({"success": False, "error": "Task not found"}, 404)
+    if task.status.is_final:
+        return json_response(
+            {"success": False, "error": "Task already finished", "task": task}, 409
         )
-    return jsonify({"success": True, "task": task_data})
+
+    if scheduler.cancel(task_id):
+        mark_cancelled(task_id, "Задача отменена")
+        return json_response({"success": True, "task": tasks.get(task_id)})
+
+    token = cancel_tokens.get(task_id)
+    if token is not None:
+        token.cancel()
+    logger.info(f"Cancellation requested for task {task_id}")
+    return json_response({"success": True, "task": tasks.get(task_id)}, 202)
+
+
+def task_list_response(owner=None, with_owners=False):
+    """
+    Отвечает страницей задач по параметрам запроса от новых к старым.
+
+    Параметры запроса: status - фильтр по статусу, since - только задачи,
+    созданные не раньше указанного времени (ISO 8601), limit - размер
+    страницы (до 200), cursor - значение next_cursor из предыдущего ответа.
+
+    Args:
+        owner (str, optional): Только задачи этого клиента.
+        with_owners (bool): Добавить в ответ владельцев задач.
+
+    Возвращает:
+        Response: Задачи страницы и next_cursor (null на последней
+        странице); 400 при неверных параметрах.
+    """
+    try:
+        query = msgspec.convert(request.args.to_dict(), TaskListQuery, strict=False)
+        before = decode_cursor(query.cursor) if query.cursor else None
+    except msgspec.DecodeError as e:
+        return validation_error_response(e)
+
+    since = query.since
+    if since is not None:
+        # created_at задач хранится в локальном времени без часового пояса
+        if since.tzinfo is not None:
+            since = since.astimezone().replace(tzinfo=None)
+        since = since.isoformat()
+
+    page, has_more = tasks.query(
+        status=query.status,
+        since=since,
+        before=before,
+        limit=query.limit,
+        owner=owner if owner is not None else query.client_id,
+    )
+    result = {
+        "success": True,
+        "tasks": page,
+        "next_cursor": encode_cursor(page[-1]) if has_more else None,
+    }
+    if with_owners:
+        result["owners"] = {task.task_id: tasks.owner(task.task_id) for task in page}
+    return json_response(result)
+
+
+@bp.route("/tasks", methods=["GET"])
+def list_tasks():
+    """
+    Возвращает задачи клиента от новых к старым с постраничной выдачей по
+    курсору (параметры см. task_list_response).
+
+    Возвращает:
+        JSON: Задачи страницы и next_cursor (null на последней странице);
+        400 при неверных параметрах.
+    """
+    client_id, _ = get_client_id()
+    return task_list_response(owner=client_id)
+
+
+@bp.route("/debug/tasks", methods=["GET"])
+def debug_list_tasks():
+    """
+    Возвращает задачи всех клиентов, например зависшие в одном статусе.
+
+    Доступен только с X-Debug-Token. Параметры те же, что у /tasks, и
+    client_id - только задачи этого клиента.
+
+    Возвращает:
+        JSON: Задачи страницы, их владельцы (owners) и next_cursor.
+    """
+    require_debug_token()
+    return task_list_response(with_owners=True)
+
+
+@bp.route("/tasks/status", methods=["POST"])
+def bulk_task_status():
+    """
+    Возвращает состояние многих задач одним запросом.
+
+    Тело: {"tasks": ["<id>", {"task_id": "<id>", "since_version": 5}],
+    "since_version": 0}. В ответ попадают только задачи, версия которых
+    больше известной клиенту; неизвестные идентификаторы перечисляются в
+    missing. Версия хранилища в ответе подходит как since_version для
+    следующего опроса.
+
+    Возвращает:
+        JSON: version, изменившиеся задачи и отсутствующие идентификаторы.
+    """
+    try:
+        query = _bulk_status_decoder.decode(request.get_data())
+    except msgspec.DecodeError as e:
+        return validation_error_response(e)
+
+    scheduler.expire_overdue()
+    # Версию хранилища читаем до задач: изменения, случившиеся во время
+    # ответа, клиент увидит при следующем опросе
+    version = tasks.version
+    changed = []
+    missing = []
+    for item in query.tasks:
+        if isinstance(item, str):
+            task_id, since_version = item, query.since_version
+        else:
+            task_id, since_version = item.task_id, item.since_version
+        task = tasks.get(task_id)
+        if task is None:
+            missing.append(task_id)
+        elif task.version > since_version:
+            changed.append(task)
+
+    return json_response(
+        {"success": True, "version": version, "tasks": changed, "missing": missing}
+    )
+
+
+@bp.route("/metrics")
+def metrics():
+    """
+    Возвращает метрики загрузки: очередь планировщика, счётчики ключей API,
+    состояние pipeline, оценки длительности этапов, доставки уведомлений и
+    число задач по статусам.
+
+    Возвращает:
+        JSON: Статистика планировщика и пула ключей.
+    """
+    return jsonify(
+        {
+            "scheduler": scheduler.stats(),
+            "keys": key_pool.stats() if key_pool is not None else [],
+            "pipelines": pipeline_router.stats(),
+            "eta": eta_estimator.stats(),
+            "webhooks": webhooks.stats(),
+            "tasks": tasks.count_by_status(),
+        }
+    )
+
+
+def live_objects():
+    """
+    Возвращает число и объём живых объектов приложения для /debug/memory.
+
+    Объём задач оценивается по размеру их JSON-представления.
+
+    Возвращает:
+        dict: Задачи, callback-параметры, ожидающие уведомления и сессии.
+    """
+    task_list = tasks.all()
+    objects = {
+        "tasks": {
+            "count": len(task_list),
+            "json_bytes": sum(len(_json_encoder.encode(task)) for task in task_list),
+        },
+        "callbacks": len(callbacks),
+        "webhooks_pending": webhooks.stats()["pending"],
+    }
+    store = getattr(current_app.session_interface, "store", None)
+    if store is not None:
+        objects["sessions"] = {"backend": get_config().session_backend}
+        objects["sessions"]["count"] = store.count()
+        if os.path.exists(getattr(store, "path", "")):
+            objects["sessions"]["file_bytes"] = os.path.getsize(store.path)
+    return objects
+
+
+def find_image(task_id, filename):
+    """
+    Находит изображение задачи в хранилище.
+
+    Возвращает:
+        tuple: (ключ в хранилище, ETag). Для общего хранилища (S3) ключ
+        изображения, сохранённого другим узлом, вычисляется из task_id и
+        имени файла. Если изображения нет, запрос завершается 404.
+    """
+    record = image_index.get(task_id, filename)
+    if record is not None:
+        return record.relpath, record.sha256
+    if not storage.shared:
+        abort(404)
+    return f"{shard_dir(task_id)}/{filename}", None
 
 
-@app.route("/image/<task_id>/<filename>")
+@bp.route("/image/<task_id>/<filename>")
 def serve_image(task_id, filename):
     """
     Отправляет сгенерированное изображение по указанному пути.
@@ -362,63 +1591,212 @@ def serve_image(task_id, filename):
         filename (str): Имя файла изображения.
 
     Возвращает:
-         Отправляет файл изображения.
-     """
-     task_folder = os.path.join(app.config["UPLOAD_FOLDER"], task_id)
-     return send_from_directory(task_folder, filename)
+        Файл изображения, редирект на подписанную ссылку (хранилище S3)
+        или 404, если изображения нет.
+    """
+    key, etag = find_image(task_id, filename)
+    return storage.send(key, etag=etag)
 
 
-@app.route("/download/<task_id>/<filename>")
+@bp.route("/download/<task_id>/<filename>")
 def download_image(task_id, filename):
     """
-     Обрабатывает запрос на скачивание сгенерированного изображения.
+    Обрабатывает запрос на скачивание сгенерированного изображения.
+
+    Args:
+        task_id (str): Идентификатор задачи.
+        filename (str): Имя файла изображения.
+
+    Возвращает:
+        Файл как аттачмент, редирект на подписанную ссылку (хранилище S3)
+        или 404, если изображения нет.
+    """
+    key, etag = find_image(task_id, filename)
+    return storage.send(key, etag=etag, download_name=secure_filename(filename))
+
 
-     Args:
-         task_id (str): Идентификатор задачи.
-         filename (str): Имя файла изображения.
+def archive_entries(task_id, prefix=""):
+    """
+    Перечисляет изображения задачи для ZIP-архива.
 
-     Возвращает:
-         Отправляет файл как аттачмент.
-     """
-     task_folder = os.path.join(app.config["UPLOAD_FOLDER"], task_id)
-     return send_from_directory(
-         task_folder,
-         filename,
-         as_attachment=True,
-         download_name=secure_filename(filename),
-     )
+    Args:
+        task_id (str): Идентификатор задачи.
+        prefix (str): Префикс имён файлов в архиве.
 
+    Возвращает:
+        list: Тройки (имя в архиве, ключ в хранилище, время создания). Для
+        общего хранилища (S3) изображения, которых нет в индексе этого узла,
+        берутся из image_paths задачи.
+    """
+    records = image_index.list_task(task_id)
+    if records:
+        return [
+            (prefix + record.filename, record.relpath, record.created_at)
+            for record in records
+        ]
+    task = tasks.get(task_id)
+    if not storage.shared or task is None:
+        return []
+    return [
+        (prefix + filename, f"{shard_dir(task_id)}/{filename}", None)
+        for filename in (image.path.rpartition("/")[2] for image in task.image_paths)
+    ]
+
+
+def zip_response(entries, download_name):
+    """
+    Возвращает потоковый ответ с ZIP-архивом изображений.
 
-@app.route("/styles")
+    Длина архива заранее не известна, поэтому ответ отдаётся по частям
+    (chunked); буферизация в прокси отключается заголовком X-Accel-Buffering.
+
+    Возвращает:
+        Response: Архив как аттачмент.
+    """
+    return Response(
+        stream_zip(storage, entries),
+        mimetype="application/zip",
+        headers={
+            "Content-Disposition": f'attachment; filename="{download_name}"',
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
+@bp.route("/download/<task_id>.zip")
+def download_task_zip(task_id):
+    """
+    Отдаёт все изображения задачи одним ZIP-архивом.
+
+    Args:
+        task_id (str): Идентификатор задачи.
+
+    Возвращает:
+        ZIP-архив, формируемый по мере отправки, или 404, если у задачи
+        нет изображений.
+    """
+    entries = archive_entries(task_id)
+    if not entries:
+        abort(404)
+    logger.info(f"Streaming ZIP of {len(entries)} images for task {task_id}")
+    return zip_response(entries, f"{secure_filename(task_id) or 'images'}.zip")
+
+
+@bp.route("/download/batch.zip")
+def download_batch_zip():
+    """
+    Отдаёт изображения нескольких задач одним ZIP-архивом.
+
+    Задачи передаются параметрами task_id (не больше
+    MAX_BULK_STATUS_TASKS); изображения каждой задачи лежат в архиве в
+    папке с её идентификатором. Задачи без изображений пропускаются.
+
+    Возвращает:
+        ZIP-архив, 400 при неверном списке задач или 404, если изображений
+        нет ни у одной задачи.
+    """
+    task_ids = list(dict.fromkeys(request.args.getlist("task_id")))
+    if not task_ids:
+        return jsonify({"success": False, "error": "Не указаны задачи"}), 400
+    if len(task_ids) > MAX_BULK_STATUS_TASKS:
+        return (
+            jsonify(
+                {
+                    "success": False,
+                    "error": f"Не больше {MAX_BULK_STATUS_TASKS} задач за запрос",
+                }
+            ),
+            400,
+        )
+    entries = []
+    for task_id in task_ids:
+        entries.extend(archive_entries(task_id, prefix=f"{secure_filename(task_id)}/"))
+    if not entries:
+        abort(404)
+    logger.info(f"Streaming ZIP of {len(entries)} images for {len(task_ids)} tasks")
+    return zip_response(entries, "images.zip")
+
+
+@bp.route("/styles")
 def get_styles():
-     """
-     Возвращает список доступных стилей генерации изображений.
-
-     Возвращает:
-         JSON: Список стилей с идентификаторами и названиями.
-     """
-     styles = [
-         {"id": "DEFAULT", "name": "По умолчанию"},
-         {"id": "ANIME", "name": "Аниме"},
-         {"id": "PORTRAIT", "name": "Портрет"},
-         {"id": "REALISTIC", "name": "Реалистичный"},
-         {"id": "UHD", "name": "Ультра HD"},
-     ]
-     return jsonify(styles)
+    """
+    Возвращает список доступных стилей генерации изображений.
+
+    Возвращает:
+        JSON: Список стилей с идентификаторами и названиями.
+    """
+    styles = [
+        {"id": "DEFAULT", "name": "По умолчанию"},
+        {"id": "ANIME", "name": "Аниме"},
+        {"id": "PORTRAIT", "name": "Портрет"},
+        {"id": "REALISTIC", "name": "Реалистичный"},
+        {"id": "UHD", "name": "Ультра HD"},
+    ]
+    return jsonify(styles)
+
+
+def create_app():
+    """
+    Создаёт приложение Flask.
+
+    Фабрика только настраивает логирование, сессии и маршруты: фоновые
+    потоки здесь не запускаются, поэтому приложение можно загрузить в
+    мастер-процессе gunicorn (preload) до fork. Хуки жизненного цикла:
+    start_background_services() - запуск служб в процессе-обработчике
+    (post_fork или первый запрос), drain() - остановка с ожиданием генераций.
+
+    Возвращает:
+        Flask: Настроенное приложение.
+    """
+    config = get_config()
+    configure_logging(config)
+
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = config.secret_key
+    app.config["SESSION_PERMANENT"] = False
+    # Бэкенд сессий: cookie (без состояния на сервере), memory или sqlite
+    app.config["SESSION_BACKEND"] = config.session_backend
+    app.config["SESSION_DB"] = config.session_db
+    app.config["SESSION_MAX_ENTRIES"] = config.session_max_entries
+    app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(
+        hours=config.session_lifetime_hours
+    )
+    app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
+    init_session(app)
+    app.register_blueprint(bp)
+    # /debug/memory, доступен только при заданном DEBUG_TOKEN
+    app.register_blueprint(create_debug_blueprint(live_objects))
+
+    logger.info(
+        f"Application created in "
+        f"{(time.perf_counter() - _import_started) * 1000:.0f} ms"
+    )
+    return app
+
+
+app = create_app()
 
 
 if __name__ == "__main__":
-     """
-     Основной блок запуска приложения.
-
-     Выполняет проверку конфигурации перед запуском сервера.
-     """
-     try:
-         config = ConfigManager()
-         config.validate()
-         os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
-         app.run(host="0.0.0.0", port=5000, debug=True)
-     except ValueError as e:
-         logger.error(f"Configuration error: {e}")
-         print(f"Error: {e}")
-         print("Please check your API credentials in .env file")
\ No newline at end of file
+    """
+    Основной блок запуска приложения.
+
+    Выполняет проверку конфигурации перед запуском сервера.
+    """
+    try:
+        get_config().validate()
+        os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+        signal.signal(signal.SIGTERM, handle_sigterm)
+        install_sighup_handler()
+        install_profile_signal_handler()
+        start_background_services()
+        app.run(
+            host="0.0.0.0",
+            port=5000,
+            debug=config.flask_debug,
+            threaded=True,
+        )
+    except ValueError as e:
+        logger.error(f"Configuration error: {e}")
+        print(f"Error: {e}")
+        print("Please check your API credentials in .env file")
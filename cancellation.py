@@ -0,0 +1,65 @@
+# cancellation.py
+import threading
+import time
+
+# Причина отмены задачи по сроку выполнения
+DEADLINE_EXCEEDED = "Истёк срок выполнения задачи"
+
+
+class TaskCancelledError(Exception):
+    """Задача отменена клиентом или превысила срок выполнения."""
+
+
+class CancelToken:
+    """
+    Флаг отмены задачи с необязательным сроком выполнения.
+
+    Поток генерации проверяет флаг между этапами и ждёт на нём паузы между
+    опросами FusionBrain, поэтому отмена прерывает ожидание сразу, а не после
+    очередной паузы. По истечении deadline токен считается отменённым.
+    """
+
+    def __init__(self, deadline: float = None):
+        """
+        Args:
+            deadline (float, optional): Срок выполнения (time.time()).
+        """
+        self.deadline = deadline
+        self.reason = None
+        self._event = threading.Event()
+
+    def cancel(self, reason: str = "Задача отменена") -> None:
+        """Отменяет задачу; первая причина отмены сохраняется."""
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        if (
+            not self._event.is_set()
+            and self.deadline is not None
+            and time.time() >= self.deadline
+        ):
+            self.cancel(DEADLINE_EXCEEDED)
+        return self._event.is_set()
+
+    def check(self) -> None:
+        """
+        Raises:
+            TaskCancelledError: Если задача отменена.
+        """
+        if self.cancelled:
+            raise TaskCancelledError(self.reason)
+
+    def wait(self, seconds: float) -> bool:
+        """
+        Ждёт seconds секунд, отмены или наступления срока выполнения.
+
+        Returns:
+            bool: True, если задача отменена.
+        """
+        if self.deadline is not None:
+            seconds = min(seconds, max(0.0, self.deadline - time.time()))
+        self._event.wait(seconds)
+        return self.cancelled
@@ -1,54 +1,280 @@
 # client_con.py
 import base64
-import json
+import contextvars
+import io
 import logging
 import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from random import uniform
-from time import sleep
 from urllib.parse import urlparse
 
+import msgspec
 import requests
 import requests.exceptions
-from dotenv import load_dotenv
 
-load_dotenv()
+from cancellation import CancelToken, TaskCancelledError
+from config import get_config
+from storage import copy_stream
+from transport import HttpTransport
 
 logger = logging.getLogger(__name__)
 
 
+class Pipeline(msgspec.Struct):
+    """Элемент ответа key/api/v1/pipelines."""
+
+    id: str
+    name: str = ""
+    type: str = ""
+    status: str = ""
+
+
+class Availability(msgspec.Struct):
+    """Ответ key/api/v1/pipeline/<id>/availability."""
+
+    pipeline_status: str | None = None
+
+
+class RunResponse(msgspec.Struct):
+    """Ответ key/api/v1/pipeline/run."""
+
+    uuid: str
+    status: str | None = None
+
+
+class GenerationResult(msgspec.Struct):
+    """Результат завершённой генерации."""
+
+    files: list[str] = []
+    censored: bool = False
+
+
+class StatusResponse(msgspec.Struct):
+    """Ответ key/api/v1/pipeline/status/<uuid>."""
+
+    status: str
+    result: GenerationResult | None = None
+    error_description: str = msgspec.field(
+        default="Unknown error", name="errorDescription"
+    )
+
+
+# Декодеры переиспользуются: схема разбирается один раз, а не на каждый ответ
+_pipelines_decoder = msgspec.json.Decoder(list[Pipeline])
+_availability_decoder = msgspec.json.Decoder(Availability)
+_run_decoder = msgspec.json.Decoder(RunResponse)
+_status_decoder = msgspec.json.Decoder(StatusResponse)
+
+
 class ConfigManager:
-    """Управляет конфигурацией приложения, загружая настройки из переменных окружения."""
+    """
+    Изменяемая копия параметров генерации для консольного использования клиента.
+
+    Значения берутся из общего снимка конфигурации config.get_config(), поэтому
+    создание ConfigManager не перечитывает переменные окружения.
+    """
 
     def __init__(self):
         """
-        Инициализирует конфигурацию, загружая переменные окружения.
+        Инициализирует конфигурацию из текущего снимка.
 
         Загружает API ключи, параметры по умолчанию для генерации изображений.
         """
-        logger.info("Initializing ConfigManager")
-        self.api_key = os.getenv("FUSIONBRAIN_API_KEY")
-        self.secret_key = os.getenv("FUSIONBRAIN_SECRET_KEY")
-        self.prompt = os.getenv(
-            "FUSIONBRAIN_DEFAULT_PROMPT", "Красивый закат на морском побережье"
+        snapshot = get_config()
+        self.credentials = snapshot.credentials
+        self.api_key, self.secret_key = (
+            snapshot.credentials[0] if snapshot.credentials else (None, None)
         )
-        self.width = int(os.getenv("FUSIONBRAIN_DEFAULT_WIDTH", 512))
-        self.height = int(os.getenv("FUSIONBRAIN_DEFAULT_HEIGHT", 512))
-        self.style = os.getenv("FUSIONBRAIN_DEFAULT_STYLE", None)
-        self.negative_prompt = os.getenv("FUSIONBRAIN_DEFAULT_NEGATIVE_PROMPT", None)
+        self.key_eject_seconds = snapshot.key_eject_seconds
+        self.prompt = snapshot.default_prompt
+        self.width = snapshot.default_width
+        self.height = snapshot.default_height
+        self.style = snapshot.default_style
+        self.negative_prompt = snapshot.default_negative_prompt
+        self.images_num = snapshot.default_images
+        self.image_download_concurrency = snapshot.image_download_concurrency
 
     def validate(self) -> None:
         """
         Проверяет наличие обязательных ключей API.
 
         Raises:
-            ValueError: Если отсутствует api_key или secret_key.
+            ValueError: Если не задано ни одной пары api_key и secret_key.
         """
-        if not self.api_key or not self.secret_key:
+        if not self.credentials:
             logger.error("API key or Secret key is missing in environment variables")
-            raise ValueError("API key or Secret key is missing in environment variables.")
+            raise ValueError(
+                "API key or Secret key is missing in environment variables."
+            )
         logger.info("Configuration validated successfully")
 
 
+class KeyPoolExhaustedError(Exception):
+    """Все ключи API временно исключены из пула."""
+
+
+class Credential:
+    """Пара ключей FusionBrain со счётчиками нагрузки и ошибок."""
+
+    __slots__ = (
+        "key_id",
+        "headers",
+        "in_flight",
+        "total_requests",
+        "total_jobs",
+        "errors",
+        "ejected_until",
+        "recent",
+    )
+
+    def __init__(self, key_id: str, api_key: str, secret_key: str):
+        self.key_id = key_id
+        self.headers = {
+            "X-Key": f"Key {api_key}",
+            "X-Secret": f"Secret {secret_key}",
+        }
+        self.in_flight = 0
+        self.total_requests = 0
+        self.total_jobs = 0
+        self.errors = 0
+        self.ejected_until = 0.0
+        self.recent = deque()
+
+
+class KeyPool:
+    """
+    Пул пар ключей FusionBrain с учётом нагрузки на каждый ключ.
+
+    Новая генерация отдаётся исправному ключу с наименьшим числом
+    выполняемых заданий. Ключ, получивший ошибку авторизации или превышения
+    квоты (401, 403, 429), временно исключается из выбора.
+    """
+
+    EJECT_STATUS_CODES = (401, 403, 429)
+
+    def __init__(
+        self, credentials: list, eject_seconds: float = 300, rate_window: float = 60
+    ):
+        """
+        Args:
+            credentials (list): Список кортежей (api_key, secret_key).
+            eject_seconds (float): На сколько секунд исключать ключ после ошибки.
+            rate_window (float): Окно в секундах для подсчёта частоты запросов.
+
+        Raises:
+            ValueError: Если список ключей пуст.
+        """
+        if not credentials:
+            raise ValueError("Key pool requires at least one credential pair")
+        # В логах и метриках ключ показывается только по первым символам
+        self.credentials = [
+            Credential(f"{i + 1}:{key[:4]}…", key, secret)
+            for i, (key, secret) in enumerate(credentials)
+        ]
+        self._by_id = {cred.key_id: cred for cred in self.credentials}
+        self.eject_seconds = eject_seconds
+        self.rate_window = rate_window
+        self._lock = threading.Lock()
+
+    def get(self, key_id: str) -> Credential:
+        """Возвращает ключ по идентификатору или None."""
+        return self._by_id.get(key_id)
+
+    def _healthy(self, now: float) -> list:
+        healthy = [cred for cred in self.credentials if cred.ejected_until <= now]
+        if not healthy:
+            raise KeyPoolExhaustedError("All FusionBrain API keys are ejected")
+        return healthy
+
+    def pick(self) -> Credential:
+        """Выбирает наименее загруженный исправный ключ для служебного запроса."""
+        with self._lock:
+            now = time.monotonic()
+            return min(
+                self._healthy(now), key=lambda cred: (cred.in_flight, len(cred.recent))
+            )
+
+    def acquire(self) -> Credential:
+        """
+        Резервирует наименее загруженный исправный ключ под новую генерацию.
+
+        Raises:
+            KeyPoolExhaustedError: Если все ключи исключены.
+        """
+        with self._lock:
+            now = time.monotonic()
+            cred = min(
+                self._healthy(now), key=lambda cred: (cred.in_flight, len(cred.recent))
+            )
+            cred.in_flight += 1
+            cred.total_jobs += 1
+            return cred
+
+    def bind(self, key_id: str) -> Credential:
+        """Резервирует конкретный ключ для генерации, начатой ранее."""
+        cred = self._by_id.get(key_id)
+        if cred is None:
+            return None
+        with self._lock:
+            cred.in_flight += 1
+        return cred
+
+    def release(self, cred: Credential) -> None:
+        """Освобождает ключ после завершения генерации."""
+        with self._lock:
+            cred.in_flight = max(0, cred.in_flight - 1)
+
+    def record(self, cred: Credential, status_code: int) -> None:
+        """
+        Учитывает запрос к API и исключает ключ при ошибке авторизации или квоты.
+
+        Args:
+            cred (Credential): Ключ, которым выполнен запрос.
+            status_code (int): HTTP-статус ответа.
+        """
+        with self._lock:
+            now = time.monotonic()
+            cred.total_requests += 1
+            cred.recent.append(now)
+            while cred.recent and cred.recent[0] < now - self.rate_window:
+                cred.recent.popleft()
+            if status_code >= 400:
+                cred.errors += 1
+            if status_code in self.EJECT_STATUS_CODES:
+                cred.ejected_until = now + self.eject_seconds
+                logger.warning(
+                    "Key %s ejected for %.0f seconds after HTTP %d",
+                    cred.key_id,
+                    self.eject_seconds,
+                    status_code,
+                )
+
+    def stats(self) -> list:
+        """Возвращает счётчики по каждому ключу пула."""
+        with self._lock:
+            now = time.monotonic()
+            return [
+                {
+                    "key_id": cred.key_id,
+                    "healthy": cred.ejected_until <= now,
+                    "ejected_for": max(0.0, round(cred.ejected_until - now, 1)),
+                    "in_flight": cred.in_flight,
+                    "jobs": cred.total_jobs,
+                    "requests": cred.total_requests,
+                    "requests_per_minute": len(
+                        [t for t in cred.recent if t >= now - self.rate_window]
+                    )
+                    * 60
+                    / self.rate_window,
+                    "errors": cred.errors,
+                }
+                for cred in self.credentials
+            ]
+
+
 class ImageHandler:
     """
     Обрабатывает сохранение изображений из данных API.
@@ -57,36 +283,53 @@ class ImageHandler:
     """
 
     @staticmethod
-    def save_image(image_data: str, save_path: str) -> None:
+    def save_image(
+        image_data: str, save_path: str, storage=None, transport=None
+    ) -> tuple:
         """
-        Сохраняет изображение на диск.
+        Сохраняет изображение на диск или в хранилище.
+
+        Изображение по URL не загружается в память целиком: ответ читается
+        потоком и сразу пишется в файл или в хранилище.
 
         Args:
             image_data (str): Данные изображения (URL или base64-строка).
-            save_path (str): Путь для сохранения изображения.
+            save_path (str): Путь для сохранения изображения (ключ объекта,
+                если задан storage).
+            storage (optional): Хранилище из модуля storage; по умолчанию
+                изображение записывается в файл save_path.
+            transport (optional): Транспорт из модуля transport, через который
+                скачивается изображение по URL; по умолчанию HttpTransport.
+
+        Returns:
+            tuple: Размер файла в байтах и SHA-256 содержимого (hex).
 
         Raises:
             ValueError: Если формат данных изображения не поддерживается.
             requests.exceptions.RequestException: Если не удалось скачать изображение по URL.
             Exception: Для других ошибок, включая проблемы с декодированием base64.
         """
+
+        def write(stream):
+            if storage is not None:
+                return storage.save(save_path, stream)
+            with open(save_path, "wb") as file:
+                return copy_stream(stream, file)
+
         try:
             logger.info("Saving image to %s", save_path)
             if isinstance(image_data, str):
                 parsed_url = urlparse(image_data)
                 if parsed_url.scheme in ("http", "https"):
-                    response = requests.get(image_data)
-                    response.raise_for_status()
-                    with open(save_path, "wb") as file:
-                        file.write(response.content)
+                    with (transport or HttpTransport()).download(image_data) as stream:
+                        result = write(stream)
                     logger.info("Image downloaded and saved to %s", save_path)
                 else:
                     if image_data.startswith("data:image"):
                         image_data = image_data.split(",")[1]
-                    image_bytes = base64.b64decode(image_data)
-                    with open(save_path, "wb") as file:
-                        file.write(image_bytes)
+                    result = write(io.BytesIO(base64.b64decode(image_data)))
                     logger.info("Base64 image decoded and saved to %s", save_path)
+                return result
             else:
                 logger.error("Unsupported image data format: %s", type(image_data))
                 raise ValueError("Unsupported image data format")
@@ -97,6 +340,49 @@ class ImageHandler:
             logger.error("Error saving image to %s: %s", save_path, e)
             raise
 
+    @staticmethod
+    def save_images(
+        items: list, concurrency: int = 4, storage=None, transport=None
+    ) -> list:
+        """
+        Сохраняет несколько изображений параллельно.
+
+        Загрузка по URL и декодирование base64 выполняются в пуле потоков не
+        больше чем по concurrency изображений одновременно, поэтому задача из
+        нескольких изображений сохраняется примерно за время одной загрузки.
+
+        Args:
+            items (list): Пары (image_data, save_path).
+            concurrency (int): Максимальное число одновременных загрузок.
+            storage (optional): Хранилище, см. save_image.
+            transport (optional): Транспорт, см. save_image.
+
+        Returns:
+            list: Пары (размер, SHA-256) в порядке items.
+
+        Raises:
+            Exception: Первая ошибка сохранения; остальные изображения при
+                этом всё равно дожидаются завершения.
+        """
+        if not items:
+            return []
+        workers = max(1, min(concurrency, len(items)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Контекст копируется, чтобы записи журнала из потоков пула
+            # сохранили метку задачи
+            futures = [
+                executor.submit(
+                    contextvars.copy_context().run,
+                    ImageHandler.save_image,
+                    image_data,
+                    save_path,
+                    storage,
+                    transport,
+                )
+                for image_data, save_path in items
+            ]
+        return [future.result() for future in futures]
+
 
 class FusionBrainAPI:
     """
@@ -105,57 +391,119 @@ class FusionBrainAPI:
     Позволяет получать pipeline ID, проверять доступность сервиса, генерировать изображения и проверять статус генерации.
     """
 
-    def __init__(self, url: str, api_key: str, secret_key: str):
+    def __init__(
+        self,
+        url: str,
+        api_key: str = None,
+        secret_key: str = None,
+        key_pool: "KeyPool" = None,
+        transport=None,
+    ):
         """
         Инициализирует клиент FusionBrain API.
 
         Args:
             url (str): Базовый URL API.
-            api_key (str): Ключ API для аутентификации.
-            secret_key (str): Секретный ключ API для аутентификации.
+            api_key (str, optional): Ключ API для аутентификации.
+            secret_key (str, optional): Секретный ключ API для аутентификации.
+            key_pool (KeyPool, optional): Пул ключей; если задан, api_key и
+                secret_key не используются.
+            transport (optional): Транспорт из модуля transport: запись или
+                воспроизведение обмена с API. По умолчанию HttpTransport.
         """
         self.URL = url
-        self.AUTH_HEADERS = {
-            "X-Key": f"Key {api_key}",
-            "X-Secret": f"Secret {secret_key}",
-        }
+        self.key_pool = key_pool or KeyPool([(api_key, secret_key)])
+        self.transport = transport or HttpTransport()
+        # UUID генерации -> ключ, которым она запущена
+        self._job_keys = {}
         logger.info("FusionBrainAPI initialized with URL: %s", url)
 
-    def get_pipeline(self) -> str:
+    def _request(self, method: str, url: str, cred: Credential = None, **kwargs):
+        """
+        Выполняет запрос к API ключом cred и учитывает его в статистике пула.
+
+        Если ключ не указан, берётся наименее загруженный исправный ключ.
+        """
+        cred = cred or self.key_pool.pick()
+        response = self.transport.request(method, url, headers=cred.headers, **kwargs)
+        self.key_pool.record(cred, response.status_code)
+        return response
+
+    def key_for(self, request_id: str) -> str:
+        """Возвращает идентификатор ключа, которым запущена генерация."""
+        cred = self._job_keys.get(request_id)
+        return cred.key_id if cred else None
+
+    def bind_job(self, request_id: str, key_id: str) -> None:
         """
-        Получает идентификатор pipeline из API.
+        Привязывает генерацию, начатую ранее, к ключу из пула.
+
+        Используется при продолжении генерации после перезапуска, чтобы опрос
+        статуса шёл тем же ключом, которым генерация была создана.
+        """
+        cred = self.key_pool.bind(key_id) if key_id else None
+        self._job_keys[request_id] = cred or self.key_pool.acquire()
+
+    def release_job(self, request_id: str) -> None:
+        """Освобождает ключ генерации после её завершения."""
+        cred = self._job_keys.pop(request_id, None)
+        if cred is not None:
+            self.key_pool.release(cred)
+
+    def list_pipelines(self) -> list:
+        """
+        Получает список pipeline из API.
 
         Returns:
-            str: Идентификатор pipeline.
+            list: Список Pipeline в порядке ответа API.
 
         Raises:
             requests.exceptions.RequestException: Если произошла сетевая ошибка.
-            ValueError: Если ответ API имеет неожиданный формат.
+            ValueError: Если ответ API имеет неожиданный формат или список пуст.
             Exception: Для непредвиденных ошибок.
         """
         try:
-            logger.info("Requesting pipeline ID from %skey/api/v1/pipelines", self.URL)
-            response = requests.get(
-                self.URL + "key/api/v1/pipelines", headers=self.AUTH_HEADERS
-            )
+            logger.info("Requesting pipelines from %skey/api/v1/pipelines", self.URL)
+            response = self._request("GET", self.URL + "key/api/v1/pipelines")
             response.raise_for_status()
-            data = response.json()
-            if not isinstance(data, list) or not data:
-                raise ValueError(f"Unexpected pipeline response: {data}")
-            pipeline_id = data[0]["id"]
-            logger.info("Successfully retrieved pipeline ID: %s", pipeline_id)
-            return pipeline_id
+            try:
+                pipelines = _pipelines_decoder.decode(response.content)
+            except msgspec.DecodeError as e:
+                raise ValueError(f"Unexpected pipeline response: {e}") from e
+            if not pipelines:
+                raise ValueError("Unexpected pipeline response: empty list")
+            logger.info(
+                "Retrieved %d pipelines: %s",
+                len(pipelines),
+                ", ".join(pipeline.id for pipeline in pipelines),
+            )
+            return pipelines
         except requests.exceptions.RequestException as e:
-            logger.error("Network error in get_pipeline: %s", e)
+            logger.error("Network error in list_pipelines: %s", e)
             raise
         except ValueError as e:
-            logger.error("Validation error in get_pipeline: %s", e)
+            logger.error("Validation error in list_pipelines: %s", e)
             raise
         except Exception as e:
-            logger.error("Unexpected error in get_pipeline: %s", e)
+            logger.error("Unexpected error in list_pipelines: %s", e)
             raise
 
-    def check_availability(self, pipeline_id: str) -> dict:
+    def get_pipeline(self) -> str:
+        """
+        Получает идентификатор первого pipeline из API.
+
+        Returns:
+            str: Идентификатор pipeline.
+
+        Raises:
+            requests.exceptions.RequestException: Если произошла сетевая ошибка.
+            ValueError: Если ответ API имеет неожиданный формат.
+        """
+        pipeline_id = self.list_pipelines()[0].id
+        logger.info("Successfully retrieved pipeline ID: %s", pipeline_id)
+        return pipeline_id
+
+    def check_availability(self, pipeline_id: str) -> Availability:
         """
         Проверяет доступность сервиса.
 
@@ -163,22 +511,22 @@ class FusionBrainAPI:
             pipeline_id (str): Идентификатор pipeline.
 
         Returns:
-            dict: Информация о доступности сервиса.
+            Availability: Информация о доступности сервиса.
 
         Raises:
             requests.exceptions.RequestException: Если произошла сетевая ошибка.
+            msgspec.DecodeError: Если ответ API имеет неожиданный формат.
             Exception: Для непредвиденных ошибок.
         """
         try:
             logger.info("Checking service availability for pipeline %s", pipeline_id)
-            response = requests.get(
-                f"{self.URL}key/api/v1/pipeline/{pipeline_id}/availability",
-                headers=self.AUTH_HEADERS,
+            response = self._request(
+                "GET", f"{self.URL}key/api/v1/pipeline/{pipeline_id}/availability"
             )
             response.raise_for_status()
-            data = response.json()
-            logger.info("Service availability status: %s", data)
-            return data
+            availability = _availability_decoder.decode(response.content)
+            logger.info("Service availability status: %s", availability)
+            return availability
         except requests.exceptions.RequestException as e:
             logger.error("Network error in check_availability: %s", e)
             raise
@@ -194,6 +542,7 @@ class FusionBrainAPI:
         height: int = 1024,
         style: str = None,
         negative_prompt: str = None,
+        images_num: int = 1,
     ) -> str:
         """
         Инициирует генерацию изображения через API.
@@ -205,18 +554,22 @@ class FusionBrainAPI:
             height (int): Высота изображения в пикселях.
             style (str, optional): Стиль изображения.
             negative_prompt (str, optional): Негативный промпт.
+            images_num (int): Количество изображений в одной генерации (1-4).
 
         Returns:
             str: UUID запроса генерации.
 
         Raises:
             requests.exceptions.RequestException: Если запрос завершился с ошибкой HTTP.
-            ValueError: Если ответ API не содержит UUID.
+            ValueError: Если ответ API не содержит UUID или images_num вне 1-4.
             Exception: Для непредвиденных ошибок.
         """
+        if not 1 <= images_num <= 4:
+            raise ValueError("images_num must be between 1 and 4")
+
         params = {
             "type": "GENERATE",
-            "numImages": 1,
+            "numImages": images_num,
             "width": width,
             "height": height,
             "generateParams": {"query": f"{prompt}"},
@@ -230,32 +583,41 @@ class FusionBrainAPI:
 
         data = {
             "pipeline_id": (None, pipeline),
-            "params": (None, json.dumps(params), "application/json"),
+            "params": (None, msgspec.json.encode(params), "application/json"),
         }
 
         try:
             logger.info(
-                "Initiating image generation with prompt: %s, pipeline: %s, width: %d, height: %d, style: %s",
+                "Initiating image generation with prompt: %s, pipeline: %s, images: %d, width: %d, height: %d, style: %s",
                 prompt,
                 pipeline,
+                images_num,
                 width,
                 height,
                 style if style else "default",
             )
-            response = requests.post(
-                self.URL + "key/api/v1/pipeline/run",
-                headers=self.AUTH_HEADERS,
-                files=data,
+            cred = self.key_pool.acquire()
+            try:
+                response = self._request(
+                    "POST", self.URL + "key/api/v1/pipeline/run", cred, files=data
+                )
+                response.raise_for_status()
+
+                try:
+                    run = _run_decoder.decode(response.content)
+                except msgspec.DecodeError as e:
+                    logger.error("Unexpected generate response: %s", response.text)
+                    raise ValueError(f"Unexpected generate response: {e}") from e
+            except Exception:
+                self.key_pool.release(cred)
+                raise
+
+            uuid = run.uuid
+            # Опрос статуса должен идти тем же ключом, которым создана генерация
+            self._job_keys[uuid] = cred
+            logger.info(
+                "Image generation initiated, UUID: %s, key: %s", uuid, cred.key_id
             )
-            response.raise_for_status()
-
-            data = response.json()
-            if "uuid" not in data:
-                logger.error("Unexpected generate response: %s", data)
-                raise ValueError(f"Unexpected generate response: {data}")
-
-            uuid = data["uuid"]
-            logger.info("Image generation initiated, UUID: %s", uuid)
             return uuid
         except requests.exceptions.RequestException as e:
             logger.error("Network error in generate: %s", e)
@@ -273,6 +635,8 @@ class FusionBrainAPI:
         max_attempts: int = 10,
         initial_delay: float = 5,
         max_delay: float = 30,
+        cancel: CancelToken = None,
+        on_done=None,
     ) -> list:
         """
         Проверяет статус генерации изображения.
@@ -282,106 +646,147 @@ class FusionBrainAPI:
             max_attempts (int): Максимальное количество попыток проверки статуса.
             initial_delay (float): Начальная задержка между попытками (в секундах).
             max_delay (float): Максимальная задержка между попытками (в секундах).
+            cancel (CancelToken, optional): Флаг отмены задачи; отмена
+                прерывает паузу между попытками.
+            on_done (callable, optional): Вызывается без аргументов сразу
+                после получения статуса DONE.
 
         Returns:
-           list: Список данных сгенерированных изображений.
-
-       Raises:
-           requests.exceptions.RequestException: Если произошла сетевая ошибка.
-           TimeoutError: Если генерация не завершилась в течение заданного времени.
-           Exception: Для непредвиденных ошибок.
-       """
-       try:
-           attempt = 0
-           delay = initial_delay
-           logger.info("Checking generation status for UUID: %s", request_id)
-           while attempt < max_attempts:
-               response = requests.get(
-                   self.URL + "key/api/v1/pipeline/status/" + request_id,
-                   headers=self.AUTH_HEADERS,
-               )
-               response.raise_for_status()
-               data = response.json()
-
-               status = data.get("status")
-               if status == "DONE":
-                   files = data.get("result", {}).get("files", [])
-                   censored = data.get("result", {}).get("censored", False)
-                   if censored:
-                       logging.warning(
-                           "Content was censored for UUID: %s", request_id
-                       )
-                   if not files:
-                       logging.warning(
-                           "No files found in the generation result for UUID: %s",
-                           request_id,
-                       )
-                   else:
-                       logger.info(
-                           "Generation completed, found %d files for UUID: %s",
-                           len(files),
-                           request_id,
-                       )
-                   return files
-               elif status == "FAIL":
-                   error_desc = data.get("errorDescription", "Unknown error")
-                   logger.error("Generation failed: %s", error_desc)
-                   raise Exception(f"Generation failed: {error_desc}")
-               elif status in ["PROCESSING", "INITIAL"]:
-                   logger.info("Generation status: %s, waiting...", status)
-               else:
-                   logging.warning("Unknown status: %s", status)
-
-               attempt += 1
-               logging.debug(
-                   "Attempt %d/%d, retrying in %.2f seconds",
-                   attempt,
-                   max_attempts,
-                   delay,
-               )
-               sleep(delay)
-               delay = min(max_delay, delay * 2 + uniform(-0.5, 0.5))
-
-           logger.error(
-               "Generation did not complete in time for UUID: %s", request_id
-           )
-           raise TimeoutError("Generation did not complete in time.")
-       except requests.exceptions.RequestException as e:
-           logger.error(
-               "Network error in check_generation for UUID %s: %s",
-               request_id,
-               e,
-           )
-           raise
-       except Exception as e:
-           logger.error(
-               "Unexpected error in check_generation for UUID %s: %s",
-               request_id,
-               e,
-           )
-           raise
+            list: Список данных сгенерированных изображений.
+
+        Raises:
+            requests.exceptions.RequestException: Если произошла сетевая ошибка.
+            TimeoutError: Если генерация не завершилась в течение заданного времени.
+            TaskCancelledError: Если задача отменена во время опроса.
+            Exception: Для непредвиденных ошибок.
+        """
+        try:
+            attempt = 0
+            delay = initial_delay
+            logger.info("Checking generation status for UUID: %s", request_id)
+            while attempt < max_attempts:
+                if cancel is not None:
+                    cancel.check()
+                response = self._request(
+                    "GET",
+                    self.URL + "key/api/v1/pipeline/status/" + request_id,
+                    self._job_keys.get(request_id),
+                )
+                response.raise_for_status()
+                data = _status_decoder.decode(response.content)
+
+                status = data.status
+                if status == "DONE":
+                    if on_done is not None:
+                        on_done()
+                    result = data.result or GenerationResult()
+                    files = result.files
+                    if result.censored:
+                        logging.warning("Content was censored for UUID: %s", request_id)
+                    if not files:
+                        logging.warning(
+                            "No files found in the generation result for UUID: %s",
+                            request_id,
+                        )
+                    else:
+                        logger.info(
+                            "Generation completed, found %d files for UUID: %s",
+                            len(files),
+                            request_id,
+                        )
+                    return files
+                elif status == "FAIL":
+                    logger.error("Generation failed: %s", data.error_description)
+                    raise Exception(f"Generation failed: {data.error_description}")
+                elif status in ["PROCESSING", "INITIAL"]:
+                    logger.info("Generation status: %s, waiting...", status)
+                else:
+                    logging.warning("Unknown status: %s", status)
+
+                attempt += 1
+                logging.debug(
+                    "Attempt %d/%d, retrying in %.2f seconds",
+                    attempt,
+                    max_attempts,
+                    delay,
+                )
+                self.transport.sleep(delay, cancel)
+                delay = min(max_delay, delay * 2 + uniform(-0.5, 0.5))
+
+            logger.error("Generation did not complete in time for UUID: %s", request_id)
+            raise TimeoutError("Generation did not complete in time.")
+        except TaskCancelledError as e:
+            logger.info("Stopped polling UUID %s: %s", request_id, e)
+            raise
+        except requests.exceptions.RequestException as e:
+            logger.error(
+                "Network error in check_generation for UUID %s: %s",
+                request_id,
+                e,
+            )
+            raise
+        except Exception as e:
+            logger.error(
+                "Unexpected error in check_generation for UUID %s: %s",
+                request_id,
+                e,
+            )
+            raise
+        finally:
+            self.release_job(request_id)
 
 
 if __name__ == "__main__":
     try:
-       # Инициализация конфигурации
-       config = ConfigManager()
-       config.validate()
-
-       # Инициализация API
-       api = FusionBrainAPI(
-           "https://api-key.fusionbrain.ai/", config.api_key, config.secret_key
-       )
-
-       # Получение pipeline ID
-       pipeline_id = api.get_pipeline()
-
-       # Проверка доступности сервиса
-       availability = api.check_availability(pipeline_id)
-       if availability.get("pipeline_status") == "DISABLED_BY_QUEUE":
-           logging.warning(
-               "Service is currently unavailable due to high load. Try again later."
-           )
-           print(
-               "Service is currently unavailable due to high load. Try again later."
-           )
\ No newline at end of file
+        # Инициализация конфигурации
+        config = ConfigManager()
+        config.validate()
+
+        # Инициализация API
+        api = FusionBrainAPI(
+            "https://api-key.fusionbrain.ai/",
+            key_pool=KeyPool(config.credentials, config.key_eject_seconds),
+        )
+
+        # Получение pipeline ID
+        pipeline_id = api.get_pipeline()
+
+        # Проверка доступности сервиса
+        availability = api.check_availability(pipeline_id)
+        if availability.pipeline_status == "DISABLED_BY_QUEUE":
+            logging.warning(
+                "Service is currently unavailable due to high load. Try again later."
+            )
+            print("Service is currently unavailable due to high load. Try again later.")
+        else:
+            # Генерация изображения
+            uuid = api.generate(
+                config.prompt,
+                pipeline_id,
+                config.width,
+                config.height,
+                style=config.style,
+                negative_prompt=config.negative_prompt,
+                images_num=config.images_num,
+            )
+
+            # Проверка статуса генерации
+            files = api.check_generation(uuid)
+
+            if not files:
+                print("No image data found. Check the API response for errors.")
+            else:
+                os.makedirs("output", exist_ok=True)
+                ImageHandler.save_images(
+                    [
+                        (
+                            file_data,
+                            os.path.join("output", f"generated_image_{i + 1}.png"),
+                        )
+                        for i, file_data in enumerate(files)
+                    ],
+                    config.image_download_concurrency,
+                )
+    except Exception as e:
+        logger.error("An error occurred: %s", e)
+        print(f"An error occurred: {e}")
@@ -0,0 +1,408 @@
+# config.py
+import logging
+import os
+import signal
+import threading
+from dataclasses import dataclass, fields
+
+from dotenv import dotenv_values
+
+logger = logging.getLogger(__name__)
+
+ENV_FILE = os.getenv("ENV_FILE", ".env")
+
+
+def _parse_credentials(pool: str, api_key: str, secret_key: str) -> tuple:
+    """
+    Собирает пары ключей из FUSIONBRAIN_API_KEYS и одиночной пары.
+
+    Args:
+        pool (str): Пары вида "api_key:secret_key", разделённые запятыми.
+        api_key (str): Ключ из FUSIONBRAIN_API_KEY.
+        secret_key (str): Секрет из FUSIONBRAIN_SECRET_KEY.
+
+    Returns:
+        tuple: Кортежи (api_key, secret_key) без повторов.
+
+    Raises:
+        ValueError: Если пара в FUSIONBRAIN_API_KEYS записана неверно.
+    """
+    credentials = []
+    if api_key and secret_key:
+        credentials.append((api_key, secret_key))
+    for item in filter(None, (part.strip() for part in pool.split(","))):
+        key, sep, secret = item.partition(":")
+        if not sep or not key or not secret:
+            raise ValueError(
+                "FUSIONBRAIN_API_KEYS must contain api_key:secret_key pairs"
+            )
+        if (key, secret) not in credentials:
+            credentials.append((key, secret))
+    return tuple(credentials)
+
+
+@dataclass(frozen=True, slots=True)
+class AppConfig:
+    """
+    Неизменяемый снимок конфигурации приложения.
+
+    Создаётся один раз при старте и разделяется всеми потоками. При
+    перезагрузке конфигурации создаётся новый снимок, а ссылка на текущий
+    заменяется целиком, поэтому читатели никогда не видят частично
+    обновлённые настройки.
+    """
+
+    # FusionBrain API
+    api_url: str = "https://api-key.fusionbrain.ai/"
+    credentials: tuple = ()
+    key_eject_seconds: float = 300
+    fusionbrain_transport: str = "http"
+    fusionbrain_cassette: str = "fusionbrain_cassette.jsonl"
+    replay_speed: float = 1.0
+    pipeline_refresh_seconds: float = 300
+    pipeline_disable_seconds: float = 60
+
+    # Параметры генерации по умолчанию
+    default_prompt: str = "Красивый закат на морском побережье"
+    default_width: int = 512
+    default_height: int = 512
+    default_style: str = None
+    default_negative_prompt: str = None
+    default_images: int = 1
+    image_download_concurrency: int = 4
+
+    # Параметры flask_app
+    model_id: str = "kandinsky_3.1"
+    width: int = 1024
+    height: int = 1024
+    images_num: int = 1
+    guidance_scale: float = 7
+
+    # Логирование
+    log_file: str = "app.log"
+    log_max_size: int = 1024 * 1024
+    log_backup_count: int = 3
+
+    # Веб-приложение
+    secret_key: str = "fusionbrain-flask-app-secret"
+    flask_debug: bool = False
+    debug_token: str = None
+    api_tokens: tuple = ()
+    profile_seconds: float = 30
+    profile_dir: str = "profiles"
+    output_cleanup_age_hours: float = 24
+    output_cleanup_interval: float = 600
+    drain_timeout: float = 180
+    tasks_db: str = "tasks.db"
+    image_index_db: str = "images.db"
+    storage_backend: str = "local"
+    s3_bucket: str = None
+    s3_endpoint_url: str = None
+    s3_region: str = None
+    s3_access_key: str = None
+    s3_secret_key: str = None
+    s3_presign_seconds: int = 3600
+    session_backend: str = "cookie"
+    session_db: str = "sessions.db"
+    session_max_entries: int = 10000
+    session_lifetime_hours: float = 24
+    generation_workers: int = 4
+    scheduler_weights: str = "interactive=4,batch=1"
+    max_running_per_client: int = 2
+    max_queued_per_client: int = 100
+    webhook_max_attempts: int = 6
+    webhook_timeout: float = 10
+    webhook_dead_letter: str = "webhooks_dead.jsonl"
+    webhook_workers: int = 4
+    webhook_max_per_host: int = 2
+
+    @classmethod
+    def from_env(cls, env: dict) -> "AppConfig":
+        """
+        Создаёт снимок из словаря переменных окружения.
+
+        Args:
+            env (dict): Переменные окружения.
+
+        Returns:
+            AppConfig: Снимок конфигурации.
+
+        Raises:
+            ValueError: Если значение переменной имеет неверный формат.
+        """
+        defaults = cls()
+        get = env.get
+        return cls(
+            api_url=get("FUSIONBRAIN_API_URL", defaults.api_url),
+            credentials=_parse_credentials(
+                get("FUSIONBRAIN_API_KEYS", ""),
+                get("FUSIONBRAIN_API_KEY"),
+                get("FUSIONBRAIN_SECRET_KEY"),
+            ),
+            key_eject_seconds=float(
+                get("FUSIONBRAIN_KEY_EJECT_SECONDS", defaults.key_eject_seconds)
+            ),
+            fusionbrain_transport=get(
+                "FUSIONBRAIN_TRANSPORT", defaults.fusionbrain_transport
+            ),
+            fusionbrain_cassette=get(
+                "FUSIONBRAIN_CASSETTE", defaults.fusionbrain_cassette
+            ),
+            replay_speed=float(get("FUSIONBRAIN_REPLAY_SPEED", defaults.replay_speed)),
+            pipeline_refresh_seconds=float(
+                get("PIPELINE_REFRESH_SECONDS", defaults.pipeline_refresh_seconds)
+            ),
+            pipeline_disable_seconds=float(
+                get("PIPELINE_DISABLE_SECONDS", defaults.pipeline_disable_seconds)
+            ),
+            default_prompt=get("FUSIONBRAIN_DEFAULT_PROMPT", defaults.default_prompt),
+            default_width=int(get("FUSIONBRAIN_DEFAULT_WIDTH", defaults.default_width)),
+            default_height=int(
+                get("FUSIONBRAIN_DEFAULT_HEIGHT", defaults.default_height)
+            ),
+            default_style=get("FUSIONBRAIN_DEFAULT_STYLE"),
+            default_negative_prompt=get("FUSIONBRAIN_DEFAULT_NEGATIVE_PROMPT"),
+            default_images=int(
+                get("FUSIONBRAIN_DEFAULT_IMAGES", defaults.default_images)
+            ),
+            image_download_concurrency=int(
+                get("IMAGE_DOWNLOAD_CONCURRENCY", defaults.image_download_concurrency)
+            ),
+            model_id=get("FUSIONBRAIN_MODEL_ID", defaults.model_id),
+            width=int(get("FUSIONBRAIN_WIDTH", defaults.width)),
+            height=int(get("FUSIONBRAIN_HEIGHT", defaults.height)),
+            images_num=int(get("FUSIONBRAIN_IMAGES_NUM", defaults.images_num)),
+            guidance_scale=float(
+                get("FUSIONBRAIN_GUIDANCE_SCALE", defaults.guidance_scale)
+            ),
+            log_file=get("LOG_FILE", defaults.log_file),
+            log_max_size=int(float(get("LOG_MAX_SIZE_MB", 1)) * 1024 * 1024),
+            log_backup_count=int(get("LOG_BACKUP_COUNT", defaults.log_backup_count)),
+            secret_key=get("SECRET_KEY", defaults.secret_key),
+            flask_debug=get("FLASK_DEBUG", "0") == "1",
+            debug_token=get("DEBUG_TOKEN") or None,
+            api_tokens=tuple(
+                filter(
+                    None, (part.strip() for part in get("API_TOKENS", "").split(","))
+                )
+            ),
+            profile_seconds=float(get("PROFILE_SECONDS", defaults.profile_seconds)),
+            profile_dir=get("PROFILE_DIR", defaults.profile_dir),
+            output_cleanup_age_hours=float(
+                get("OUTPUT_CLEANUP_AGE_HOURS", defaults.output_cleanup_age_hours)
+            ),
+            output_cleanup_interval=float(
+                get("OUTPUT_CLEANUP_INTERVAL", defaults.output_cleanup_interval)
+            ),
+            drain_timeout=float(get("DRAIN_TIMEOUT", defaults.drain_timeout)),
+            tasks_db=get("TASKS_DB", defaults.tasks_db),
+            image_index_db=get("IMAGE_INDEX_DB", defaults.image_index_db),
+            storage_backend=get("STORAGE_BACKEND", defaults.storage_backend),
+            s3_bucket=get("S3_BUCKET"),
+            s3_endpoint_url=get("S3_ENDPOINT_URL"),
+            s3_region=get("S3_REGION"),
+            s3_access_key=get("S3_ACCESS_KEY_ID"),
+            s3_secret_key=get("S3_SECRET_ACCESS_KEY"),
+            s3_presign_seconds=int(
+                get("S3_PRESIGN_SECONDS", defaults.s3_presign_seconds)
+            ),
+            session_backend=get("SESSION_BACKEND", defaults.session_backend),
+            session_db=get("SESSION_DB", defaults.session_db),
+            session_max_entries=int(
+                get("SESSION_MAX_ENTRIES", defaults.session_max_entries)
+            ),
+            session_lifetime_hours=float(
+                get("SESSION_LIFETIME_HOURS", defaults.session_lifetime_hours)
+            ),
+            generation_workers=int(
+                get("GENERATION_WORKERS", defaults.generation_workers)
+            ),
+            scheduler_weights=get("SCHEDULER_WEIGHTS", defaults.scheduler_weights),
+            max_running_per_client=int(
+                get("MAX_RUNNING_PER_CLIENT", defaults.max_running_per_client)
+            ),
+            max_queued_per_client=int(
+                get("MAX_QUEUED_PER_CLIENT", defaults.max_queued_per_client)
+            ),
+            webhook_max_attempts=int(
+                get("WEBHOOK_MAX_ATTEMPTS", defaults.webhook_max_attempts)
+            ),
+            webhook_timeout=float(get("WEBHOOK_TIMEOUT", defaults.webhook_timeout)),
+            webhook_dead_letter=get(
+                "WEBHOOK_DEAD_LETTER", defaults.webhook_dead_letter
+            ),
+            webhook_workers=int(get("WEBHOOK_WORKERS", defaults.webhook_workers)),
+            webhook_max_per_host=int(
+                get("WEBHOOK_MAX_PER_HOST", defaults.webhook_max_per_host)
+            ),
+        )
+
+    def validate(self) -> None:
+        """
+        Проверяет наличие обязательных ключей API.
+
+        При воспроизведении кассеты (FUSIONBRAIN_TRANSPORT=replay) ключи не
+        нужны.
+
+        Raises:
+            ValueError: Если не задано ни одной пары api_key и secret_key.
+        """
+        if not self.credentials and self.fusionbrain_transport != "replay":
+            raise ValueError(
+                "API key or Secret key is missing in environment variables."
+            )
+
+    def changed_fields(self, other: "AppConfig") -> list:
+        """Возвращает имена полей, значения которых отличаются от other."""
+        return [
+            field.name
+            for field in fields(self)
+            if getattr(self, field.name) != getattr(other, field.name)
+        ]
+
+
+def read_env(env_file: str = None) -> dict:
+    """
+    Читает переменные окружения вместе с файлом .env.
+
+    Переменные процесса имеют приоритет над значениями из файла, как и при
+    load_dotenv(), но os.environ не изменяется, поэтому изменения в .env
+    применяются при повторном чтении.
+
+    Args:
+        env_file (str, optional): Путь к файлу .env.
+
+    Returns:
+        dict: Объединённые переменные.
+    """
+    env_file = env_file or ENV_FILE
+    values = {}
+    if os.path.exists(env_file):
+        values.update(
+            {k: v for k, v in dotenv_values(env_file).items() if v is not None}
+        )
+    values.update(os.environ)
+    return values
+
+
+_current = None
+_lock = threading.Lock()
+_listeners = []
+_env_mtime = None
+# Запрос перезагрузки от SIGHUP: обработчик сигнала только взводит событие,
+# а конфигурацию перечитывает поток watch_env_file
+_reload_requested = threading.Event()
+
+
+def _env_file_mtime():
+    try:
+        return os.path.getmtime(ENV_FILE)
+    except OSError:
+        return None
+
+
+def get_config() -> AppConfig:
+    """
+    Возвращает текущий снимок конфигурации, загружая его при первом вызове.
+
+    Returns:
+        AppConfig: Текущий снимок.
+    """
+    config = _current
+    if config is None:
+        with _lock:
+            if _current is None:
+                _load()
+            config = _current
+    return config
+
+
+def _load() -> AppConfig:
+    global _current, _env_mtime
+    _env_mtime = _env_file_mtime()
+    _current = AppConfig.from_env(read_env())
+    return _current
+
+
+def reload_config() -> AppConfig:
+    """
+    Перечитывает конфигурацию и атомарно заменяет текущий снимок.
+
+    При ошибке разбора остаётся прежний снимок. После замены вызываются
+    обработчики, зарегистрированные через on_reload().
+
+    Returns:
+        AppConfig: Действующий после перезагрузки снимок.
+    """
+    global _current, _env_mtime
+    with _lock:
+        old = _current
+        _env_mtime = _env_file_mtime()
+        try:
+            new = AppConfig.from_env(read_env())
+        except ValueError as e:
+            logger.error(f"Config reload failed, keeping previous config: {e}")
+            return old
+        _current = new
+
+    changed = new.changed_fields(old) if old is not None else []
+    if changed:
+        logger.info(f"Config reloaded, changed: {', '.join(changed)}")
+        for listener in list(_listeners):
+            try:
+                listener(old, new)
+            except Exception as e:
+                logger.error(f"Config reload listener failed: {e}")
+    return new
+
+
+def on_reload(listener) -> None:
+    """
+    Регистрирует обработчик смены конфигурации.
+
+    Args:
+        listener (callable): Функция listener(old, new).
+    """
+    _listeners.append(listener)
+
+
+def reload_if_env_changed() -> bool:
+    """Перезагружает конфигурацию, если файл .env изменился с прошлой загрузки."""
+    if _env_file_mtime() != _env_mtime:
+        reload_config()
+        return True
+    return False
+
+
+def watch_env_file(stop_event: threading.Event, interval: float = 5) -> None:
+    """
+    Следит за изменениями .env и перезагружает конфигурацию.
+
+    Также выполняет перезагрузки, запрошенные сигналом SIGHUP.
+
+    Args:
+        stop_event (threading.Event): Событие остановки наблюдения.
+        interval (float): Период проверки в секундах.
+    """
+    while not stop_event.is_set():
+        if _reload_requested.wait(interval):
+            _reload_requested.clear()
+            reload_config()
+        else:
+            reload_if_env_changed()
+
+
+def install_sighup_handler() -> None:
+    """
+    Запрашивает перезагрузку конфигурации по SIGHUP.
+
+    reload_config() берёт _lock, поэтому вызывать её из обработчика сигнала
+    нельзя: сигнал может прийти, пока главный поток держит блокировку.
+    Обработчик только взводит событие, а перечитывает конфигурацию поток
+    watch_env_file. Вызывается из главного потока процесса: в gunicorn -
+    из post_worker_init, так как воркер сбрасывает обработчики сигналов
+    после post_fork.
+    """
+    if not hasattr(signal, "SIGHUP"):
+        return
+    signal.signal(signal.SIGHUP, lambda signum, frame: _reload_requested.set())
@@ -0,0 +1,605 @@
+# debug_tools.py
+import hmac
+import itertools
+import json
+import linecache
+import logging
+import os
+import re
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, OrderedDict
+
+from flask import Blueprint, Response, abort, jsonify, request
+
+from config import get_config
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Сколько снимков хранить одновременно; старые вытесняются
+MAX_SNAPSHOTS = 5
+
+# Аллокации самого профилировщика в отчёт не попадают
+_SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, linecache.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+)
+
+# Пределы длительности и интервала выборки CPU-профилировщика
+MAX_PROFILE_SECONDS = 600
+MIN_SAMPLE_INTERVAL = 0.001
+
+# Функции, в которых поток ждёт, а не считает: блокировки, сокеты, очереди,
+# паузы между опросами. Стеки с такой вершиной по умолчанию не учитываются
+IDLE_FUNCTIONS = frozenset(
+    {
+        "Condition.wait",
+        "Event.wait",
+        "Thread.join",
+        "Thread._wait_for_tstate_lock",
+        "Semaphore.acquire",
+        "Queue.get",
+        "SimpleQueue.get",
+        "BaseSelector.select",
+        "SelectSelector.select",
+        "PollSelector.select",
+        "EpollSelector.select",
+        "KqueueSelector.select",
+        "socket.accept",
+        "SocketIO.readinto",
+        "SSLSocket.read",
+        "SSLSocket.recv_into",
+        "HttpTransport.sleep",
+        "ReplayTransport._wait",
+    }
+)
+
+
+def _rss_bytes():
+    """Текущий RSS процесса в байтах или None, если /proc недоступен."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _stat_to_dict(stat) -> dict:
+    frame = stat.traceback[0]
+    return {
+        "file": frame.filename,
+        "line": frame.lineno,
+        "size": stat.size,
+        "count": stat.count,
+        "traceback": [f"{f.filename}:{f.lineno}" for f in stat.traceback],
+    }
+
+
+class MemoryProfiler:
+    """
+    Управление tracemalloc и снимками памяти процесса.
+
+    Трассировка включается только по запросу: пока она выключена,
+    профилировщик не влияет на скорость работы приложения.
+    """
+
+    def __init__(self, max_snapshots: int = MAX_SNAPSHOTS):
+        self.max_snapshots = max_snapshots
+        self._snapshots = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def start(self, frames: int = 10) -> None:
+        """Включает tracemalloc с глубиной стека frames."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    def stop(self) -> None:
+        """Выключает tracemalloc и удаляет снимки."""
+        tracemalloc.stop()
+        with self._lock:
+            self._snapshots.clear()
+
+    def snapshot(self) -> str:
+        """
+        Делает снимок аллокаций.
+
+        Returns:
+            str: Идентификатор снимка.
+
+        Raises:
+            RuntimeError: Если tracemalloc не включён.
+        """
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not running")
+        snapshot = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+        with self._lock:
+            snapshot_id = f"s{next(self._ids)}"
+            self._snapshots[snapshot_id] = (time.time(), snapshot)
+            while len(self._snapshots) > self.max_snapshots:
+                self._snapshots.popitem(last=False)
+        return snapshot_id
+
+    def _get(self, snapshot_id: str):
+        with self._lock:
+            entry = self._snapshots.get(snapshot_id)
+        if entry is None:
+            raise KeyError(snapshot_id)
+        return entry[1]
+
+    def top(self, snapshot_id: str, group_by: str = "lineno", limit: int = 20):
+        """
+        Возвращает места с наибольшим объёмом аллокаций в снимке.
+
+        Args:
+            snapshot_id (str): Идентификатор снимка.
+            group_by (str): "lineno", "filename" или "traceback".
+            limit (int): Число мест.
+
+        Returns:
+            dict: Общий объём и список мест.
+
+        Raises:
+            KeyError: Если снимка нет.
+        """
+        stats = self._get(snapshot_id).statistics(group_by)
+        return {
+            "total_size": sum(stat.size for stat in stats),
+            "top": [_stat_to_dict(stat) for stat in stats[:limit]],
+        }
+
+    def diff(self, old_id: str, new_id: str, group_by="lineno", limit: int = 20):
+        """
+        Сравнивает два снимка.
+
+        Returns:
+            dict: Изменение общего объёма и места с наибольшим приростом.
+
+        Raises:
+            KeyError: Если одного из снимков нет.
+        """
+        stats = self._get(new_id).compare_to(self._get(old_id), group_by)
+        return {
+            "size_diff": sum(stat.size_diff for stat in stats),
+            "top": [
+                {
+                    **_stat_to_dict(stat),
+                    "size_diff": stat.size_diff,
+                    "count_diff": stat.count_diff,
+                }
+                for stat in stats[:limit]
+            ],
+        }
+
+    def status(self) -> dict:
+        """Возвращает состояние трассировки и список снимков."""
+        tracing = tracemalloc.is_tracing()
+        current, peak = tracemalloc.get_traced_memory() if tracing else (0, 0)
+        with self._lock:
+            snapshots = [
+                {"id": snapshot_id, "taken_at": taken_at}
+                for snapshot_id, (taken_at, _) in self._snapshots.items()
+            ]
+        return {
+            "tracing": tracing,
+            "frames": tracemalloc.get_traceback_limit() if tracing else 0,
+            "traced_bytes": current,
+            "traced_peak_bytes": peak,
+            "snapshots": snapshots,
+        }
+
+
+def _thread_group(name: str) -> str:
+    """Имя группы потоков: номера заменяются на N (generation-worker-N)."""
+    return re.sub(r"\d+", "N", name)
+
+
+class SamplingProfiler:
+    """
+    Сэмплирующий CPU-профилировщик всех потоков процесса.
+
+    Фоновый поток с заданным интервалом снимает стеки всех потоков через
+    sys._current_frames() и считает одинаковые стеки. Корнем каждого стека
+    служит группа потоков (обработчики запросов, generation-worker-N,
+    поток очистки), поэтому в flame graph видно, на что уходит время в
+    каждой из них. Стеки ожидающих потоков (IDLE_FUNCTIONS) по умолчанию
+    отбрасываются. Пока профилирование не запущено, накладных расходов нет.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._labels = {}
+        self._stacks = Counter()
+        self.samples = 0
+        self.idle_samples = 0
+        self.started_at = None
+        self.finished_at = None
+        self.seconds = 0
+        self.interval = 0
+        self.include_idle = False
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(
+        self,
+        seconds: float,
+        interval: float = 0.005,
+        include_idle: bool = False,
+        on_finish=None,
+    ) -> None:
+        """
+        Запускает выборку стеков на seconds секунд.
+
+        Args:
+            seconds (float): Длительность профилирования.
+            interval (float): Интервал между выборками в секундах.
+            include_idle (bool): Учитывать стеки ожидающих потоков.
+            on_finish (callable, optional): Вызывается с профилировщиком
+                после завершения выборки.
+
+        Raises:
+            RuntimeError: Если профилирование уже идёт.
+        """
+        with self._lock:
+            if self.running:
+                raise RuntimeError("CPU profiler is already running")
+            self._stop.clear()
+            self._stacks = Counter()
+            self.samples = 0
+            self.idle_samples = 0
+            self.seconds = max(0.0, min(seconds, MAX_PROFILE_SECONDS))
+            self.interval = max(interval, MIN_SAMPLE_INTERVAL)
+            self.include_idle = include_idle
+            self.started_at = time.time()
+            self.finished_at = None
+            self._thread = threading.Thread(
+                target=self._run,
+                args=(on_finish,),
+                name="sampling-profiler",
+                daemon=True,
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Досрочно завершает выборку и ждёт её окончания."""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            filename = os.path.basename(code.co_filename)
+            label = f"{code.co_qualname} ({filename}:{code.co_firstlineno})"
+            self._labels[code] = label
+        return label
+
+    def _run(self, on_finish) -> None:
+        own_ident = threading.get_ident()
+        deadline = time.monotonic() + self.seconds
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                if not self.include_idle and frame.f_code.co_qualname in IDLE_FUNCTIONS:
+                    self.idle_samples += 1
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(_thread_group(names.get(ident, "unknown")))
+                stack.reverse()
+                stacks.append(tuple(stack))
+            frame = None
+            with self._lock:
+                self._stacks.update(stacks)
+                self.samples += len(stacks)
+        self.finished_at = time.time()
+        if on_finish is not None:
+            try:
+                on_finish(self)
+            except Exception as e:
+                logger.error(f"Failed to export CPU profile: {e}")
+
+    def _stacks_snapshot(self) -> Counter:
+        with self._lock:
+            return self._stacks.copy()
+
+    def status(self) -> dict:
+        """Возвращает состояние профилировщика и число выборок."""
+        return {
+            "running": self.running,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "seconds": self.seconds,
+            "interval_ms": round(self.interval * 1000, 3),
+            "include_idle": self.include_idle,
+            "samples": self.samples,
+            "idle_samples": self.idle_samples,
+            "stacks": len(self._stacks),
+        }
+
+    def collapsed(self) -> str:
+        """
+        Возвращает профиль в формате collapsed stacks.
+
+        Каждая строка — стек от корня к вершине через ";" и число выборок;
+        формат понимают flamegraph.pl, speedscope и inferno.
+        """
+        stacks = sorted(self._stacks_snapshot().items())
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in stacks)
+
+    def speedscope(self) -> dict:
+        """
+        Возвращает профиль в формате speedscope (https://speedscope.app).
+
+        Для каждой группы потоков строится отдельный sampled-профиль с весом
+        выборки, равным интервалу в секундах.
+        """
+        frames, frame_index, profiles = [], {}, {}
+        for stack, count in sorted(self._stacks_snapshot().items()):
+            group, *calls = stack
+            indexes = []
+            for label in calls:
+                if label not in frame_index:
+                    frame_index[label] = len(frames)
+                    frames.append({"name": label})
+                indexes.append(frame_index[label])
+            profile = profiles.setdefault(group, {"samples": [], "weights": []})
+            profile["samples"].append(indexes)
+            profile["weights"].append(count * self.interval)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"CPU profile (pid {os.getpid()})",
+            "exporter": "debug_tools.SamplingProfiler",
+            "shared": {"frames": frames},
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": group,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": sum(profile["weights"]),
+                    **profile,
+                }
+                for group, profile in sorted(profiles.items())
+            ],
+        }
+
+    def export(self, directory: str) -> str:
+        """
+        Сохраняет профиль в файлы .collapsed и .speedscope.json.
+
+        Args:
+            directory (str): Папка для файлов профиля.
+
+        Returns:
+            str: Путь к файлам без расширения.
+        """
+        os.makedirs(directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started_at))
+        base = os.path.join(directory, f"cpu-{os.getpid()}-{stamp}")
+        with open(f"{base}.collapsed", "w", encoding="utf-8") as f:
+            f.write(self.collapsed())
+        with open(f"{base}.speedscope.json", "w", encoding="utf-8") as f:
+            json.dump(self.speedscope(), f)
+        return base
+
+
+# Профилировщик процесса: общий для эндпоинтов и сигнала SIGUSR2
+sampling_profiler = SamplingProfiler()
+
+
+def _export_profile(profiler: SamplingProfiler) -> None:
+    base = profiler.export(get_config().profile_dir)
+    logger.info(
+        f"CPU profile saved to {base}.collapsed and {base}.speedscope.json "
+        f"({profiler.samples} samples)"
+    )
+
+
+def install_profile_signal_handler() -> None:
+    """
+    Включает CPU-профилирование по сигналу SIGUSR2.
+
+    Профиль снимается PROFILE_SECONDS секунд и сохраняется в PROFILE_DIR.
+    SIGUSR1 в воркерах gunicorn занят переоткрытием журналов, поэтому
+    используется SIGUSR2. Вызывается из главного потока процесса.
+    """
+    if not hasattr(signal, "SIGUSR2"):  # Windows
+        return
+
+    def handle_sigusr2(signum, frame):
+        try:
+            sampling_profiler.start(
+                get_config().profile_seconds, on_finish=_export_profile
+            )
+        except RuntimeError:
+            return
+        logger.info(
+            f"CPU profiling started for {sampling_profiler.seconds:g}s by SIGUSR2"
+        )
+
+    signal.signal(signal.SIGUSR2, handle_sigusr2)
+
+
+def require_debug_token() -> None:
+    """
+    Пропускает запрос только с верным DEBUG_TOKEN.
+
+    Токен передаётся в заголовке X-Debug-Token. Если DEBUG_TOKEN не задан,
+    отладочные эндпоинты отключены и отвечают 404.
+    """
+    token = get_config().debug_token
+    if not token:
+        abort(404)
+    given = request.headers.get("X-Debug-Token", "")
+    if not hmac.compare_digest(given.encode("utf-8"), token.encode("utf-8")):
+        abort(403)
+
+
+def create_debug_blueprint(
+    live_objects,
+    profiler: MemoryProfiler = None,
+    cpu_profiler: SamplingProfiler = None,
+):
+    """
+    Создаёт блюпринт /debug для профилирования памяти и CPU.
+
+    Args:
+        live_objects (callable): Функция без аргументов, возвращающая
+            словарь с числом и объёмом живых объектов приложения (задачи,
+            результаты, сессии).
+        profiler (MemoryProfiler, optional): Профилировщик; по умолчанию
+            создаётся новый.
+        cpu_profiler (SamplingProfiler, optional): CPU-профилировщик; по
+            умолчанию общий sampling_profiler процесса.
+
+    Returns:
+        Blueprint: Блюпринт "debug".
+    """
+    profiler = profiler or MemoryProfiler()
+    cpu_profiler = cpu_profiler or sampling_profiler
+    bp = Blueprint("debug", __name__, url_prefix="/debug")
+    bp.before_request(require_debug_token)
+
+    def limit_arg() -> int:
+        return max(1, min(request.args.get("limit", 20, type=int), 200))
+
+    def group_by_arg() -> str:
+        group_by = request.args.get("group_by", "lineno")
+        if group_by not in ("lineno", "filename", "traceback"):
+            abort(400)
+        return group_by
+
+    @bp.route("/memory")
+    def memory_status():
+        """Состояние трассировки, RSS и живые объекты приложения."""
+        max_rss = None
+        if resource is not None:
+            # ru_maxrss в Linux указывается в килобайтах
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return jsonify(
+            {
+                "rss_bytes": _rss_bytes(),
+                "max_rss_bytes": max_rss,
+                "tracemalloc": profiler.status(),
+                "objects": live_objects(),
+            }
+        )
+
+    @bp.route("/memory/start", methods=["POST"])
+    def memory_start():
+        """Включает tracemalloc; ?frames=N задаёт глубину стека (1-100)."""
+        frames = max(1, min(request.args.get("frames", 10, type=int), 100))
+        profiler.start(frames)
+        return jsonify(profiler.status())
+
+    @bp.route("/memory/stop", methods=["POST"])
+    def memory_stop():
+        """Выключает tracemalloc и удаляет снимки."""
+        profiler.stop()
+        return jsonify(profiler.status())
+
+    @bp.route("/memory/snapshots", methods=["POST"])
+    def memory_snapshot():
+        """Делает снимок и возвращает его идентификатор и главные места."""
+        try:
+            snapshot_id = profiler.snapshot()
+        except RuntimeError as e:
+            return jsonify({"error": str(e)}), 409
+        return jsonify(
+            {
+                "id": snapshot_id,
+                **profiler.top(snapshot_id, group_by_arg(), limit_arg()),
+            }
+        )
+
+    @bp.route("/memory/snapshots/<snapshot_id>")
+    def memory_snapshot_top(snapshot_id):
+        """Главные места аллокаций в снимке."""
+        try:
+            return jsonify(profiler.top(snapshot_id, group_by_arg(), limit_arg()))
+        except KeyError:
+            abort(404)
+
+    @bp.route("/memory/diff")
+    def memory_diff():
+        """Разница между снимками ?from=<id>&to=<id>."""
+        try:
+            result = profiler.diff(
+                request.args.get("from", ""),
+                request.args.get("to", ""),
+                group_by_arg(),
+                limit_arg(),
+            )
+        except KeyError as e:
+            return jsonify({"error": f"Unknown snapshot: {e.args[0]}"}), 404
+        return jsonify(result)
+
+    @bp.route("/profile")
+    def profile_status():
+        """Состояние CPU-профилировщика."""
+        return jsonify(cpu_profiler.status())
+
+    @bp.route("/profile/start", methods=["POST"])
+    def profile_start():
+        """
+        Запускает CPU-профилирование.
+
+        Параметры: ?seconds=N (по умолчанию PROFILE_SECONDS),
+        ?interval_ms=N (по умолчанию 5), ?idle=1 — учитывать ожидание.
+        """
+        seconds = request.args.get("seconds", get_config().profile_seconds, type=float)
+        interval_ms = request.args.get("interval_ms", 5, type=float)
+        try:
+            cpu_profiler.start(
+                seconds,
+                interval=interval_ms / 1000,
+                include_idle=request.args.get("idle") == "1",
+            )
+        except RuntimeError as e:
+            return jsonify({"error": str(e)}), 409
+        return jsonify(cpu_profiler.status())
+
+    @bp.route("/profile/stop", methods=["POST"])
+    def profile_stop():
+        """Досрочно завершает CPU-профилирование."""
+        cpu_profiler.stop()
+        return jsonify(cpu_profiler.status())
+
+    @bp.route("/profile/result")
+    def profile_result():
+        """
+        Профиль в формате ?format=collapsed (по умолчанию) или speedscope.
+
+        Во время профилирования возвращает уже собранные выборки.
+        """
+        if cpu_profiler.started_at is None:
+            abort(404)
+        fmt = request.args.get("format", "collapsed")
+        if fmt == "collapsed":
+            return Response(cpu_profiler.collapsed(), mimetype="text/plain")
+        if fmt == "speedscope":
+            return jsonify(cpu_profiler.speedscope())
+        abort(400)
+
+    return bp
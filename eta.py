@@ -0,0 +1,168 @@
+# eta.py
+import threading
+
+# Этапы выполнения задачи, длительность которых накапливает оценщик
+PREPARE = "prepare"  # от запуска задачи до начала опроса FusionBrain
+UPSTREAM = "upstream"  # от начала опроса до статуса DONE
+SAVE = "save"  # от DONE до сохранения изображений
+PHASES = (PREPARE, UPSTREAM, SAVE)
+
+
+class EtaEstimator:
+    """
+    Оценка времени ожидания в очереди и завершения задачи.
+
+    По каждому этапу выполнения хранится сглаженная (EWMA) длительность.
+    Время выполнения задачи - сумма этапов, пропускная способность пула -
+    workers задач за это время. Ожидание в очереди оценивается по числу
+    задач впереди и выполняемых сейчас, время до завершения выполняемой
+    задачи - по её текущему этапу и прошедшему на нём времени. До первых
+    наблюдений используются начальные значения.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        alpha: float = 0.2,
+        prepare_seconds: float = 2.0,
+        upstream_seconds: float = 30.0,
+        save_seconds: float = 2.0,
+        min_check: float = 1.0,
+        max_check: float = 10.0,
+    ):
+        """
+        Args:
+            workers (int): Число потоков, выполняющих генерации.
+            alpha (float): Вес нового наблюдения в EWMA.
+            prepare_seconds (float): Начальная оценка этапа prepare.
+            upstream_seconds (float): Начальная оценка этапа upstream.
+            save_seconds (float): Начальная оценка этапа save.
+            min_check (float): Минимальная пауза до следующего опроса.
+            max_check (float): Максимальная пауза до следующего опроса.
+        """
+        self.workers = max(1, workers)
+        self.alpha = alpha
+        self.min_check = min_check
+        self.max_check = max_check
+        self._phases = {
+            PREPARE: prepare_seconds,
+            UPSTREAM: upstream_seconds,
+            SAVE: save_seconds,
+        }
+        self._counts = dict.fromkeys(PHASES, 0)
+        self._lock = threading.Lock()
+
+    def record(self, phase: str, seconds: float) -> None:
+        """
+        Учитывает наблюдаемую длительность этапа.
+
+        Args:
+            phase (str): prepare, upstream или save.
+            seconds (float): Длительность в секундах.
+        """
+        if seconds < 0:
+            return
+        with self._lock:
+            if self._counts[phase]:
+                self._phases[phase] += self.alpha * (seconds - self._phases[phase])
+            else:
+                # Первое наблюдение заменяет начальное значение
+                self._phases[phase] = seconds
+            self._counts[phase] += 1
+
+    def phase(self, phase: str) -> float:
+        """Текущая оценка длительности этапа в секундах."""
+        return self._phases[phase]
+
+    @property
+    def job_seconds(self) -> float:
+        """Ожидаемое время выполнения задачи целиком."""
+        return sum(self._phases.values())
+
+    def queue_wait(self, position: int, running: int) -> float:
+        """
+        Ожидаемое время до запуска задачи из очереди.
+
+        Args:
+            position (int): Число задач в очереди перед задачей.
+            running (int): Число выполняемых задач.
+
+        Returns:
+            float: Секунды до освобождения потока для задачи.
+        """
+        # Задача запустится, когда завершатся все задачи впереди, кроме
+        # workers - 1 последних; пул завершает workers задач за job_seconds
+        ahead = running + position - self.workers + 1
+        return max(0, ahead) * self.job_seconds / self.workers
+
+    def remaining(
+        self,
+        queued: bool,
+        position: int = 0,
+        running: int = 0,
+        elapsed: float = 0.0,
+        upstream_elapsed: float = None,
+        saving: bool = False,
+    ) -> float:
+        """
+        Ожидаемое время до завершения задачи.
+
+        Args:
+            queued (bool): Задача ещё в очереди.
+            position (int): Число задач в очереди перед задачей.
+            running (int): Число выполняемых задач.
+            elapsed (float): Секунды с запуска задачи.
+            upstream_elapsed (float, optional): Секунды с начала опроса
+                FusionBrain; None, если опрос не начат.
+            saving (bool): Идёт сохранение изображений.
+
+        Returns:
+            float: Секунды до завершения, не меньше min_check.
+        """
+        prepare, upstream, save = (self._phases[phase] for phase in PHASES)
+        if queued:
+            remaining = self.queue_wait(position, running) + self.job_seconds
+        elif saving:
+            remaining = save / 2
+        elif upstream_elapsed is None:
+            remaining = max(prepare - elapsed, 0.0) + upstream + save
+        else:
+            remaining = max(upstream - upstream_elapsed, 0.0) + save
+        # Задача, вышедшая за оценку, ожидается «вот-вот», а не в прошлом
+        return max(remaining, self.min_check)
+
+    def next_check(self, remaining: float) -> float:
+        """Пауза до следующего опроса статуса: к ожидаемому завершению."""
+        return round(min(max(remaining, self.min_check), self.max_check), 1)
+
+    def stats(self) -> dict:
+        """Возвращает оценки этапов и число наблюдений для /metrics."""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "job_seconds": round(self.job_seconds, 3),
+                "phases": {
+                    phase: {
+                        "seconds": round(self._phases[phase], 3),
+                        "samples": self._counts[phase],
+                    }
+                    for phase in PHASES
+                },
+            }
+
+
+def time_progress(elapsed: float, remaining: float) -> int:
+    """
+    Прогресс по времени: доля прошедшего времени от ожидаемого общего.
+
+    Args:
+        elapsed (float): Секунды с создания задачи.
+        remaining (float): Ожидаемые секунды до завершения.
+
+    Returns:
+        int: Процент 0-99; 100 выставляется только по факту завершения.
+    """
+    total = elapsed + remaining
+    if total <= 0:
+        return 0
+    return min(99, max(0, int(100 * elapsed / total)))
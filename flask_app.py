@@ -1,16 +1,31 @@
-import base64
 import json
 import logging
 import os
 import threading
 import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from io import BytesIO
 
 import requests
-from dotenv import load_dotenv
-from flask import Flask, jsonify, render_template, request, send_from_directory
-from PIL import Image
+from flask import (
+    Flask,
+    Response,
+    jsonify,
+    render_template,
+    request,
+    send_from_directory,
+    stream_with_context,
+)
+
+from config import get_config
+from debug_tools import create_debug_blueprint, install_profile_signal_handler
+from eta import UPSTREAM, EtaEstimator, time_progress
+from pipeline_router import AUTO, PipelineRouter, is_disabled
+
+# Сколько раз проверять статус генерации, прежде чем считать её зависшей;
+# пауза между проверками не больше 10 секунд (см. EtaEstimator.next_check)
+MAX_STATUS_CHECKS = 120
 
 # Настройка логирования
 logging.basicConfig(
@@ -53,11 +68,14 @@ class FusionBrainClient:
         Raises:
             ValueError: Если API Key и Secret Key не были указаны ни в параметрах, ни в переменных окружения.
         """
-        load_dotenv()
+        config = get_config()
 
-        # Если ключи не переданы явно, берём их из переменных окружения
-        self.api_key = api_key or os.getenv("FUSIONBRAIN_API_KEY")
-        self.secret_key = secret_key or os.getenv("FUSIONBRAIN_SECRET_KEY")
+        # Если ключи не переданы явно, берём первую пару из конфигурации
+        default_key, default_secret = (
+            config.credentials[0] if config.credentials else (None, None)
+        )
+        self.api_key = api_key or default_key
+        self.secret_key = secret_key or default_secret
 
         if not self.api_key or not self.secret_key:
             raise ValueError(
@@ -65,17 +83,24 @@ class FusionBrainClient:
             )
 
         # Исправленный базовый URL
-        self.base_url = os.getenv(
-            "FUSIONBRAIN_API_URL", "https://api-key.fusionbrain.ai/"
-        )
+        self.base_url = config.api_url
         self.headers = {
             "X-Key": f"Key {self.api_key}",
             "X-Secret": f"Secret {self.secret_key}",
         }
         # Словарь для хранения прогресса выполнения задач
         self.tasks_progress = {}
-        # Словарь для хранения результатов генерации
+        # Словарь для хранения результатов генерации (сырые байты изображений)
         self.tasks_results = {}
+        # Условие для уведомления потоковых ответов о новых изображениях
+        self._results_cond = threading.Condition()
+        # Оценка времени генерации FusionBrain для прогресса по времени
+        self.eta = EtaEstimator(workers=1)
+        # Выбор модели для model_id=auto по скорости и доступности
+        self.router = PipelineRouter(
+            refresh_seconds=config.pipeline_refresh_seconds,
+            disable_seconds=config.pipeline_disable_seconds,
+        )
 
     def get_models(self):
         """
@@ -110,15 +135,60 @@ class FusionBrainClient:
                 for i, pipeline in enumerate(data)
             ]
             logging.info("Retrieved %d pipelines: %s", len(models), models)
-            return models
+            self.router.update_pipelines(
+                [pipeline for pipeline in data if "id" in pipeline]
+            )
+            # Автовыбор предлагается первым, когда список моделей известен
+            return [{"id": AUTO, "name": "Авто (самая быстрая модель)"}] + models
         except requests.exceptions.RequestException as e:
             logging.error("Failed to fetch pipelines: %s", e)
+            # Следующий выбор модели повторит загрузку списка
+            self.router.invalidate()
             # Возвращаем заглушку при ошибке
             return [{"id": "kandinsky_3.1", "name": "Kandinsky 3.1"}]
         except Exception as e:
             logging.error("Unexpected error in get_models: %s", e)
+            self.router.invalidate()
             return [{"id": "kandinsky_3.1", "name": "Kandinsky 3.1"}]
 
+    def pick_model(self):
+        """
+        Выбирает самую быструю доступную модель для model_id=auto.
+
+        Список моделей обновляется не чаще раза в PIPELINE_REFRESH_SECONDS.
+        Модель, ответившая DISABLED_BY_QUEUE, временно исключается, и
+        проверяется следующая; так же пропускается модель, проверка
+        доступности которой завершилась ошибкой.
+
+        Returns:
+            str: Идентификатор модели.
+
+        Raises:
+            ValueError: Если ни одна модель не доступна.
+        """
+        if self.router.claim_refresh():
+            self.get_models()
+        elif not self.router.wait_pipelines():
+            # Загрузка другим потоком не удалась: запрашиваем список сами
+            self.get_models()
+        for model_id in self.router.candidates(AUTO):
+            try:
+                response = requests.get(
+                    f"{self.base_url}key/api/v1/pipeline/{model_id}/availability",
+                    headers=self.headers,
+                )
+                response.raise_for_status()
+                status = response.json().get("pipeline_status")
+            except (requests.exceptions.RequestException, ValueError) as e:
+                # Ошибка проверки одной модели не мешает выбрать другую
+                logging.warning("Availability check for %s failed: %s", model_id, e)
+                continue
+            self.router.record_availability(model_id, status)
+            if not is_disabled(status):
+                logging.info("Auto-selected pipeline %s", model_id)
+                return model_id
+        raise ValueError("Нет доступных моделей, попробуйте позже")
+
     def get_task_progress(self, task_id):
         """Получить текущий прогресс выполнения задачи"""
         return self.tasks_progress.get(task_id, {"status": "UNKNOWN", "progress": 0})
@@ -127,6 +197,101 @@ class FusionBrainClient:
         """Получить результат выполнения задачи"""
         return self.tasks_results.get(task_id)
 
+    def get_task_image(self, task_id, image_index):
+        """
+        Возвращает байты одного изображения задачи.
+
+        Args:
+            task_id (str): Идентификатор задачи.
+            image_index (int): Индекс изображения.
+
+        Returns:
+            bytes | None: Содержимое изображения или None, если его ещё нет.
+        """
+        for image in self.tasks_results.get(task_id, []):
+            if image["index"] == image_index:
+                return image["content"]
+        return None
+
+    def is_task_finished(self, task_id):
+        """Проверяет, завершилась ли задача (успешно или с ошибкой)"""
+        status = self.get_task_progress(task_id).get("status")
+        return status in ("COMPLETED", "FAILED", "UNKNOWN")
+
+    def iter_task_images(self, task_id, timeout=300):
+        """
+        Отдаёт изображения задачи по мере их загрузки.
+
+        Генератор блокируется до появления очередного изображения и
+        завершается, когда задача закончена и все изображения отданы.
+
+        Args:
+            task_id (str): Идентификатор задачи.
+            timeout (float): Максимальное время ожидания следующего изображения.
+
+        Yields:
+            tuple: Пара (index, bytes) для каждого изображения.
+        """
+        sent = 0
+        while True:
+            with self._results_cond:
+                ready = self._results_cond.wait_for(
+                    lambda: len(self.tasks_results.get(task_id, [])) > sent
+                    or self.is_task_finished(task_id),
+                    timeout=timeout,
+                )
+                images = self.tasks_results.get(task_id, [])
+                pending = images[sent:]
+            if not ready:
+                logging.warning("Timed out waiting for images of task %s", task_id)
+                return
+            for image in pending:
+                yield image["index"], image["content"]
+            sent += len(pending)
+            if not pending and self.is_task_finished(task_id):
+                return
+
+    def _download_results(self, task_id, file_urls):
+        """
+        Загружает изображения задачи параллельно.
+
+        Одновременно загружается не больше IMAGE_DOWNLOAD_CONCURRENCY
+        изображений; каждое публикуется в tasks_results сразу после загрузки,
+        не дожидаясь остальных.
+
+        Args:
+            task_id (str): Идентификатор задачи.
+            file_urls (list): Ссылки на изображения из ответа API.
+
+        Raises:
+            requests.exceptions.RequestException: Если загрузка не удалась.
+        """
+
+        def download(file_url):
+            img_response = requests.get(file_url)
+            img_response.raise_for_status()
+            return img_response.content
+
+        workers = max(1, min(get_config().image_download_concurrency, len(file_urls)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(download, file_url): i
+                for i, file_url in enumerate(file_urls)
+            }
+            for future in as_completed(futures):
+                content = future.result()
+                with self._results_cond:
+                    self.tasks_results[task_id].append(
+                        {"index": futures[future], "content": content}
+                    )
+                    self._results_cond.notify_all()
+
+    def _set_progress(self, task_id, progress_data):
+        """Обновляет прогресс задачи и будит ожидающие потоковые ответы"""
+        with self._results_cond:
+            self.tasks_progress[task_id] = progress_data
+            self._results_cond.notify_all()
+
     def generate_image_async(
         self,
         prompt,
@@ -150,7 +315,7 @@ class FusionBrainClient:
             task_id = str(uuid.uuid4())
 
         # Устанавливаем начальный прогресс
-        self.tasks_progress[task_id] = {"status": "PENDING", "progress": 0}
+        self._set_progress(task_id, {"status": "PENDING", "progress": 0})
 
         # Запускаем генерацию в отдельном потоке
         thread = threading.Thread(
@@ -187,32 +352,16 @@ class FusionBrainClient:
         seed=None,
     ):
         """Внутренний метод для генерации изображения в отдельном потоке"""
+        attempt = None
         try:
-            # Используем значения из .env, если параметры не переданы
-            model_id = (
-                model_id
-                if model_id is not None
-                else os.getenv("FUSIONBRAIN_MODEL_ID", "kandinsky_3.1")
-            )
-            width = (
-                width
-                if width is not None
-                else int(os.getenv("FUSIONBRAIN_WIDTH", 1024))
-            )
-            height = (
-                height
-                if height is not None
-                else int(os.getenv("FUSIONBRAIN_HEIGHT", 1024))
-            )
-            images_num = (
-                images_num
-                if images_num is not None
-                else int(os.getenv("FUSIONBRAIN_IMAGES_NUM", 1))
-            )
+            # Используем значения из конфигурации, если параметры не переданы
+            config = get_config()
+            model_id = model_id if model_id is not None else config.model_id
+            width = width if width is not None else config.width
+            height = height if height is not None else config.height
+            images_num = images_num if images_num is not None else config.images_num
             guidance_scale = (
-                guidance_scale
-                if guidance_scale is not None
-                else float(os.getenv("FUSIONBRAIN_GUIDANCE_SCALE", 7))
+                guidance_scale if guidance_scale is not None else config.guidance_scale
             )
 
             # Проверка параметров
@@ -243,13 +392,17 @@ class FusionBrainClient:
             if style:
                 params["generateParams"]["style"] = style
 
+            if model_id == AUTO:
+                model_id = self.pick_model()
+
             data = {
                 "pipeline_id": (None, model_id),
                 "params": (None, json.dumps(params), "application/json"),
             }
 
             # Обновляем прогресс - задача отправлена
-            self.tasks_progress[task_id] = {"status": "SENDING", "progress": 10}
+            self._set_progress(task_id, {"status": "SENDING", "progress": 10})
+            attempt = self.router.start(model_id)
 
             # Отправляем запрос на генерацию
             logging.info("Sending generate request with pipeline_id: %s", model_id)
@@ -262,35 +415,54 @@ class FusionBrainClient:
 
             if response.status_code != 200:
                 error_msg = response.json().get("error", response.text)
-                self.tasks_progress[task_id] = {
-                    "status": "FAILED",
-                    "progress": 0,
-                    "error": f"Ошибка при запросе генерации: {response.status_code}, {error_msg}",
-                }
+                self._set_progress(
+                    task_id,
+                    {
+                        "status": "FAILED",
+                        "progress": 0,
+                        "error": f"Ошибка при запросе генерации: {response.status_code}, {error_msg}",
+                    },
+                )
                 return
 
             # Получаем UUID задачи от API
             api_task_uuid = response.json().get("uuid")
             if not api_task_uuid:
-                self.tasks_progress[task_id] = {
-                    "status": "FAILED",
-                    "progress": 0,
-                    "error": "API response does not contain uuid",
-                }
+                self._set_progress(
+                    task_id,
+                    {
+                        "status": "FAILED",
+                        "progress": 0,
+                        "error": "API response does not contain uuid",
+                    },
+                )
                 return
 
             # Обновляем прогресс - запрос принят
-            self.tasks_progress[task_id] = {"status": "PROCESSING", "progress": 30}
+            self._set_progress(task_id, {"status": "PROCESSING", "progress": 30})
 
             # Проверяем статус задачи
             status = "PENDING"
             result = None
             start_time = time.time()
-            check_count = 0
+            delay = 1
+            checks = 0
+
+            while status in ("PENDING", "INITIAL", "PROCESSING"):
+                if checks >= MAX_STATUS_CHECKS:
+                    self._set_progress(
+                        task_id,
+                        {
+                            "status": "FAILED",
+                            "progress": 0,
+                            "error": "Генерация не завершилась за отведённое время",
+                        },
+                    )
+                    return
+                checks += 1
 
-            while status == "PENDING":
-                time.sleep(1)  # Ждем 1 секунду между запросами
-                check_count += 1
+                # Следующая проверка - к ожидаемому завершению генерации
+                time.sleep(delay)
 
                 status_response = requests.get(
                     f"{self.base_url}key/api/v1/pipeline/status/{api_task_uuid}",
@@ -302,65 +474,84 @@ class FusionBrainClient:
                     error_msg = status_response.json().get(
                         "error", status_response.text
                     )
-                    self.tasks_progress[task_id] = {
-                        "status": "FAILED",
-                        "progress": 0,
-                        "error": f"Ошибка при проверке статуса: {status_response.status_code}, {error_msg}",
-                    }
+                    self._set_progress(
+                        task_id,
+                        {
+                            "status": "FAILED",
+                            "progress": 0,
+                            "error": f"Ошибка при проверке статуса: {status_response.status_code}, {error_msg}",
+                        },
+                    )
                     return
 
                 status_data = status_response.json()
                 status = status_data.get("status")
 
-                # Прогресс от 30% до 90% в зависимости от времени ожидания
+                # Прогресс от 30% до 90% по времени относительно ожидаемого
                 elapsed = time.time() - start_time
-                progress_percent = min(90, 30 + (check_count * 5))
-
-                self.tasks_progress[task_id] = {
-                    "status": "PROCESSING",
-                    "progress": progress_percent,
-                }
+                remaining = self.eta.remaining(
+                    queued=False, elapsed=elapsed, upstream_elapsed=elapsed
+                )
+                delay = self.eta.next_check(remaining)
+
+                self._set_progress(
+                    task_id,
+                    {
+                        "status": "PROCESSING",
+                        "progress": 30 + 60 * time_progress(elapsed, remaining) // 100,
+                        "eta_seconds": round(remaining, 1),
+                        "next_check_after": delay,
+                    },
+                )
 
                 if status == "DONE":
+                    attempt.mark_done()
+                    self.eta.record(UPSTREAM, elapsed)
                     result = status_data.get("result", {}).get("files", [])
                     break
                 elif status == "FAILED":
-                    self.tasks_progress[task_id] = {
-                        "status": "FAILED",
-                        "progress": 0,
-                        "error": f"Задача завершилась с ошибкой: {status_data.get('error')}",
-                    }
+                    self._set_progress(
+                        task_id,
+                        {
+                            "status": "FAILED",
+                            "progress": 0,
+                            "error": f"Задача завершилась с ошибкой: {status_data.get('error')}",
+                        },
+                    )
                     return
 
             # Обрабатываем результат
             if result:
-                images = []
-                for i, file_url in enumerate(result):
-                    # Загружаем изображение по URL
-                    img_response = requests.get(file_url)
-                    img_response.raise_for_status()
-                    img = Image.open(BytesIO(img_response.content))
-                    img_base64 = base64.b64encode(img_response.content).decode("utf-8")
-                    images.append({"index": i, "base64": img_base64})
-
-                # Сохраняем результат
-                self.tasks_results[task_id] = images
+                with self._results_cond:
+                    self.tasks_results[task_id] = []
+                self._download_results(task_id, result)
 
                 # Обновляем статус - задача выполнена успешно
-                self.tasks_progress[task_id] = {"status": "COMPLETED", "progress": 100}
+                self._set_progress(task_id, {"status": "COMPLETED", "progress": 100})
             else:
-                self.tasks_progress[task_id] = {
-                    "status": "FAILED",
-                    "progress": 0,
-                    "error": "Не удалось получить результат генерации",
-                }
+                self._set_progress(
+                    task_id,
+                    {
+                        "status": "FAILED",
+                        "progress": 0,
+                        "error": "Не удалось получить результат генерации",
+                    },
+                )
 
         except Exception as e:
-            self.tasks_progress[task_id] = {
-                "status": "FAILED",
-                "progress": 0,
-                "error": str(e),
-            }
+            self._set_progress(
+                task_id,
+                {
+                    "status": "FAILED",
+                    "progress": 0,
+                    "error": str(e),
+                },
+            )
+        finally:
+            # Время и исход генерации учитываются при выборе модели для auto
+            if attempt is not None:
+                status = self.get_task_progress(task_id).get("status")
+                attempt.finish(status == "COMPLETED")
 
 
 # Инициализация Flask приложения
@@ -368,11 +559,53 @@ app = Flask(__name__)
 app.config["STATIC_FOLDER"] = "static"
 app.config["UPLOAD_FOLDER"] = "generated_images"
 
-# Создаём директорию для сохранения изображений, если она не существует
-os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
+# Клиент FusionBrain создаётся при первом обращении, а не при импорте модуля
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Возвращает общий клиент FusionBrain, создавая его при первом вызове.
+
+    Returns:
+        FusionBrainClient: Клиент приложения.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = FusionBrainClient()
+    return _client
+
+
+def live_objects():
+    """
+    Возвращает число и объём живых объектов приложения для /debug/memory.
+
+    Returns:
+        dict: Прогресс задач и результаты генерации с байтами изображений.
+    """
+    client = _client
+    if client is None:
+        return {"tasks_progress": 0, "tasks_results": {"tasks": 0, "images": 0}}
+    with client._results_cond:
+        results = [list(images) for images in client.tasks_results.values()]
+        progress = len(client.tasks_progress)
+    return {
+        "tasks_progress": progress,
+        "tasks_results": {
+            "tasks": len(results),
+            "images": sum(len(images) for images in results),
+            "bytes": sum(
+                len(image["content"]) for images in results for image in images
+            ),
+        },
+    }
+
 
-# Создаём клиент FusionBrain
-client = FusionBrainClient()
+# /debug/memory, доступен только при заданном DEBUG_TOKEN
+app.register_blueprint(create_debug_blueprint(live_objects))
 
 
 @app.route("/")
@@ -383,7 +616,7 @@ def index():
     """
     try:
         # Получаем список моделей для отображения в форме
-        models = client.get_models()
+        models = get_client().get_models()
     except Exception as e:
         models = [{"id": "kandinsky_3.1", "name": "Kandinsky 3.1"}]
         logging.error("Ошибка при получении моделей: %s", e)
@@ -404,7 +637,8 @@ def generate():
     Аргументы (данные формы):
         prompt (str): Обязательно. Текстовый промпт для генерации изображения.
         negative_prompt (str): Необязательно. Отрицательный промпт для исключения из генерации.
-        model_id (str): Обязательно. ID модели, используемой для генерации.
+        model_id (str): Обязательно. ID модели, используемой для генерации, или
+            "auto" - самая быстрая доступная модель.
         width (int): Необязательно. Ширина сгенерированного изображения (по умолчанию: 1024).
         height (int): Необязательно. Высота сгенерированного изображения (по умолчанию: 1024).
         images_num (int): Необязательно. Количество изображений для генерации (по умолчанию: 1).
@@ -433,7 +667,7 @@ def generate():
         return jsonify({"error": "Prompt is required"}), 400
 
     # Запускаем асинхронную генерацию
-    task_id = client.generate_image_async(
+    task_id = get_client().generate_image_async(
         prompt=prompt,
         negative_prompt=negative_prompt,
         model_id=model_id,
@@ -449,18 +683,106 @@ def generate():
 @app.route("/progress/<task_id>")
 def progress(task_id):
     # Получаем прогресс выполнения задачи
-    progress_data = client.get_task_progress(task_id)
+    progress_data = get_client().get_task_progress(task_id)
     return jsonify(progress_data)
 
 
+def _image_mimetype(content):
+    """Определяет MIME-тип изображения по сигнатуре файла"""
+    if content.startswith(b"\xff\xd8"):
+        return "image/jpeg"
+    if content.startswith(b"RIFF") and content[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/png"
+
+
 @app.route("/result/<task_id>")
 def result(task_id):
-    # Получаем результат выполнения задачи
-    result_data = client.get_task_result(task_id)
-    if result_data:
-        return jsonify({"status": "success", "images": result_data})
-    else:
-        return jsonify({"status": "not_found"})
+    """
+    Потоково отдаёт изображения задачи по мере их готовности.
+
+    По умолчанию ответ - multipart/mixed, каждая часть которого содержит
+    сырые байты одного изображения. С параметром ?format=ndjson каждая строка
+    ответа - JSON с индексом и URL изображения для /result/<task_id>/<index>.
+
+    Args:
+        task_id (str): Идентификатор задачи.
+
+    Returns:
+        Response: Потоковый ответ или JSON со статусом not_found.
+    """
+    if (
+        get_client().get_task_result(task_id) is None
+        and get_client().get_task_progress(task_id)["status"] == "UNKNOWN"
+    ):
+        return jsonify({"status": "not_found"}), 404
+
+    if request.args.get("format") == "ndjson":
+
+        def generate_ndjson():
+            for index, content in get_client().iter_task_images(task_id):
+                line = {
+                    "index": index,
+                    "url": f"/result/{task_id}/{index}",
+                    "size": len(content),
+                    "mimetype": _image_mimetype(content),
+                }
+                yield json.dumps(line) + "\n"
+
+        return Response(
+            stream_with_context(generate_ndjson()),
+            mimetype="application/x-ndjson",
+            headers={"Cache-Control": "no-store"},
+        )
+
+    boundary = uuid.uuid4().hex
+
+    def generate_multipart():
+        for index, content in get_client().iter_task_images(task_id):
+            headers = (
+                f"--{boundary}\r\n"
+                f"Content-Type: {_image_mimetype(content)}\r\n"
+                f"Content-Length: {len(content)}\r\n"
+                f'Content-Disposition: inline; name="image"; filename="{index}.png"\r\n'
+                f"X-Image-Index: {index}\r\n\r\n"
+            )
+            yield headers.encode("ascii")
+            yield content
+            yield b"\r\n"
+        yield f"--{boundary}--\r\n".encode("ascii")
+
+    return Response(
+        stream_with_context(generate_multipart()),
+        mimetype=f"multipart/mixed; boundary={boundary}",
+        headers={"Cache-Control": "no-store"},
+    )
+
+
+@app.route("/result/<task_id>/<int:image_index>")
+def result_image(task_id, image_index):
+    """
+    Отдаёт одно изображение задачи в бинарном виде.
+
+    Результат задачи неизменен, поэтому ответ кэшируется браузером навсегда
+    и поддерживает условные запросы по ETag.
+
+    Args:
+        task_id (str): Идентификатор задачи.
+        image_index (int): Индекс изображения в списке результатов.
+
+    Returns:
+        Response: Байты изображения или JSON с ошибкой 404.
+    """
+    content = get_client().get_task_image(task_id, image_index)
+    if content is None:
+        return jsonify({"status": "not_found"}), 404
+
+    response = Response(content, mimetype=_image_mimetype(content))
+    response.set_etag(f"{task_id}-{image_index}")
+    response.cache_control.public = True
+    response.cache_control.max_age = 31536000
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
 
 
 @app.route("/save/<task_id>/<int:image_index>", methods=["POST"])
@@ -475,21 +797,22 @@ def save_image(task_id, image_index):
     Returns:
         JSON: Имя файла, если изображение сохранено, или сообщение об ошибке.
     """
-    result_data = client.get_task_result(task_id)
+    # Изображения публикуются в порядке загрузки, поэтому ищутся по индексу,
+    # а не по позиции в списке результатов
+    img_data = get_client().get_task_image(task_id, image_index)
 
-    if not result_data or image_index >= len(result_data):
+    if img_data is None:
         return jsonify({"status": "error", "message": "Изображение не найдено"})
 
     try:
-        # Получаем base64 строку выбранного изображения
-        img_base64 = result_data[image_index]["base64"]
+        # Pillow нужен только здесь, поэтому импортируется по требованию
+        from PIL import Image
 
-        # Декодируем изображение из base64
-        img_data = base64.b64decode(img_base64)
         img = Image.open(BytesIO(img_data))
 
         # Создаём имя файла с временной меткой
         filename = f"fusionbrain_{int(time.time())}_{image_index}.png"
+        os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
         filepath = os.path.join(app.config["UPLOAD_FOLDER"], filename)
 
         # Сохраняем изображение
@@ -516,4 +839,5 @@ def download_file(filename):
 
 
 if __name__ == "__main__":
+    install_profile_signal_handler()
     app.run(debug=True)
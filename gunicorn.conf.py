@@ -0,0 +1,73 @@
+# gunicorn.conf.py
+# Конфигурация gunicorn для продакшена: gunicorn -c gunicorn.conf.py app:app
+import multiprocessing
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+
+# gthread: запросы обслуживаются потоками, поэтому частые опросы /task/<id>
+# не блокируют друг друга, а генерации выполняются в фоновых потоках.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+
+# Статусы задач хранятся в памяти процесса, поэтому по умолчанию один воркер:
+# опрос /task/<id> должен попадать в тот же процесс, что принял /generate.
+# GUNICORN_WORKERS=auto выбирает число воркеров по количеству CPU.
+_workers = os.getenv("GUNICORN_WORKERS", "1")
+workers = multiprocessing.cpu_count() * 2 + 1 if _workers == "auto" else int(_workers)
+threads = int(os.getenv("GUNICORN_THREADS", multiprocessing.cpu_count() * 4))
+
+# Приложение импортируется один раз в мастер-процессе; фоновые потоки
+# запускаются в каждом воркере после fork (см. post_fork).
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+# Интерфейс опрашивает статус раз в секунду: держим соединение открытым
+# дольше интервала опроса, чтобы не открывать новое на каждый запрос.
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+
+# Время на завершение генераций при остановке должно укладываться
+# в graceful_timeout, иначе мастер убьёт воркер по SIGKILL.
+drain_timeout = float(os.getenv("DRAIN_TIMEOUT", 180))
+graceful_timeout = int(drain_timeout) + 10
+
+accesslog = None
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+
+def post_fork(server, worker):
+    """Запускает фоновые службы приложения в новом воркере."""
+    import app
+
+    app.start_background_services()
+
+
+def post_worker_init(worker):
+    """
+    Устанавливает обработчики SIGHUP (перезагрузка конфигурации) и SIGUSR2
+    (снятие CPU-профиля).
+
+    Воркер сбрасывает обработчики сигналов в init_process уже после
+    post_fork, поэтому обработчики ставятся здесь. SIGHUP мастеру
+    по-прежнему перезапускает воркеры; SIGHUP воркеру перечитывает
+    конфигурацию без перезапуска.
+    """
+    from config import install_sighup_handler
+    from debug_tools import install_profile_signal_handler
+
+    install_sighup_handler()
+    install_profile_signal_handler()
+
+
+def worker_int(worker):
+    """Прекращает приём новых генераций сразу после SIGINT/SIGQUIT."""
+    import app
+
+    app.shutdown_event.set()
+
+
+def worker_exit(server, worker):
+    """Дожидается завершения генераций перед выходом воркера."""
+    import app
+
+    app.drain(drain_timeout)
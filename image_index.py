@@ -0,0 +1,165 @@
+# image_index.py
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+def shard_dir(task_id: str) -> str:
+    """
+    Возвращает каталог задачи относительно папки output.
+
+    Каталоги раскладываются по двум уровням подкаталогов по хешу task_id
+    (ab/cd/<task_id>), чтобы ни в одном каталоге не было миллионов записей.
+
+    Args:
+        task_id (str): Идентификатор задачи.
+
+    Returns:
+        str: Относительный путь вида "ab/cd/<task_id>".
+    """
+    digest = hashlib.sha1(task_id.encode("utf-8")).hexdigest()
+    # Разделитель "/" подходит и для файловой системы, и для ключей S3
+    return f"{digest[:2]}/{digest[2:4]}/{task_id}"
+
+
+class ImageRecord:
+    """Запись индекса о сохранённом изображении."""
+
+    __slots__ = ("task_id", "filename", "relpath", "size", "sha256", "created_at")
+
+    def __init__(self, task_id, filename, relpath, size, sha256, created_at):
+        self.task_id = task_id
+        self.filename = filename
+        self.relpath = relpath
+        self.size = size
+        self.sha256 = sha256
+        self.created_at = created_at
+
+
+class ImageIndex:
+    """
+    Индекс сохранённых изображений в SQLite.
+
+    Сопоставляет задаче и имени файла путь внутри хранилища изображений, размер и
+    SHA-256 содержимого. Отдача, скачивание и очистка файлов идут через
+    индекс и не обходят файловую систему.
+    """
+
+    _COLUMNS = "task_id, filename, relpath, size, sha256, created_at"
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path (str): Путь к файлу базы SQLite.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # Соединение SQLite нельзя переносить через fork, поэтому оно
+        # открывается заново в каждом процессе
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn_pid = os.getpid()
+            with self._conn:
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS images ("
+                    "task_id TEXT NOT NULL, "
+                    "filename TEXT NOT NULL, "
+                    "relpath TEXT NOT NULL, "
+                    "size INTEGER NOT NULL, "
+                    "sha256 TEXT NOT NULL, "
+                    "created_at REAL NOT NULL, "
+                    "PRIMARY KEY (task_id, filename))"
+                )
+                self._conn.execute(
+                    "CREATE INDEX IF NOT EXISTS images_created_at "
+                    "ON images (created_at)"
+                )
+        return self._conn
+
+    def add(self, task_id, filename, relpath, size, sha256) -> None:
+        """
+        Добавляет изображение в индекс.
+
+        Args:
+            task_id (str): Идентификатор задачи.
+            filename (str): Имя файла в URL.
+            relpath (str): Путь к файлу (ключ) в хранилище изображений.
+            size (int): Размер файла в байтах.
+            sha256 (str): Хеш содержимого.
+        """
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    f"INSERT OR REPLACE INTO images ({self._COLUMNS}) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (task_id, filename, relpath, size, sha256, time.time()),
+                )
+
+    def get(self, task_id: str, filename: str):
+        """Возвращает ImageRecord изображения или None."""
+        with self._lock:
+            row = (
+                self._connection()
+                .execute(
+                    f"SELECT {self._COLUMNS} FROM images "
+                    "WHERE task_id = ? AND filename = ?",
+                    (task_id, filename),
+                )
+                .fetchone()
+            )
+        return ImageRecord(*row) if row else None
+
+    def list_task(self, task_id: str) -> list:
+        """Возвращает изображения задачи в порядке имён файлов."""
+        with self._lock:
+            rows = (
+                self._connection()
+                .execute(
+                    f"SELECT {self._COLUMNS} FROM images WHERE task_id = ? "
+                    "ORDER BY filename",
+                    (task_id,),
+                )
+                .fetchall()
+            )
+        return [ImageRecord(*row) for row in rows]
+
+    def expired_tasks(self, older_than: float, limit: int = 1000) -> list:
+        """
+        Возвращает задачи, изображения которых сохранены раньше older_than.
+
+        Изображения задачи сохраняются одновременно, поэтому выборка идёт по
+        индексу created_at без группировки по всей таблице.
+
+        Args:
+            older_than (float): Граница по времени (Unix time).
+            limit (int): Максимальное число задач за вызов.
+
+        Returns:
+            list: Идентификаторы задач.
+        """
+        with self._lock:
+            rows = (
+                self._connection()
+                .execute(
+                    "SELECT DISTINCT task_id FROM images "
+                    "WHERE created_at < ? LIMIT ?",
+                    (older_than, limit),
+                )
+                .fetchall()
+            )
+        return [row[0] for row in rows]
+
+    def delete_task(self, task_id: str) -> None:
+        """Удаляет записи об изображениях задачи."""
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute("DELETE FROM images WHERE task_id = ?", (task_id,))
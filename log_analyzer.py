@@ -0,0 +1,552 @@
+# log_analyzer.py
+import argparse
+import glob
+import gzip
+import json
+import math
+import os
+import re
+import sys
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime
+
+QUEUE_WAIT_RE = re.compile(r"waited ([\d.]+)s in queue")
+ERROR_RE = re.compile(r"^(?:Network|Validation|Unexpected) error in (\w+)")
+FINISHED_RE = re.compile(r"^Task \S+ finished: (\w+)")
+
+# Журнал без меток [task=...]: задача связывается с генерацией по UUID, а
+# с идентификатором задачи - по путям сохраняемых изображений
+_UUID = r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}"
+UUID_RE = re.compile(rf"UUID:? ({_UUID})")
+LEGACY_TASK_RE = re.compile(
+    rf"^(?:Saving image to .*?|Image saved: path=|Task )({_UUID})[\\/ ]"
+)
+LEGACY_STATUS_RE = re.compile(rf"^Task {_UUID} status: (\w+)")
+FILES_RE = re.compile(r"found (\d+) files")
+
+# События до получения UUID генерации; без метки они копятся в одной
+# ожидающей хронологии
+LEGACY_PREPARE_EVENTS = frozenset(
+    {"pipeline_start", "pipeline_end", "availability_start", "availability_end"}
+)
+
+# Префикс сообщения -> (событие, запрос к FusionBrain или None)
+EVENTS = (
+    ("Requesting pipelines from", "pipeline_start", "pipelines"),
+    ("Retrieved ", "pipeline_end", None),
+    ("Requesting pipeline ID", "pipeline_start", "pipelines"),
+    ("Successfully retrieved pipeline ID", "pipeline_end", None),
+    ("Checking service availability", "availability_start", "availability"),
+    ("Service availability status", "availability_end", None),
+    ("Initiating image generation", "run_start", "run"),
+    ("Image generation initiated", "run_end", None),
+    ("Checking generation status for UUID", "poll_start", None),
+    ("Generation status:", "poll", "status"),
+    ("Generation completed", "poll_end", "status"),
+    ("No files found in the generation result", "poll_end", "status"),
+    ("Generation failed:", "poll_end", "status"),
+    ("Saving image to", "save_start", None),
+    ("Image saved:", "save_end", None),
+)
+
+# Этап -> (событие начала, событие окончания)
+STAGES = OrderedDict(
+    (
+        ("pipeline", ("pipeline_start", "pipeline_end")),
+        ("availability", ("availability_start", "availability_end")),
+        ("run", ("run_start", "run_end")),
+        ("generation", ("poll_start", "poll_end")),
+        ("save", ("save_start", "save_end")),
+    )
+)
+
+# Метод FusionBrainAPI -> запрос, ошибки которого он журналирует
+ERROR_CALLS = {
+    "list_pipelines": "pipelines",
+    "get_pipeline": "pipelines",
+    "check_availability": "availability",
+    "generate": "run",
+    "check_generation": "status",
+}
+
+
+class Histogram:
+    """
+    Гистограмма длительностей с логарифмическими корзинами.
+
+    Корзины растут в growth раз, поэтому перцентили вычисляются с
+    относительной погрешностью не больше growth - 1 при памяти,
+    не зависящей от числа значений.
+    """
+
+    def __init__(self, growth: float = 1.02, minimum: float = 0.001):
+        self._log_growth = math.log(growth)
+        self.growth = growth
+        self.minimum = minimum
+        self.buckets = Counter()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value: float) -> None:
+        """Добавляет значение в секундах."""
+        if value < self.minimum:
+            index = 0
+        else:
+            index = int(math.log(value / self.minimum) / self._log_growth) + 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p: float) -> float:
+        """Возвращает p-й перцентиль (0-100) или 0, если значений нет."""
+        if not self.count:
+            return 0.0
+        rank = math.ceil(self.count * p / 100) or 1
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                if index == 0:
+                    return self.minimum
+                # Верхняя граница корзины, но не больше максимума
+                return min(self.minimum * self.growth**index, self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        """Возвращает count, mean, p50, p90, p99 и max."""
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 3) if self.count else 0.0,
+            "p50": round(self.percentile(50), 3),
+            "p90": round(self.percentile(90), 3),
+            "p99": round(self.percentile(99), 3),
+            "max": round(self.max, 3),
+        }
+
+
+class TaskTimeline:
+    """Незавершённая задача: время первых событий каждого вида и число опросов."""
+
+    __slots__ = ("first", "last", "events", "polls", "files", "saved", "task_id")
+
+    def __init__(self, ts: float):
+        self.first = ts
+        self.last = ts
+        self.events = {}
+        self.polls = 0
+        # Для журнала без меток: ожидаемое и сохранённое число изображений
+        self.files = None
+        self.saved = 0
+        self.task_id = None
+
+
+class LogAnalyzer:
+    """
+    Однопроходный разбор журнала со сбором статистики по задачам.
+
+    Хронология задачи восстанавливается по метке [task=<id>]. В журнале
+    прежнего формата, без меток, строки связываются по содержимому: события
+    до запуска генерации относятся к генерации, UUID которой появится
+    следующим, опросы - по UUID (строки статуса без UUID - к последней
+    опрашиваемой генерации), а сохранение изображений - по идентификатору
+    задачи в пути, который связывается с последней завершившейся
+    генерацией. Такая задача закрывается после сохранения всех найденных
+    изображений или по строке со статусом задачи. При параллельных
+    генерациях без меток связывание приблизительное. Запросы к FusionBrain
+    и их ошибки считаются по всем строкам.
+
+    Строки не сохраняются, длительности копятся в гистограммах, а задачи
+    без завершения вытесняются по таймауту, поэтому память не зависит от
+    размера журнала.
+    """
+
+    def __init__(self, bucket_seconds: float = 300, task_timeout: float = 3600):
+        """
+        Args:
+            bucket_seconds (float): Ширина интервала для отчёта о
+                параллельности.
+            task_timeout (float): Через сколько секунд без событий задача
+                считается незавершённой и вытесняется из памяти.
+        """
+        self.bucket_seconds = bucket_seconds
+        self.task_timeout = task_timeout
+        self.open = OrderedDict()
+        self.stages = OrderedDict((name, Histogram()) for name in STAGES)
+        self.stages["queue"] = Histogram()
+        self.stages["total"] = Histogram()
+        self.polls = Counter()
+        self.statuses = Counter()
+        self.calls = Counter()
+        self.failures = Counter()
+        self.key_ejections = 0
+        self.lines = 0
+        self.unattributed = 0
+        self.active = 0
+        # Начало интервала -> [запущено, завершено, пик, занятые секунды]
+        self.buckets = {}
+        self._now = 0.0
+        self._second_cache = (None, 0.0)
+        # Связывание строк журнала без меток
+        self._pending = None
+        self._legacy_uuids = {}
+        self._legacy_tasks = {}
+        self._last_polled = None
+        self._last_completed = None
+
+    def _timestamp(self, second: str, millis: str) -> float:
+        # Журнал пишется по порядку, поэтому разбор секунды кешируется
+        cached_second, value = self._second_cache
+        if second != cached_second:
+            value = time.mktime(
+                datetime.strptime(second, "%Y-%m-%d %H:%M:%S").timetuple()
+            )
+            self._second_cache = (second, value)
+        return value + int(millis) / 1000
+
+    def _bucket(self, ts: float) -> list:
+        start = ts - ts % self.bucket_seconds
+        bucket = self.buckets.get(start)
+        if bucket is None:
+            bucket = self.buckets[start] = [0, 0, self.active, 0.0]
+        return bucket
+
+    def _start(self, task_id: str, timeline: TaskTimeline) -> None:
+        self.open[task_id] = timeline
+        self.active += 1
+        bucket = self._bucket(timeline.first)
+        bucket[0] += 1
+        bucket[2] = max(bucket[2], self.active)
+
+    def _close(self, task_id: str, timeline: TaskTimeline, status: str) -> None:
+        del self.open[task_id]
+        if task_id.startswith("uuid:"):
+            self._legacy_uuids.pop(task_id[5:], None)
+            self._legacy_tasks.pop(timeline.task_id, None)
+        self.active -= 1
+        self.statuses[status] += 1
+        self.polls[timeline.polls] += 1
+        for name, (start, end) in STAGES.items():
+            if start in timeline.events and end in timeline.events:
+                self.stages[name].add(timeline.events[end] - timeline.events[start])
+        self.stages["total"].add(timeline.last - timeline.first)
+
+        self._bucket(timeline.last)[1] += 1
+        # Время выполнения раскладывается по интервалам
+        ts = timeline.first
+        while ts < timeline.last:
+            bucket_end = ts - ts % self.bucket_seconds + self.bucket_seconds
+            self._bucket(ts)[3] += min(bucket_end, timeline.last) - ts
+            ts = bucket_end
+
+    def _evict(self) -> None:
+        deadline = self._now - self.task_timeout
+        while self.open:
+            task_id, timeline = next(iter(self.open.items()))
+            if timeline.last >= deadline:
+                break
+            self._close(task_id, timeline, "incomplete")
+
+    def feed(self, line: str) -> None:
+        """Разбирает одну строку журнала."""
+        # Формат строки фиксирован (см. log_context.LOG_FORMAT), поэтому поля
+        # выделяются срезами без регулярного выражения
+        if len(line) < 27 or line[19] != "," or line[23:26] != " - ":
+            return
+        level_end = line.find(" - ", 26)
+        if level_end < 0 or not line[:4].isdigit():
+            return
+        self.lines += 1
+        message = line[level_end + 3 :].rstrip("\n")
+        task_id = None
+        if message.startswith("[task="):
+            end = message.find("] ")
+            if end > 0:
+                task_id = message[6:end]
+                message = message[end + 2 :]
+        ts = self._timestamp(line[:19], line[20:23])
+        self._now = ts
+
+        if message.startswith("Key ") and "ejected" in message:
+            self.key_ejections += 1
+
+        event = None
+        for prefix, name, call in EVENTS:
+            if message.startswith(prefix):
+                event = name
+                if call:
+                    self.calls[call] += 1
+                break
+        else:
+            error = ERROR_RE.match(message)
+            if error and error.group(1) in ERROR_CALLS:
+                self.failures[ERROR_CALLS[error.group(1)]] += 1
+
+        if task_id is None:
+            self._feed_legacy(message, event, ts)
+        else:
+            timeline = self.open.get(task_id)
+            if timeline is None:
+                timeline = TaskTimeline(ts)
+                self._start(task_id, timeline)
+            else:
+                self.open.move_to_end(task_id)
+            timeline.last = ts
+
+            waited = QUEUE_WAIT_RE.search(message)
+            if waited and message.startswith("Job started"):
+                self.stages["queue"].add(float(waited.group(1)))
+            if event is not None:
+                self._record(timeline, event, ts)
+            else:
+                finished = FINISHED_RE.match(message)
+                if finished:
+                    self._close(task_id, timeline, finished.group(1))
+
+        if self.lines % 10000 == 0:
+            self._evict()
+
+    @staticmethod
+    def _record(timeline: TaskTimeline, event: str, ts: float) -> None:
+        # Для начала этапа берётся первое событие, для конца - последнее
+        if event.endswith("_end"):
+            timeline.events[event] = ts
+        else:
+            timeline.events.setdefault(event, ts)
+        if event in ("poll", "poll_end"):
+            timeline.polls += 1
+
+    def _feed_legacy(self, message: str, event, ts: float) -> None:
+        """Относит строку журнала без метки к задаче (см. описание класса)."""
+        key = None
+        uuid = UUID_RE.search(message)
+        if event in LEGACY_PREPARE_EVENTS or event == "run_start":
+            # Новый запрос списка pipeline начинает новую задачу; прежняя
+            # ожидающая хронология без генерации отбрасывается
+            if self._pending is None or event == "pipeline_start":
+                self._pending = TaskTimeline(ts)
+            self._pending.last = ts
+            self._record(self._pending, event, ts)
+            return
+        if event == "run_end" and uuid:
+            timeline = self._pending or TaskTimeline(ts)
+            self._pending = None
+            key = f"uuid:{uuid.group(1)}"
+            self._start(key, timeline)
+            self._legacy_uuids[uuid.group(1)] = key
+        elif uuid:
+            key = self._legacy_uuids.get(uuid.group(1))
+            if event == "poll_start":
+                self._last_polled = key
+        elif event in ("poll", "poll_end"):
+            key = self._last_polled
+        else:
+            task = LEGACY_TASK_RE.match(message)
+            if task:
+                key = self._legacy_tasks.get(task.group(1))
+                if key is None and event == "save_start" and self._last_completed:
+                    key = self._legacy_tasks[task.group(1)] = self._last_completed
+                    if key in self.open:
+                        self.open[key].task_id = task.group(1)
+
+        timeline = self.open.get(key) if key else None
+        if timeline is None:
+            self.unattributed += 1
+            return
+        self.open.move_to_end(key)
+        timeline.last = ts
+
+        if event is not None:
+            self._record(timeline, event, ts)
+        if event == "poll_end":
+            self._last_completed = key
+            files = FILES_RE.search(message)
+            if files:
+                timeline.files = int(files.group(1))
+            elif message.startswith("Generation failed"):
+                self._close(key, timeline, "error")
+            else:
+                self._close(key, timeline, "no_files")
+        elif event == "save_end":
+            timeline.saved += 1
+            if timeline.files is not None and timeline.saved >= timeline.files:
+                self._close(key, timeline, "completed")
+        else:
+            status = LEGACY_STATUS_RE.match(message)
+            if status:
+                self._close(key, timeline, status.group(1))
+
+    def finish(self) -> None:
+        """Закрывает задачи, оставшиеся без завершения в конце журнала."""
+        for task_id, timeline in list(self.open.items()):
+            self._close(task_id, timeline, "incomplete")
+
+    def report(self) -> dict:
+        """Возвращает результаты анализа."""
+        total_polls = sum(self.polls.values())
+        poll_percentiles = {}
+        for p in (50, 90, 99):
+            rank = math.ceil(total_polls * p / 100) or 1
+            cumulative = 0
+            for count in sorted(self.polls):
+                cumulative += self.polls[count]
+                if cumulative >= rank:
+                    poll_percentiles[f"p{p}"] = count
+                    break
+        return {
+            "lines": self.lines,
+            "unattributed_lines": self.unattributed,
+            "tasks": dict(self.statuses),
+            "stages": {name: h.summary() for name, h in self.stages.items()},
+            "polls_per_task": {
+                "distribution": {str(k): v for k, v in sorted(self.polls.items())},
+                **poll_percentiles,
+            },
+            "upstream": {
+                call: {
+                    "requests": self.calls[call],
+                    "failures": self.failures[call],
+                    "failure_rate": (
+                        round(self.failures[call] / self.calls[call], 4)
+                        if self.calls[call]
+                        else 0.0
+                    ),
+                }
+                for call in ("pipelines", "availability", "run", "status")
+            },
+            "key_ejections": self.key_ejections,
+            "concurrency": [
+                {
+                    "start": datetime.fromtimestamp(start).isoformat(),
+                    "started": started,
+                    "finished": finished,
+                    "peak": peak,
+                    "avg_in_flight": round(busy / self.bucket_seconds, 2),
+                }
+                for start, (started, finished, peak, busy) in sorted(
+                    self.buckets.items()
+                )
+            ],
+        }
+
+
+def rotated_files(path: str) -> list:
+    """
+    Возвращает журнал и его резервные копии от старых к новым.
+
+    RotatingFileHandler хранит копии как path.1 (самая новая) ... path.N.
+
+    Args:
+        path (str): Путь к основному файлу журнала.
+
+    Returns:
+        list: Пути к файлам в хронологическом порядке.
+    """
+    backups = []
+    for name in glob.glob(glob.escape(path) + ".*"):
+        suffix = name[len(path) + 1 :]
+        number = suffix[:-3] if suffix.endswith(".gz") else suffix
+        if number.isdigit():
+            backups.append((int(number), name))
+    files = [name for _, name in sorted(backups, reverse=True)]
+    for name in (path, path + ".gz"):
+        if os.path.exists(name):
+            files.append(name)
+    return files
+
+
+def open_log(path: str):
+    """Открывает журнал для чтения, распаковывая .gz."""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, encoding="utf-8", errors="replace")
+
+
+def print_report(report: dict) -> None:
+    """Выводит отчёт в виде таблиц."""
+    print(
+        f"Lines: {report['lines']} "
+        f"(without task id: {report['unattributed_lines']})"
+    )
+    print("Tasks: " + ", ".join(f"{k}={v}" for k, v in report["tasks"].items()))
+
+    print("\nStage latency, s")
+    print(
+        f"{'stage':<14}{'count':>8}{'mean':>9}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}"
+    )
+    for name, s in report["stages"].items():
+        print(
+            f"{name:<14}{s['count']:>8}{s['mean']:>9.3f}{s['p50']:>9.3f}"
+            f"{s['p90']:>9.3f}{s['p99']:>9.3f}{s['max']:>9.3f}"
+        )
+
+    polls = report["polls_per_task"]
+    print(
+        "\nStatus polls per task: "
+        + ", ".join(f"{k}: {v}" for k, v in polls["distribution"].items())
+    )
+    print(
+        "  " + ", ".join(f"{k}={polls[k]}" for k in ("p50", "p90", "p99") if k in polls)
+    )
+
+    print("\nUpstream requests")
+    print(f"{'request':<14}{'total':>8}{'failed':>8}{'rate':>8}")
+    for call, u in report["upstream"].items():
+        print(
+            f"{call:<14}{u['requests']:>8}{u['failures']:>8}"
+            f"{u['failure_rate']:>8.2%}"
+        )
+    print(f"Key ejections: {report['key_ejections']}")
+
+    print("\nConcurrency")
+    print(f"{'interval':<22}{'started':>9}{'finished':>9}{'peak':>6}{'avg':>8}")
+    for c in report["concurrency"]:
+        print(
+            f"{c['start']:<22}{c['started']:>9}{c['finished']:>9}"
+            f"{c['peak']:>6}{c['avg_in_flight']:>8.2f}"
+        )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Latency report for app.log and its rotated backups"
+    )
+    parser.add_argument(
+        "logs", nargs="*", default=["app.log"], help="log files (default: app.log)"
+    )
+    parser.add_argument(
+        "--bucket", type=float, default=300, help="concurrency interval, seconds"
+    )
+    parser.add_argument(
+        "--task-timeout",
+        type=float,
+        default=3600,
+        help="seconds without events before a task counts as incomplete",
+    )
+    parser.add_argument("--json", action="store_true", help="print JSON")
+    args = parser.parse_args(argv)
+
+    analyzer = LogAnalyzer(args.bucket, args.task_timeout)
+    for log in args.logs:
+        files = rotated_files(log)
+        if not files:
+            print(f"Log file not found: {log}", file=sys.stderr)
+            return 1
+        for path in files:
+            with open_log(path) as f:
+                for line in f:
+                    analyzer.feed(line)
+    analyzer.finish()
+
+    report = analyzer.report()
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
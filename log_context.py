@@ -0,0 +1,39 @@
+# log_context.py
+import contextvars
+import logging
+from contextlib import contextmanager
+
+# Идентификатор задачи, которую обрабатывает текущий поток
+_current_task = contextvars.ContextVar("current_task", default=None)
+
+# Формат строк журнала; %(task)s пуст вне задачи
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(task)s%(message)s"
+
+
+@contextmanager
+def task_log_context(task_id: str):
+    """
+    Помечает записи журнала внутри блока идентификатором задачи.
+
+    Args:
+        task_id (str): Идентификатор задачи.
+    """
+    token = _current_task.set(task_id)
+    try:
+        yield
+    finally:
+        _current_task.reset(token)
+
+
+class TaskLogFilter(logging.Filter):
+    """
+    Добавляет в запись журнала поле task вида "[task=<id>] ".
+
+    По этой метке log_analyzer собирает хронологию каждой задачи. Вне
+    задачи поле пустое, и строка журнала выглядит как раньше.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        task_id = _current_task.get()
+        record.task = f"[task={task_id}] " if task_id else ""
+        return True
@@ -0,0 +1,298 @@
+# pipeline_router.py
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Значение параметра pipeline, при котором маршрутизатор выбирает сам
+AUTO = "auto"
+
+# Типы pipeline, генерирующие изображение по тексту; пустой тип у старых ответов
+COMPATIBLE_TYPES = frozenset({"", "TEXT2IMAGE"})
+
+# Статусы доступности, при которых pipeline не принимает генерации
+DISABLED_STATUSES = frozenset({"DISABLED_BY_QUEUE", "DISABLED_MANUALLY"})
+
+# Сколько секунд ждать первой загрузки списка pipeline другим потоком
+LOAD_TIMEOUT = 30
+
+
+def is_disabled(status) -> bool:
+    """Проверяет, что pipeline_status из availability запрещает генерацию."""
+    return status in DISABLED_STATUSES
+
+
+class PipelineState:
+    """Наблюдаемое состояние одного pipeline."""
+
+    __slots__ = (
+        "pipeline_id",
+        "name",
+        "type",
+        "availability",
+        "disabled_until",
+        "latency",
+        "success_rate",
+        "in_flight",
+        "total",
+        "failures",
+    )
+
+    def __init__(self, pipeline_id: str, name: str = "", type: str = ""):
+        self.pipeline_id = pipeline_id
+        self.name = name
+        self.type = type
+        self.availability = None
+        self.disabled_until = 0.0
+        # Сглаженное время генерации в секундах; None, пока нет наблюдений
+        self.latency = None
+        self.success_rate = 1.0
+        self.in_flight = 0
+        self.total = 0
+        self.failures = 0
+
+
+class PipelineAttempt:
+    """
+    Генерация на выбранном pipeline.
+
+    Время генерации считается от создания попытки до первого увиденного
+    статуса DONE (mark_done), без скачивания и сохранения результата.
+    """
+
+    def __init__(self, router: "PipelineRouter", pipeline_id: str):
+        self.router = router
+        self.pipeline_id = pipeline_id
+        self.started = time.monotonic()
+        self.done_at = None
+        self._finished = False
+
+    def mark_done(self) -> None:
+        """Отмечает первый ответ со статусом DONE; повторные вызовы игнорируются."""
+        if self.done_at is None:
+            self.done_at = time.monotonic()
+
+    def finish(self, success) -> None:
+        """
+        Учитывает результат генерации; повторные вызовы игнорируются.
+
+        Args:
+            success (bool | None): Успех генерации; None - генерация
+                прервана (отменена) и в статистику не попадает.
+        """
+        if self._finished:
+            return
+        self._finished = True
+        ended = self.done_at if self.done_at is not None else time.monotonic()
+        self.router._finish(self.pipeline_id, ended - self.started, success)
+
+
+class PipelineRouter:
+    """
+    Выбор pipeline FusionBrain по наблюдаемой скорости и надёжности.
+
+    Для каждого pipeline хранятся последний статус доступности, сглаженное
+    (EWMA) время генерации и доля успешных генераций. В режиме auto новая
+    генерация уходит на самый быстрый исправный совместимый pipeline;
+    pipeline, ответивший DISABLED_BY_QUEUE, исключается на disable_seconds,
+    и генерация переходит к следующему кандидату. Pipeline без наблюдений
+    считается не медленнее самого быстрого, чтобы его скорость была измерена.
+    """
+
+    def __init__(
+        self,
+        refresh_seconds: float = 300,
+        disable_seconds: float = 60,
+        alpha: float = 0.2,
+    ):
+        """
+        Args:
+            refresh_seconds (float): Как часто обновлять список pipeline.
+            disable_seconds (float): На сколько исключать недоступный pipeline.
+            alpha (float): Вес нового наблюдения в EWMA.
+        """
+        self.refresh_seconds = refresh_seconds
+        self.disable_seconds = disable_seconds
+        self.alpha = alpha
+        self._pipelines = {}
+        self._order = []
+        self._refreshed_at = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._loaded = threading.Condition(self._lock)
+
+    def claim_refresh(self) -> bool:
+        """
+        Проверяет, пора ли обновить список pipeline, и занимает обновление.
+
+        Returns:
+            bool: True, если вызывающий должен загрузить список и передать
+            его в update_pipelines (или вызвать invalidate при ошибке).
+            Остальные потоки в это время работают со старым списком, а пока
+            списка нет - ждут его в wait_pipelines.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._refreshing or (
+                self._refreshed_at is not None
+                and now - self._refreshed_at < self.refresh_seconds
+            ):
+                return False
+            self._refreshed_at = now
+            self._refreshing = True
+            return True
+
+    def wait_pipelines(self, timeout: float = LOAD_TIMEOUT) -> bool:
+        """
+        Ждёт, пока другой поток загрузит список pipeline, если его ещё нет.
+
+        Args:
+            timeout (float): Максимальное время ожидания в секундах.
+
+        Returns:
+            bool: True, если список загружен; False, если загрузка не
+            удалась или не успела - тогда вызывающий загружает список сам.
+        """
+        with self._lock:
+            self._loaded.wait_for(
+                lambda: self._order or not self._refreshing, timeout=timeout
+            )
+            return bool(self._order)
+
+    def update_pipelines(self, pipelines: list) -> None:
+        """
+        Заменяет список pipeline, сохраняя накопленную статистику.
+
+        Args:
+            pipelines (list): Словари с ключами id, name и type из ответа
+                key/api/v1/pipelines в порядке API.
+        """
+        with self._lock:
+            order = []
+            for entry in pipelines:
+                pipeline_id = str(entry["id"])
+                state = self._pipelines.get(pipeline_id)
+                if state is None:
+                    state = self._pipelines[pipeline_id] = PipelineState(pipeline_id)
+                state.name = entry.get("name") or state.name
+                state.type = entry.get("type") or ""
+                order.append(pipeline_id)
+            self._order = order
+            self._refreshing = False
+            self._loaded.notify_all()
+        logger.info(f"Pipeline list updated: {', '.join(order) or 'empty'}")
+
+    def invalidate(self) -> None:
+        """Требует обновить список pipeline при следующем выборе."""
+        with self._lock:
+            self._refreshed_at = None
+            self._refreshing = False
+            self._loaded.notify_all()
+
+    def _state(self, pipeline_id: str) -> PipelineState:
+        state = self._pipelines.get(pipeline_id)
+        if state is None:
+            state = self._pipelines[pipeline_id] = PipelineState(pipeline_id)
+        return state
+
+    def candidates(self, requested: str = None) -> list:
+        """
+        Возвращает pipeline в порядке попыток.
+
+        Args:
+            requested (str, optional): Pipeline, выбранный клиентом; None или
+                "auto" - выбор маршрутизатора.
+
+        Returns:
+            list: Идентификаторы pipeline. Для явно выбранного pipeline -
+            только он. В режиме auto сначала исправные по возрастанию
+            ожидаемого времени, затем временно исключённые (их доступность
+            могла восстановиться).
+        """
+        if requested and requested != AUTO:
+            return [requested]
+        now = time.monotonic()
+        with self._lock:
+            states = [
+                self._pipelines[pipeline_id]
+                for pipeline_id in self._order
+                if self._pipelines[pipeline_id].type in COMPATIBLE_TYPES
+            ]
+            known = [s.latency for s in states if s.latency is not None]
+            fastest = min(known) if known else 0.0
+
+            def score(state):
+                latency = state.latency if state.latency is not None else fastest
+                return (latency + 1.0) / max(state.success_rate, 0.05)
+
+            healthy = [s for s in states if s.disabled_until <= now]
+            disabled = [s for s in states if s.disabled_until > now]
+            healthy.sort(key=score)
+            disabled.sort(key=lambda s: s.disabled_until)
+        return [s.pipeline_id for s in healthy + disabled]
+
+    def record_availability(self, pipeline_id: str, status) -> None:
+        """
+        Запоминает статус доступности pipeline.
+
+        Args:
+            pipeline_id (str): Идентификатор pipeline.
+            status (str | None): pipeline_status из ответа availability.
+        """
+        with self._lock:
+            state = self._state(pipeline_id)
+            state.availability = status
+            if is_disabled(status):
+                state.disabled_until = time.monotonic() + self.disable_seconds
+            else:
+                state.disabled_until = 0.0
+        if is_disabled(status):
+            logger.warning(
+                f"Pipeline {pipeline_id} reported {status}, excluded for "
+                f"{self.disable_seconds:g}s"
+            )
+
+    def start(self, pipeline_id: str) -> PipelineAttempt:
+        """Отмечает начало генерации на pipeline."""
+        with self._lock:
+            self._state(pipeline_id).in_flight += 1
+        return PipelineAttempt(self, pipeline_id)
+
+    def _finish(self, pipeline_id: str, elapsed: float, success) -> None:
+        with self._lock:
+            state = self._state(pipeline_id)
+            state.in_flight -= 1
+            if success is None:
+                return
+            state.total += 1
+            state.success_rate += self.alpha * (float(success) - state.success_rate)
+            if success:
+                if state.latency is None:
+                    state.latency = elapsed
+                else:
+                    state.latency += self.alpha * (elapsed - state.latency)
+            else:
+                state.failures += 1
+
+    def stats(self) -> list:
+        """Возвращает статистику по pipeline для /metrics."""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "pipeline_id": state.pipeline_id,
+                    "name": state.name,
+                    "type": state.type,
+                    "availability": state.availability,
+                    "disabled_for": round(max(0.0, state.disabled_until - now), 1),
+                    "latency_seconds": (
+                        round(state.latency, 3) if state.latency is not None else None
+                    ),
+                    "success_rate": round(state.success_rate, 3),
+                    "in_flight": state.in_flight,
+                    "total": state.total,
+                    "failures": state.failures,
+                }
+                for state in self._pipelines.values()
+            ]
@@ -0,0 +1,398 @@
+# scheduler.py
+import heapq
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+
+from log_context import task_log_context
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = (INTERACTIVE, BATCH)
+
+
+class QueueFullError(Exception):
+    """Клиент превысил допустимое число задач в очереди."""
+
+
+class Job:
+    """Задача генерации, ожидающая выполнения в планировщике."""
+
+    __slots__ = (
+        "task_id",
+        "client_id",
+        "priority",
+        "target",
+        "args",
+        "submitted_at",
+        "deadline",
+        "seq",
+    )
+
+    def __init__(self, task_id, client_id, priority, target, args, deadline=None):
+        self.task_id = task_id
+        self.client_id = client_id
+        self.priority = priority
+        self.target = target
+        self.args = args
+        self.submitted_at = time.monotonic()
+        self.deadline = deadline
+        # Номер задачи среди задач клиента в классе (см. _ClientQueue)
+        self.seq = 0
+
+
+class _ClientQueue(deque):
+    """Очередь задач клиента; задачи нумеруются по порядку постановки."""
+
+    def __init__(self):
+        super().__init__()
+        self.next_seq = 0
+
+
+class GenerationScheduler:
+    """
+    Планировщик генераций с классами приоритета и справедливой очередью.
+
+    Задачи выполняются фиксированным пулом потоков. Между классами
+    приоритета (interactive и batch) время делится пропорционально весам
+    (stride scheduling), внутри класса клиенты обслуживаются по кругу, так что
+    клиент с сотнями задач не задерживает остальных. Число одновременно
+    выполняемых задач одного клиента ограничено max_running_per_client.
+
+    Задача, срок выполнения которой истёк в очереди, убирается из неё при
+    следующей постановке задачи или запросе места в очереди и передаётся
+    в on_expired; лимиты и места в очереди она больше не занимает.
+    """
+
+    def __init__(
+        self,
+        workers: int = 4,
+        weights: dict = None,
+        max_running_per_client: int = 2,
+        max_queued_per_client: int = 100,
+        on_expired=None,
+    ):
+        """
+        Args:
+            workers (int): Число потоков, выполняющих генерации.
+            weights (dict, optional): Веса классов приоритета.
+            max_running_per_client (int): Лимит одновременных задач клиента.
+            max_queued_per_client (int): Лимит задач клиента в очереди.
+            on_expired (callable, optional): Функция on_expired(task_id) для
+                задачи, убранной из очереди по сроку выполнения; вызывается
+                вне блокировки планировщика.
+        """
+        self.workers = workers
+        self.weights = weights or {INTERACTIVE: 4, BATCH: 1}
+        self.max_running_per_client = max_running_per_client
+        self.max_queued_per_client = max_queued_per_client
+        self.on_expired = on_expired
+
+        # Для каждого класса: клиент -> очередь его задач (порядок = круг)
+        self._queues = {priority: OrderedDict() for priority in PRIORITIES}
+        # Виртуальное время класса для stride scheduling
+        self._pass = {priority: 0.0 for priority in PRIORITIES}
+        # Число задач в очереди каждого класса
+        self._counts = {priority: 0 for priority in PRIORITIES}
+        self._queued = {}  # task_id -> Job
+        # Куча (срок, task_id) задач очереди со сроком выполнения
+        self._deadlines = []
+        self._running = {}  # task_id -> Job
+        self._running_per_client = {}
+        self._cond = threading.Condition()
+        self._threads = []
+        self._stopping = False
+
+    def start(self) -> None:
+        """Запускает потоки-исполнители."""
+        with self._cond:
+            self._stopping = False
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._worker, name=f"generation-worker-{i + 1}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+        logger.info(f"Generation scheduler started with {self.workers} workers")
+
+    def submit(
+        self, task_id, client_id, priority, target, args=(), deadline=None
+    ) -> int:
+        """
+        Ставит задачу в очередь.
+
+        Args:
+            task_id (str): Идентификатор задачи.
+            client_id (str): Идентификатор клиента для справедливой очереди.
+            priority (str): Класс приоритета: interactive или batch.
+            target (callable): Функция, выполняющая задачу.
+            args (tuple): Аргументы функции.
+            deadline (float, optional): Срок выполнения (time.time()), после
+                которого задача не запускается.
+
+        Returns:
+            int: Оценка числа задач, которые будут запущены раньше этой
+            (см. queue_position).
+
+        Raises:
+            ValueError: Если указан неизвестный класс приоритета.
+            QueueFullError: Если клиент превысил лимит задач в очереди.
+        """
+        if priority not in self._queues:
+            raise ValueError(f"Unknown priority: {priority}")
+
+        # Просроченные задачи клиента не должны занимать его лимит
+        self.expire_overdue()
+        with self._cond:
+            queues = self._queues[priority]
+            client_queue = queues.get(client_id)
+            if client_queue is None:
+                client_queue = queues[client_id] = _ClientQueue()
+                # Простаивавший класс не должен копить кредит времени
+                if len(queues) == 1:
+                    self._pass[priority] = max(
+                        self._pass[priority], self._min_active_pass(exclude=priority)
+                    )
+            if len(client_queue) >= self.max_queued_per_client:
+                if not client_queue:
+                    del queues[client_id]
+                raise QueueFullError(
+                    f"Client {client_id} has too many queued tasks "
+                    f"(limit {self.max_queued_per_client})"
+                )
+            job = Job(task_id, client_id, priority, target, args, deadline)
+            job.seq = client_queue.next_seq
+            client_queue.next_seq += 1
+            client_queue.append(job)
+            self._queued[task_id] = job
+            self._counts[priority] += 1
+            if deadline is not None:
+                heapq.heappush(self._deadlines, (deadline, task_id))
+            self._cond.notify()
+            return self._position(job)
+
+    def _min_active_pass(self, exclude):
+        active = [
+            self._pass[priority]
+            for priority, queues in self._queues.items()
+            if queues and priority != exclude
+        ]
+        return min(active) if active else 0.0
+
+    def _pick(self):
+        """Выбирает следующую задачу. Вызывается под self._cond."""
+        candidates = sorted(
+            (priority for priority in PRIORITIES if self._queues[priority]),
+            key=lambda priority: self._pass[priority],
+        )
+        for priority in candidates:
+            queues = self._queues[priority]
+            for client_id in list(queues):
+                running = self._running_per_client.get(client_id, 0)
+                if running >= self.max_running_per_client:
+                    continue
+                client_queue = queues.pop(client_id)
+                job = client_queue.popleft()
+                if client_queue:
+                    # Клиент уходит в конец круга
+                    queues[client_id] = client_queue
+                self._pass[priority] += 1.0 / self.weights.get(priority, 1)
+                self._counts[priority] -= 1
+                return job
+        return None
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                job = None
+                while not self._stopping:
+                    job = self._pick()
+                    if job is not None:
+                        break
+                    self._cond.wait()
+                if job is None:
+                    return
+                del self._queued[job.task_id]
+                self._running[job.task_id] = job
+                self._running_per_client[job.client_id] = (
+                    self._running_per_client.get(job.client_id, 0) + 1
+                )
+
+            try:
+                # Все записи журнала задачи помечаются её идентификатором
+                with task_log_context(job.task_id):
+                    logger.info(
+                        f"Job started ({job.priority}), waited "
+                        f"{time.monotonic() - job.submitted_at:.3f}s in queue"
+                    )
+                    job.target(*job.args)
+            except Exception as e:
+                logger.error(f"Unhandled error in task {job.task_id}: {e}")
+            finally:
+                with self._cond:
+                    del self._running[job.task_id]
+                    remaining = self._running_per_client[job.client_id] - 1
+                    if remaining:
+                        self._running_per_client[job.client_id] = remaining
+                    else:
+                        del self._running_per_client[job.client_id]
+                    self._cond.notify_all()
+
+    def shutdown(self, timeout: float) -> list:
+        """
+        Прекращает выдачу новых задач и ждёт завершения выполняемых.
+
+        Задачи, оставшиеся в очереди, не запускаются.
+
+        Args:
+            timeout (float): Максимальное время ожидания в секундах.
+
+        Returns:
+            list: Идентификаторы задач, не завершившихся за отведённое время
+            (выполнявшихся и оставшихся в очереди).
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            while self._running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return list(self._running) + list(self._queued)
+
+    def cancel(self, task_id) -> bool:
+        """
+        Убирает задачу из очереди, если она ещё не запущена.
+
+        Returns:
+            bool: True, если задача ожидала в очереди и удалена из неё.
+        """
+        with self._cond:
+            job = self._queued.pop(task_id, None)
+            if job is None:
+                return False
+            self._remove(job)
+            return True
+
+    def _remove(self, job) -> None:
+        """Убирает задачу из очереди её клиента. Вызывается под self._cond."""
+        queues = self._queues[job.priority]
+        client_queue = queues[job.client_id]
+        client_queue.remove(job)
+        if not client_queue:
+            del queues[job.client_id]
+        self._counts[job.priority] -= 1
+
+    def expire_overdue(self) -> list:
+        """
+        Убирает из очереди задачи с истёкшим сроком выполнения.
+
+        Для каждой убранной задачи вызывается on_expired.
+
+        Returns:
+            list: Идентификаторы убранных задач.
+        """
+        expired = []
+        now = time.time()
+        with self._cond:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                deadline, task_id = heapq.heappop(self._deadlines)
+                job = self._queued.get(task_id)
+                # Запись кучи могла остаться от запущенной или отменённой задачи
+                if job is None or job.deadline != deadline:
+                    continue
+                del self._queued[task_id]
+                self._remove(job)
+                expired.append(task_id)
+        for task_id in expired:
+            logger.info(f"Task {task_id} expired in queue")
+            if self.on_expired is not None:
+                try:
+                    self.on_expired(task_id)
+                except Exception as e:
+                    logger.error(f"Failed to expire task {task_id}: {e}")
+        return expired
+
+    def _position(self, job) -> int:
+        """
+        Оценивает число задач, которые будут запущены раньше job.
+
+        Повторяет порядок выдачи _pick: внутри класса клиенты обслуживаются
+        по кругу, поэтому перед k-й задачей клиента каждый другой клиент
+        класса запускает до k задач и в среднем ещё половину круга. Другие
+        классы за это время получают задачи по своим весам: класс
+        выбирается, пока его виртуальное время меньше того, при котором
+        будет выбрана job. Лимит одновременных задач клиента не учитывается.
+        Вычисляется по счётчикам без перебора очереди; вызывается под
+        self._cond.
+        """
+        priority = job.priority
+        queues = self._queues[priority]
+        client_queue = queues[job.client_id]
+        # Номера задач клиента идут подряд; отменённая задача из середины
+        # очереди лишь немного завышает оценку
+        own = job.seq - client_queue[0].seq
+        others = len(queues) - 1
+        others_queued = self._counts[priority] - len(client_queue)
+        ahead = own + min(others_queued, own * others + (others + 1) // 2)
+
+        target = self._pass[priority] + ahead / self.weights.get(priority, 1)
+        for other, queued in self._counts.items():
+            if other == priority or not queued:
+                continue
+            share = (target - self._pass[other]) * self.weights.get(other, 1)
+            ahead += min(queued, max(0, math.ceil(round(share, 9))))
+        return ahead
+
+    def queue_position(self, task_id):
+        """
+        Возвращает оценку числа задач, которые будут запущены раньше task_id,
+        или None, если задача не ожидает в очереди.
+
+        Сначала из очереди убираются просроченные задачи (см. expire_overdue).
+        """
+        self.expire_overdue()
+        with self._cond:
+            job = self._queued.get(task_id)
+            if job is None:
+                return None
+            return self._position(job)
+
+    def running_count(self) -> int:
+        with self._cond:
+            return len(self._running)
+
+    def stats(self) -> dict:
+        """Возвращает текущую загрузку планировщика."""
+        self.expire_overdue()
+        with self._cond:
+            return {
+                "workers": self.workers,
+                "running": len(self._running),
+                "queued": dict(self._counts),
+                "clients_running": dict(self._running_per_client),
+            }
+
+
+def parse_weights(value: str) -> dict:
+    """
+    Разбирает веса классов приоритета из строки вида "interactive=4,batch=1".
+
+    Raises:
+        ValueError: Если строка имеет неверный формат.
+    """
+    weights = {INTERACTIVE: 4, BATCH: 1}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, weight = item.partition("=")
+        if name not in weights or float(weight) <= 0:
+            raise ValueError(f"Invalid scheduler weight: {item}")
+        weights[name] = float(weight)
+    return weights
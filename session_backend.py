@@ -0,0 +1,359 @@
+# session_backend.py
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import (
+    SecureCookieSessionInterface,
+    SessionInterface,
+    SessionMixin,
+)
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+logger = logging.getLogger(__name__)
+
+# Эндпоинты, которым сессия не нужна: для них она не читается и не сохраняется
+DEFAULT_EXEMPT_ENDPOINTS = frozenset(
+    {
+        "task_status",
+        "bulk_task_status",
+        "serve_image",
+        "download_image",
+        "download_task_zip",
+        "download_batch_zip",
+        "metrics",
+        "memory_status",
+        "memory_start",
+        "memory_stop",
+        "memory_snapshot",
+        "memory_snapshot_top",
+        "memory_diff",
+        "profile_status",
+        "profile_start",
+        "profile_stop",
+        "profile_result",
+        "debug_list_tasks",
+    }
+)
+
+
+def _is_exempt(app, request) -> bool:
+    """Проверяет, нужно ли пропустить работу с сессией для текущего запроса."""
+    exempt = app.config.get("SESSION_EXEMPT_ENDPOINTS", DEFAULT_EXEMPT_ENDPOINTS)
+    endpoint = request.endpoint or ""
+    # Эндпоинты блюпринтов сравниваются по имени без префикса "blueprint."
+    name = endpoint.rpartition(".")[2]
+    return endpoint in exempt or name in exempt or name == "static"
+
+
+class CookieSessionInterface(SecureCookieSessionInterface):
+    """
+    Сессия в подписанной cookie без хранения состояния на сервере.
+
+    Для эндпоинтов из SESSION_EXEMPT_ENDPOINTS cookie не разбирается и не
+    выставляется заново. Непустая сессия подписывается заново при каждом
+    ответе: подпись старше PERMANENT_SESSION_LIFETIME не принимается, и
+    активный пользователь иначе терял бы сессию через этот срок.
+    """
+
+    def open_session(self, app, request):
+        if _is_exempt(app, request):
+            return self.make_null_session(app)
+        return super().open_session(app, request)
+
+    def should_set_cookie(self, app, session) -> bool:
+        return session.modified or (
+            bool(session) and app.config["SESSION_REFRESH_EACH_REQUEST"]
+        )
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Сессия, данные которой хранятся на сервере, а в cookie лежит только её id."""
+
+    def __init__(self, initial=None, sid=None, new=False, expires=None):
+        def on_update(session):
+            session.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        # Время истечения, записанное в хранилище (Unix time)
+        self.expires = expires
+
+
+class MemorySessionStore:
+    """
+    Хранилище сессий в памяти процесса с ограничением по количеству записей.
+
+    При превышении max_entries вытесняются давно не использованные сессии.
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sid: str):
+        """Возвращает (данные, время истечения) сессии или None."""
+        with self._lock:
+            item = self._data.get(sid)
+            if item is None:
+                return None
+            expires, payload = item
+            if expires < time.time():
+                del self._data[sid]
+                return None
+            self._data.move_to_end(sid)
+            return payload, expires
+
+    def set(self, sid: str, payload: str, expires: float) -> None:
+        with self._lock:
+            self._data[sid] = (expires, payload)
+            self._data.move_to_end(sid)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, sid: str) -> None:
+        with self._lock:
+            self._data.pop(sid, None)
+
+    def gc(self) -> int:
+        """Удаляет просроченные сессии и возвращает их количество."""
+        now = time.time()
+        with self._lock:
+            expired = [sid for sid, (exp, _) in self._data.items() if exp < now]
+            for sid in expired:
+                del self._data[sid]
+        return len(expired)
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+
+class SqliteSessionStore:
+    """
+    Хранилище сессий в SQLite с индексом по времени истечения.
+
+    Один файл вместо каталога с файлом на каждого посетителя; просроченные
+    записи удаляются через gc() по индексу, не просматривая всю таблицу.
+    Соединение открывается при первом обращении в каждом процессе, поэтому
+    хранилище можно создать до fork (gunicorn preload_app).
+    """
+
+    def __init__(self, path: str, max_entries: int = 100000):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # Соединение SQLite нельзя переносить через fork, поэтому оно
+        # открывается заново в каждом процессе
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn_pid = os.getpid()
+            with self._conn:
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS sessions ("
+                    "sid TEXT PRIMARY KEY, payload TEXT NOT NULL, expires REAL NOT NULL)"
+                )
+                self._conn.execute(
+                    "CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires)"
+                )
+        return self._conn
+
+    def get(self, sid: str):
+        """Возвращает (данные, время истечения) сессии или None."""
+        with self._lock:
+            row = (
+                self._connection()
+                .execute(
+                    "SELECT payload, expires FROM sessions "
+                    "WHERE sid = ? AND expires >= ?",
+                    (sid, time.time()),
+                )
+                .fetchone()
+            )
+        return tuple(row) if row else None
+
+    def set(self, sid: str, payload: str, expires: float) -> None:
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO sessions (sid, payload, expires) VALUES (?, ?, ?)",
+                    (sid, payload, expires),
+                )
+
+    def delete(self, sid: str) -> None:
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+    def gc(self) -> int:
+        """Удаляет просроченные и лишние сессии и возвращает их количество."""
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                deleted = conn.execute(
+                    "DELETE FROM sessions WHERE expires < ?", (time.time(),)
+                ).rowcount
+                overflow = (
+                    conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+                    - self.max_entries
+                )
+                if overflow > 0:
+                    deleted += conn.execute(
+                        "DELETE FROM sessions WHERE sid IN ("
+                        "SELECT sid FROM sessions ORDER BY expires LIMIT ?)",
+                        (overflow,),
+                    ).rowcount
+        return deleted
+
+    def count(self) -> int:
+        with self._lock:
+            return (
+                self._connection()
+                .execute("SELECT COUNT(*) FROM sessions")
+                .fetchone()[0]
+            )
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    Интерфейс сессий Flask поверх MemorySessionStore или SqliteSessionStore.
+
+    В cookie хранится подписанный идентификатор сессии. Сборка мусора
+    выполняется не чаще одного раза в gc_interval секунд при сохранении сессии.
+    Срок жизни неизменённой сессии продлевается при обращении, но не чаще
+    одного раза в gc_interval секунд, чтобы не писать в хранилище на каждый
+    запрос.
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store, gc_interval: float = 600):
+        self.store = store
+        self.gc_interval = gc_interval
+        self._last_gc = time.time()
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt="server-side-session")
+
+    def open_session(self, app, request):
+        if _is_exempt(app, request):
+            return self.make_null_session(app)
+
+        signed_sid = request.cookies.get(self.get_cookie_name(app))
+        if signed_sid:
+            try:
+                sid = self._signer(app).unsign(signed_sid).decode("utf-8")
+            except BadSignature:
+                sid = None
+            if sid:
+                stored = self.store.get(sid)
+                if stored is not None:
+                    payload, expires = stored
+                    return ServerSideSession(
+                        self.serializer.loads(payload), sid=sid, expires=expires
+                    )
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        now = time.time()
+        # Сессия, записанная больше gc_interval секунд назад, продлевается
+        stale = session.expires is not None and (
+            session.expires - lifetime <= now - self.gc_interval
+        )
+        if not self.should_set_cookie(app, session) and not stale:
+            return
+
+        expires = now + lifetime
+        self.store.set(session.sid, self.serializer.dumps(dict(session)), expires)
+        self._maybe_gc()
+
+        signed_sid = self._signer(app).sign(session.sid.encode("utf-8"))
+        response.set_cookie(
+            name,
+            signed_sid.decode("utf-8"),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+    def _maybe_gc(self) -> None:
+        now = time.time()
+        if now - self._last_gc < self.gc_interval:
+            return
+        self._last_gc = now
+        try:
+            deleted = self.store.gc()
+            if deleted:
+                logger.info(f"Session GC removed {deleted} expired sessions")
+        except Exception as e:
+            logger.error(f"Session GC failed: {e}")
+
+
+def init_session(app) -> SessionInterface:
+    """
+    Настраивает бэкенд сессий приложения по значению SESSION_BACKEND.
+
+    Поддерживаются значения "cookie" (по умолчанию), "memory" и "sqlite".
+
+    Args:
+        app (Flask): Приложение Flask.
+
+    Returns:
+        SessionInterface: Установленный интерфейс сессий.
+
+    Raises:
+        ValueError: Если указан неизвестный бэкенд.
+    """
+    backend = app.config.get("SESSION_BACKEND", "cookie")
+    max_entries = app.config.get("SESSION_MAX_ENTRIES", 10000)
+    gc_interval = app.config.get("SESSION_GC_INTERVAL", 600)
+
+    if backend == "cookie":
+        interface = CookieSessionInterface()
+    elif backend == "memory":
+        interface = ServerSideSessionInterface(
+            MemorySessionStore(max_entries), gc_interval
+        )
+    elif backend == "sqlite":
+        interface = ServerSideSessionInterface(
+            SqliteSessionStore(
+                app.config.get("SESSION_DB", "sessions.db"), max_entries
+            ),
+            gc_interval,
+        )
+    else:
+        raise ValueError(f"Unknown session backend: {backend}")
+
+    app.session_interface = interface
+    logger.info(f"Session backend: {backend}")
+    return interface
@@ -0,0 +1,355 @@
+# storage.py
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+import zipfile
+from contextlib import closing
+
+from flask import redirect, send_from_directory
+
+logger = logging.getLogger(__name__)
+
+# Размер блока при копировании потока изображения
+CHUNK_SIZE = 64 * 1024
+
+
+class HashingReader:
+    """
+    Файлоподобная обёртка над потоком, считающая размер и SHA-256 прочитанного.
+
+    Позволяет передать поток загрузки прямо в хранилище и получить хеш
+    содержимого без повторного чтения.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._hash = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._stream.read(size)
+        self._hash.update(data)
+        self.size += len(data)
+        return data
+
+    @property
+    def sha256(self) -> str:
+        """SHA-256 прочитанных данных (hex)."""
+        return self._hash.hexdigest()
+
+
+def copy_stream(src, dst) -> tuple:
+    """
+    Копирует поток блоками, подсчитывая размер и SHA-256.
+
+    Args:
+        src: Файлоподобный объект для чтения.
+        dst: Файлоподобный объект для записи.
+
+    Returns:
+        tuple: Размер в байтах и SHA-256 содержимого (hex).
+    """
+    reader = HashingReader(src)
+    while True:
+        chunk = reader.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        dst.write(chunk)
+    return reader.size, reader.sha256
+
+
+class _ZipSink:
+    """
+    Приёмник для zipfile без seek: копит записанные байты до выдачи.
+
+    Без seek zipfile пишет размеры и CRC после данных файла (data
+    descriptor), поэтому архив можно отдавать по мере записи.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(storage, entries):
+    """
+    Отдаёт ZIP-архив из объектов хранилища по частям.
+
+    Файлы записываются без сжатия (ZIP_STORED): PNG уже сжаты. Архив не
+    собирается ни в памяти, ни во временном файле: каждый файл читается
+    блоками по CHUNK_SIZE, и блоки отдаются сразу вместе с заголовками
+    архива. Файл, который не удалось открыть, пропускается.
+
+    Args:
+        storage (LocalStorage | S3Storage): Хранилище изображений.
+        entries (iterable): Пары (имя в архиве, ключ в хранилище) или тройки
+            с временем создания файла (Unix time) третьим элементом.
+
+    Yields:
+        bytes: Очередная часть архива.
+    """
+    sink = _ZipSink()
+    archive = zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED)
+    for arcname, key, *created_at in entries:
+        try:
+            source = storage.open(key)
+        except Exception as e:
+            logger.warning(f"Skipping {key} in ZIP archive: {e}")
+            continue
+        mtime = created_at[0] if created_at and created_at[0] else time.time()
+        info = zipfile.ZipInfo(arcname, time.localtime(mtime)[:6])
+        with closing(source), archive.open(info, "w") as target:
+            while chunk := source.read(CHUNK_SIZE):
+                target.write(chunk)
+                # Первый блок уходит вместе с локальным заголовком файла
+                yield sink.drain()
+        # Дескриптор данных с CRC и размерами пишется при закрытии файла
+        yield sink.drain()
+    archive.close()
+    yield sink.drain()
+
+
+class LocalStorage:
+    """Хранение изображений в локальной папке (по умолчанию output)."""
+
+    # Хранилище видно только процессам этого узла
+    shared = False
+
+    def __init__(self, root: str):
+        """
+        Args:
+            root (str): Корневая папка хранилища.
+        """
+        self.root = os.path.abspath(root)
+
+    def save(self, key: str, stream) -> tuple:
+        """
+        Записывает поток в файл root/key.
+
+        Args:
+            key (str): Путь относительно корня хранилища.
+            stream: Файлоподобный объект с содержимым.
+
+        Returns:
+            tuple: Размер в байтах и SHA-256 содержимого (hex).
+        """
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as file:
+            return copy_stream(stream, file)
+
+    def open(self, key: str):
+        """
+        Открывает объект на чтение.
+
+        Raises:
+            OSError: Если файла нет.
+        """
+        return open(os.path.join(self.root, key), "rb")
+
+    def send(self, key: str, etag: str = None, download_name: str = None):
+        """
+        Возвращает ответ Flask с содержимым объекта.
+
+        Args:
+            key (str): Путь относительно корня хранилища.
+            etag (str, optional): Значение ETag.
+            download_name (str, optional): Имя файла для скачивания; если
+                задано, файл отдаётся как вложение.
+        """
+        return send_from_directory(
+            self.root,
+            key,
+            etag=etag if etag is not None else True,
+            as_attachment=download_name is not None,
+            download_name=download_name,
+        )
+
+    def delete_prefix(self, prefix: str) -> None:
+        """
+        Удаляет каталог prefix вместе с опустевшими родительскими каталогами.
+
+        Args:
+            prefix (str): Каталог относительно корня хранилища.
+        """
+        path = os.path.join(self.root, prefix)
+        shutil.rmtree(path, ignore_errors=True)
+        parent = os.path.dirname(path)
+        while parent != self.root and os.path.isdir(parent) and not os.listdir(parent):
+            os.rmdir(parent)
+            parent = os.path.dirname(parent)
+
+
+class S3Storage:
+    """
+    Хранение изображений в S3-совместимом хранилище (AWS S3, MinIO и др.).
+
+    Изображение загружается потоком прямо из ответа FusionBrain; крупные
+    объекты boto3 отправляет multipart-загрузкой. Отдача идёт редиректом на
+    подписанную ссылку, поэтому байты изображений не проходят через
+    процессы приложения. Клиент boto3 создаётся при первом обращении в
+    каждом процессе.
+    """
+
+    # Хранилище общее для всех узлов
+    shared = True
+
+    def __init__(
+        self,
+        bucket: str,
+        endpoint_url: str = None,
+        region: str = None,
+        access_key: str = None,
+        secret_key: str = None,
+        presign_seconds: int = 3600,
+    ):
+        """
+        Args:
+            bucket (str): Имя бакета.
+            endpoint_url (str, optional): Адрес S3-совместимого сервера.
+            region (str, optional): Регион.
+            access_key (str, optional): Ключ доступа; если не задан,
+                используется стандартная цепочка учётных данных boto3.
+            secret_key (str, optional): Секретный ключ.
+            presign_seconds (int): Время жизни подписанной ссылки.
+        """
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.presign_seconds = presign_seconds
+        self._client = None
+        self._client_pid = None
+        self._lock = threading.Lock()
+
+    def _get_client(self):
+        # boto3 нужен только для этого бэкенда, поэтому импортируется здесь
+        with self._lock:
+            if self._client is None or self._client_pid != os.getpid():
+                import boto3
+
+                self._client = boto3.client(
+                    "s3",
+                    endpoint_url=self.endpoint_url,
+                    region_name=self.region,
+                    aws_access_key_id=self.access_key,
+                    aws_secret_access_key=self.secret_key,
+                )
+                self._client_pid = os.getpid()
+            return self._client
+
+    def save(self, key: str, stream) -> tuple:
+        """
+        Загружает поток в объект key.
+
+        Args:
+            key (str): Ключ объекта.
+            stream: Файлоподобный объект с содержимым.
+
+        Returns:
+            tuple: Размер в байтах и SHA-256 содержимого (hex).
+        """
+        reader = HashingReader(stream)
+        self._get_client().upload_fileobj(
+            reader, self.bucket, key, ExtraArgs={"ContentType": "image/png"}
+        )
+        return reader.size, reader.sha256
+
+    def open(self, key: str):
+        """
+        Открывает объект на потоковое чтение из бакета.
+
+        Raises:
+            botocore.exceptions.ClientError: Если объекта нет.
+        """
+        response = self._get_client().get_object(Bucket=self.bucket, Key=key)
+        return response["Body"]
+
+    def send(self, key: str, etag: str = None, download_name: str = None):
+        """
+        Возвращает редирект на подписанную ссылку на объект.
+
+        Args:
+            key (str): Ключ объекта.
+            etag (str, optional): Не используется: ETag отдаёт хранилище.
+            download_name (str, optional): Имя файла для скачивания.
+        """
+        params = {"Bucket": self.bucket, "Key": key}
+        if download_name is not None:
+            params["ResponseContentDisposition"] = (
+                f'attachment; filename="{download_name}"'
+            )
+        url = self._get_client().generate_presigned_url(
+            "get_object", Params=params, ExpiresIn=self.presign_seconds
+        )
+        return redirect(url)
+
+    def delete_prefix(self, prefix: str) -> None:
+        """
+        Удаляет все объекты с ключами, начинающимися с prefix/.
+
+        Args:
+            prefix (str): Префикс ключей.
+        """
+        client = self._get_client()
+        paginator = client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=f"{prefix}/"):
+            objects = [{"Key": item["Key"]} for item in page.get("Contents", [])]
+            if objects:
+                client.delete_objects(Bucket=self.bucket, Delete={"Objects": objects})
+
+
+def create_storage(config, local_root: str):
+    """
+    Создаёт хранилище изображений по значению STORAGE_BACKEND.
+
+    Поддерживаются значения "local" (по умолчанию) и "s3".
+
+    Args:
+        config (AppConfig): Снимок конфигурации.
+        local_root (str): Папка для бэкенда "local".
+
+    Returns:
+        LocalStorage | S3Storage: Хранилище.
+
+    Raises:
+        ValueError: Если указан неизвестный бэкенд или не задан бакет S3.
+    """
+    backend = config.storage_backend
+    if backend == "local":
+        storage = LocalStorage(local_root)
+    elif backend == "s3":
+        if not config.s3_bucket:
+            raise ValueError("S3_BUCKET is required for STORAGE_BACKEND=s3")
+        storage = S3Storage(
+            config.s3_bucket,
+            endpoint_url=config.s3_endpoint_url,
+            region=config.s3_region,
+            access_key=config.s3_access_key,
+            secret_key=config.s3_secret_key,
+            presign_seconds=config.s3_presign_seconds,
+        )
+    else:
+        raise ValueError(f"Unknown storage backend: {backend}")
+    logger.info(f"Image storage backend: {backend}")
+    return storage
@@ -0,0 +1,201 @@
+# task_journal.py
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Через сколько секунд без продления задачи процесса считаются брошенными
+LEASE_SECONDS = 60
+
+
+class TaskJournal:
+    """
+    Журнал контрольных точек незавершённых задач генерации в SQLite.
+
+    Для каждой задачи хранятся параметры, текущий этап и UUID генерации
+    FusionBrain, как только он получен. После перезапуска процесса по журналу
+    можно продолжить опрос статуса уже запущенных генераций, не оплачивая их
+    повторно. Завершённые задачи из журнала удаляются.
+
+    Владелец задачи - случайный идентификатор процесса, а не имя хоста и PID:
+    в контейнере они совпадают после каждого перезапуска. Владелец продлевает
+    аренду своих задач через heartbeat(); задачи, аренда которых не
+    продлевалась lease_seconds, может забрать любой процесс.
+    """
+
+    def __init__(self, path: str, lease_seconds: float = LEASE_SECONDS):
+        """
+        Args:
+            path (str): Путь к файлу базы SQLite.
+            lease_seconds (float): Срок аренды задач владельцем в секундах.
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.owner = None
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # Соединение SQLite нельзя переносить через fork, поэтому оно
+        # открывается заново в каждом процессе
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn_pid = os.getpid()
+            # У каждого процесса, в том числе созданного fork, свой владелец
+            self.owner = uuid.uuid4().hex
+            with self._conn:
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS checkpoints ("
+                    "task_id TEXT PRIMARY KEY, "
+                    "params TEXT NOT NULL, "
+                    "stage TEXT NOT NULL, "
+                    "generation_uuid TEXT, "
+                    "owner TEXT NOT NULL, "
+                    "created_at TEXT NOT NULL, "
+                    "updated_at REAL NOT NULL, "
+                    "key_id TEXT)"
+                )
+                columns = {
+                    row[1]
+                    for row in self._conn.execute("PRAGMA table_info(checkpoints)")
+                }
+                if "key_id" not in columns:
+                    self._conn.execute("ALTER TABLE checkpoints ADD COLUMN key_id TEXT")
+        return self._conn
+
+    def create(self, task_id: str, params: dict, created_at: str) -> None:
+        """
+        Записывает новую задачу в журнал.
+
+        Args:
+            task_id (str): Идентификатор задачи.
+            params (dict): Параметры генерации.
+            created_at (str): Время создания задачи в формате ISO.
+        """
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO checkpoints "
+                    "(task_id, params, stage, generation_uuid, owner, created_at, updated_at) "
+                    "VALUES (?, ?, 'created', NULL, ?, ?, ?)",
+                    (task_id, json.dumps(params), self.owner, created_at, time.time()),
+                )
+
+    def checkpoint(
+        self,
+        task_id: str,
+        stage: str,
+        generation_uuid: str = None,
+        key_id: str = None,
+    ) -> None:
+        """
+        Сохраняет текущий этап задачи и, если переданы, UUID генерации и ключ.
+
+        Args:
+            task_id (str): Идентификатор задачи.
+            stage (str): Этап выполнения задачи.
+            generation_uuid (str, optional): UUID генерации FusionBrain.
+            key_id (str, optional): Идентификатор ключа API, создавшего генерацию.
+        """
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "UPDATE checkpoints SET stage = ?, "
+                    "generation_uuid = COALESCE(?, generation_uuid), "
+                    "key_id = COALESCE(?, key_id), "
+                    "owner = ?, updated_at = ? WHERE task_id = ?",
+                    (stage, generation_uuid, key_id, self.owner, time.time(), task_id),
+                )
+
+    def finish(self, task_id: str) -> None:
+        """Удаляет завершённую задачу из журнала."""
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute("DELETE FROM checkpoints WHERE task_id = ?", (task_id,))
+
+    def heartbeat(self) -> None:
+        """Продлевает аренду задач этого процесса."""
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "UPDATE checkpoints SET updated_at = ? WHERE owner = ?",
+                    (time.time(), self.owner),
+                )
+
+    def release(self) -> None:
+        """
+        Отпускает задачи этого процесса при остановке.
+
+        Аренда задач считается истёкшей, поэтому их сразу может забрать
+        другой процесс.
+        """
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "UPDATE checkpoints SET updated_at = 0 WHERE owner = ?",
+                    (self.owner,),
+                )
+
+    def claim_unfinished(self) -> list:
+        """
+        Забирает себе незавершённые задачи, аренда которых истекла.
+
+        Захват выполняется условным UPDATE по прежнему владельцу и времени
+        продления, поэтому при одновременном старте нескольких воркеров
+        каждая задача достаётся ровно одному из них.
+
+        Returns:
+            list: Список словарей с полями task_id, params, stage,
+            generation_uuid, key_id и created_at.
+        """
+        claimed = []
+        with self._lock:
+            conn = self._connection()
+            now = time.time()
+            rows = conn.execute(
+                "SELECT task_id, params, stage, generation_uuid, key_id, owner, "
+                "updated_at, created_at FROM checkpoints "
+                "WHERE owner != ? AND updated_at < ?",
+                (self.owner, now - self.lease_seconds),
+            ).fetchall()
+            for row in rows:
+                (
+                    task_id,
+                    params,
+                    stage,
+                    generation_uuid,
+                    key_id,
+                    owner,
+                    updated_at,
+                    created_at,
+                ) = row
+                with conn:
+                    updated = conn.execute(
+                        "UPDATE checkpoints SET owner = ?, updated_at = ? "
+                        "WHERE task_id = ? AND owner = ? AND updated_at = ?",
+                        (self.owner, now, task_id, owner, updated_at),
+                    ).rowcount
+                if updated:
+                    claimed.append(
+                        {
+                            "task_id": task_id,
+                            "params": json.loads(params),
+                            "stage": stage,
+                            "generation_uuid": generation_uuid,
+                            "key_id": key_id,
+                            "created_at": created_at,
+                        }
+                    )
+        return claimed
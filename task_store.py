@@ -0,0 +1,341 @@
+# task_store.py
+import threading
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from enum import Enum
+
+import msgspec
+from msgspec.structs import replace
+
+
+class TaskStatus(str, Enum):
+    """Статусы задачи генерации в порядке их прохождения."""
+
+    QUEUED = "queued"
+    INITIALIZING = "initializing"
+    CONNECTING = "connecting"
+    GETTING_PIPELINE = "getting_pipeline"
+    CHECKING_AVAILABILITY = "checking_availability"
+    GENERATING = "generating"
+    CHECKING_GENERATION = "checking_generation"
+    SAVING = "saving"
+    COMPLETED = "completed"
+    NO_FILES = "no_files"
+    UNAVAILABLE = "unavailable"
+    ERROR = "error"
+    CANCELLED = "cancelled"
+
+    @property
+    def is_final(self) -> bool:
+        """Задача в этом статусе больше не изменится."""
+        return self in FINAL_STATUSES
+
+
+FINAL_STATUSES = frozenset(
+    {
+        TaskStatus.COMPLETED,
+        TaskStatus.NO_FILES,
+        TaskStatus.UNAVAILABLE,
+        TaskStatus.ERROR,
+        TaskStatus.CANCELLED,
+    }
+)
+
+
+class TaskParams(msgspec.Struct, frozen=True):
+    """Параметры генерации, переданные клиентом."""
+
+    prompt: str
+    width: int
+    height: int
+    style: str | None = None
+    negative_prompt: str | None = None
+    images_num: int = 1
+    priority: str | None = None
+    pipeline: str | None = None
+    deadline_at: str | None = None
+
+
+class ImageRef(msgspec.Struct, frozen=True):
+    """Сохранённое изображение задачи."""
+
+    path: str
+    url: str
+
+
+class Task(msgspec.Struct, frozen=True, kw_only=True, omit_defaults=True):
+    """
+    Неизменяемый снимок состояния задачи.
+
+    Каждое изменение создаёт новый снимок с большим version, поэтому
+    читатель всегда видит согласованное состояние целиком, а для проверки
+    изменений достаточно сравнить версии. Сериализуется msgspec напрямую;
+    необязательные поля со значением по умолчанию в JSON не попадают.
+    """
+
+    task_id: str
+    params: TaskParams
+    created_at: str
+    status: TaskStatus
+    progress: int
+    version: int
+    message: str | None = None
+    image_paths: tuple[ImageRef, ...] = ()
+    started_at: str | None = None
+    polling_started_at: str | None = None
+    finished_at: str | None = None
+    recovered: bool = False
+
+
+_encoder = msgspec.json.Encoder()
+
+
+class TaskStore:
+    """
+    Хранилище задач с атомарной публикацией снимков.
+
+    Записи заменяются целиком под блокировкой, а чтение - это одно обращение
+    к словарю, поэтому читателям блокировка не нужна. Номер версии общий для
+    всех задач и только растёт.
+
+    Для выборок поддерживаются отсортированные индексы по ключу
+    (created_at, task_id): общий, отдельный для каждого статуса, для каждого
+    клиента-владельца и для каждой пары (владелец, статус). Владелец
+    хранится вне снимка и в JSON задачи не попадает. Задачи создаются в
+    порядке времени, поэтому вставка почти всегда идёт в конец списка, а
+    выборка страницы с любым сочетанием фильтров - это бинарный поиск и срез.
+
+    JSON снимка кодируется один раз на версию: повторные чтения одной версии
+    получают готовые байты из кэша. Кэш ограничен encoded_cache_size
+    недавно прочитанными задачами, а запись удаляется вместе с задачей.
+    """
+
+    def __init__(self, encoded_cache_size: int = 1024):
+        """
+        Args:
+            encoded_cache_size (int): Сколько задач держать в кэше JSON.
+        """
+        self._tasks = {}
+        self.encoded_cache_size = encoded_cache_size
+        self._encoded = OrderedDict()
+        self._encoded_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._version = 0
+        self._by_created = []
+        self._by_status = {status: [] for status in TaskStatus}
+        self._owners = {}
+        self._by_owner = {}
+        self._by_owner_status = {}
+
+    @staticmethod
+    def _remove_key(index: list, key: tuple) -> None:
+        i = bisect_left(index, key)
+        if i < len(index) and index[i] == key:
+            del index[i]
+
+    def add(self, task: Task, owner: str = None) -> Task:
+        """
+        Добавляет задачу, присваивая ей новую версию.
+
+        Args:
+            task (Task): Снимок задачи.
+            owner (str, optional): Клиент, создавший задачу.
+
+        Returns:
+            Task: Опубликованный снимок.
+        """
+        with self._lock:
+            self._version += 1
+            task = replace(task, version=self._version)
+            old = self._tasks.get(task.task_id)
+            if old is not None:
+                self._remove_indexes(old)
+            self._tasks[task.task_id] = task
+            key = (task.created_at, task.task_id)
+            insort(self._by_created, key)
+            insort(self._by_status[task.status], key)
+            if owner is not None:
+                self._owners[task.task_id] = owner
+                insort(self._by_owner.setdefault(owner, []), key)
+                insort(self._by_owner_status.setdefault((owner, task.status), []), key)
+        return task
+
+    @staticmethod
+    def _remove_owned_key(indexes: dict, name, key: tuple) -> None:
+        index = indexes[name]
+        TaskStore._remove_key(index, key)
+        if not index:
+            del indexes[name]
+
+    def _remove_indexes(self, task: Task) -> None:
+        key = (task.created_at, task.task_id)
+        self._remove_key(self._by_created, key)
+        self._remove_key(self._by_status[task.status], key)
+        owner = self._owners.pop(task.task_id, None)
+        if owner is not None:
+            self._remove_owned_key(self._by_owner, owner, key)
+            self._remove_owned_key(self._by_owner_status, (owner, task.status), key)
+
+    def update(self, task_id: str, **changes) -> Task:
+        """
+        Публикует новый снимок задачи с изменёнными полями.
+
+        Args:
+            task_id (str): Идентификатор задачи.
+            **changes: Новые значения полей Task.
+
+        Returns:
+            Task: Опубликованный снимок.
+
+        Raises:
+            KeyError: Если задачи нет в хранилище.
+        """
+        with self._lock:
+            old = self._tasks[task_id]
+            self._version += 1
+            task = replace(old, version=self._version, **changes)
+            self._tasks[task_id] = task
+            if task.status != old.status:
+                key = (task.created_at, task_id)
+                self._remove_key(self._by_status[old.status], key)
+                insort(self._by_status[task.status], key)
+                owner = self._owners.get(task_id)
+                if owner is not None:
+                    self._remove_owned_key(
+                        self._by_owner_status, (owner, old.status), key
+                    )
+                    insort(
+                        self._by_owner_status.setdefault((owner, task.status), []),
+                        key,
+                    )
+        return task
+
+    def get(self, task_id: str):
+        """Возвращает текущий снимок задачи или None."""
+        return self._tasks.get(task_id)
+
+    def get_encoded(self, task_id: str):
+        """
+        Возвращает текущий снимок задачи вместе с его JSON.
+
+        Снимок неизменяем, поэтому JSON кэшируется по task_id и версии и
+        кодируется заново только после публикации новой версии. Кодирование
+        идёт вне блокировки: при гонке два читателя закодируют одну версию
+        дважды, и в кэше останется любой из одинаковых результатов. Из кэша
+        вытесняются давно не читавшиеся задачи.
+
+        Returns:
+            tuple | None: (Task, bytes) или None, если задачи нет.
+        """
+        task = self._tasks.get(task_id)
+        if task is None:
+            return None
+        with self._encoded_lock:
+            cached = self._encoded.get(task_id)
+            if cached is not None and cached[0] is task:
+                self._encoded.move_to_end(task_id)
+                return cached
+        cached = (task, _encoder.encode(task))
+        with self._encoded_lock:
+            # Задачу могли удалить во время кодирования: pop убирает её из
+            # словаря задач раньше, чем из кэша
+            if task_id in self._tasks:
+                self._encoded[task_id] = cached
+                self._encoded.move_to_end(task_id)
+                while len(self._encoded) > self.encoded_cache_size:
+                    self._encoded.popitem(last=False)
+        return cached
+
+    def pop(self, task_id: str):
+        """Удаляет задачу и возвращает её последний снимок или None."""
+        with self._lock:
+            task = self._tasks.pop(task_id, None)
+            if task is not None:
+                self._remove_indexes(task)
+        with self._encoded_lock:
+            self._encoded.pop(task_id, None)
+        return task
+
+    def evict_finished(self, created_before: str) -> int:
+        """
+        Удаляет завершённые задачи, созданные раньше created_before.
+
+        Задачи перебираются по индексу времени создания от старых к новым,
+        поэтому обход останавливается на первой более новой задаче.
+        Незавершённые задачи не удаляются.
+
+        Args:
+            created_before (str): Граница времени создания (ISO 8601).
+
+        Returns:
+            int: Число удалённых задач.
+        """
+        with self._lock:
+            end = bisect_left(self._by_created, (created_before,))
+            expired = [
+                task_id
+                for _, task_id in self._by_created[:end]
+                if self._tasks[task_id].status.is_final
+            ]
+        for task_id in expired:
+            self.pop(task_id)
+        return len(expired)
+
+    def owner(self, task_id: str):
+        """Возвращает клиента, создавшего задачу, или None."""
+        return self._owners.get(task_id)
+
+    def query(
+        self, status=None, since=None, before=None, limit=50, owner=None
+    ) -> tuple:
+        """
+        Возвращает страницу задач от новых к старым.
+
+        Args:
+            status (TaskStatus, optional): Только задачи в этом статусе.
+            owner (str, optional): Только задачи этого клиента.
+            since (str, optional): Только задачи, созданные не раньше этого
+                времени (ISO 8601).
+            before (tuple, optional): Ключ (created_at, task_id) последней
+                задачи предыдущей страницы; выдаются задачи старше него.
+            limit (int): Размер страницы.
+
+        Returns:
+            tuple: (список Task, есть ли ещё задачи за этой страницей).
+        """
+        with self._lock:
+            if owner is None:
+                index = self._by_created if status is None else self._by_status[status]
+            elif status is None:
+                index = self._by_owner.get(owner, [])
+            else:
+                index = self._by_owner_status.get((owner, status), [])
+            hi = len(index) if before is None else bisect_left(index, tuple(before))
+            lo = 0 if since is None else bisect_left(index, (since,))
+            start = max(lo, hi - limit)
+            page = [self._tasks[task_id] for _, task_id in reversed(index[start:hi])]
+        return page, start > lo
+
+    def all(self) -> list:
+        """Возвращает снимки всех задач."""
+        return list(self._tasks.values())
+
+    def count_by_status(self) -> dict:
+        """Возвращает число задач в каждом статусе."""
+        with self._lock:
+            return {
+                status.value: len(index)
+                for status, index in self._by_status.items()
+                if index
+            }
+
+    @property
+    def version(self) -> int:
+        """Версия последнего изменения в хранилище."""
+        return self._version
+
+    def __contains__(self, task_id) -> bool:
+        return task_id in self._tasks
+
+    def __len__(self) -> int:
+        return len(self._tasks)
@@ -0,0 +1,53 @@
+# test_app_startup.py
+import json
+import os
+import subprocess
+import sys
+
+# Бюджет холодного старта: от запуска импорта app до готового приложения
+COLD_START_BUDGET_SECONDS = 2.0
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Импортирует app в отдельном процессе и сообщает, что успело случиться
+STARTUP_PROBE = """
+import json, sys, threading, time
+started = time.perf_counter()
+import app
+print(json.dumps({
+    "seconds": time.perf_counter() - started,
+    "modules": [m for m in ("PIL", "requests", "client_con") if m in sys.modules],
+    "threads": threading.active_count(),
+}))
+"""
+
+
+def cold_start(tmp_path, **env):
+    """Запускает импорт app в чистом процессе в каталоге tmp_path."""
+    result = subprocess.run(
+        [sys.executable, "-c", STARTUP_PROBE],
+        cwd=tmp_path,
+        env={**os.environ, "PYTHONPATH": REPO_DIR, **env},
+        capture_output=True,
+        text=True,
+        timeout=60,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_cold_start_within_budget(tmp_path):
+    startup = cold_start(tmp_path)
+    assert startup["seconds"] < COLD_START_BUDGET_SECONDS
+
+
+def test_import_is_fork_safe(tmp_path):
+    startup = cold_start(
+        tmp_path, SESSION_BACKEND="sqlite", SESSION_DB=str(tmp_path / "sessions.db")
+    )
+    # Тяжёлые модули загружаются при первой генерации, а фоновые потоки
+    # запускаются после fork
+    assert startup["modules"] == []
+    assert startup["threads"] == 1
+    # Соединение с базой сессий не открывается до первого запроса
+    assert not (tmp_path / "sessions.db").exists()
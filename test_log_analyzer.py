@@ -0,0 +1,75 @@
+# test_log_analyzer.py
+from log_analyzer import LogAnalyzer
+
+# Фрагмент app.log в формате без меток [task=...]
+LEGACY_LOG = """\
+2025-04-18 15:11:22,568 - INFO - 127.0.0.1 - - [18/Apr/2025 15:11:22] "POST /generate HTTP/1.1" 200 -
+2025-04-18 15:11:22,569 - INFO - FusionBrainAPI initialized with URL: https://api-key.fusionbrain.ai/
+2025-04-18 15:11:22,570 - INFO - Requesting pipeline ID from https://api-key.fusionbrain.ai/key/api/v1/pipelines
+2025-04-18 15:11:23,147 - INFO - Successfully retrieved pipeline ID: a17740da-e8a0-4816-876a-74326c5c4cef
+2025-04-18 15:11:23,147 - INFO - Checking service availability for pipeline a17740da-e8a0-4816-876a-74326c5c4cef
+2025-04-18 15:11:23,432 - INFO - Service availability status: {'status': 'ACTIVE'}
+2025-04-18 15:11:23,433 - INFO - Initiating image generation with prompt: Красивый закат на морском побережье, pipeline: a17740da-e8a0-4816-876a-74326c5c4cef, width: 512, height: 512, style: default
+2025-04-18 15:11:23,587 - INFO - Returning task data: {'status': 'generating', 'progress': 50}
+2025-04-18 15:11:23,862 - INFO - Image generation initiated, UUID: 0ada3017-7e3f-4b17-b173-849c67ff9930
+2025-04-18 15:11:23,862 - INFO - Checking generation status for UUID: 0ada3017-7e3f-4b17-b173-849c67ff9930
+2025-04-18 15:11:24,262 - INFO - Generation status: INITIAL, waiting...
+2025-04-18 15:11:29,689 - INFO - Generation status: INITIAL, waiting...
+2025-04-18 15:11:39,735 - INFO - Generation completed, found 1 files for UUID: 0ada3017-7e3f-4b17-b173-849c67ff9930
+2025-04-18 15:11:39,738 - INFO - Saving image to output\\f082e9a8-dd7f-4ad0-909e-2b966dc54afb\\generated_1744978299_1.png
+2025-04-18 15:11:39,741 - INFO - Base64 image decoded and saved to output\\f082e9a8-dd7f-4ad0-909e-2b966dc54afb\\generated_1744978299_1.png
+2025-04-18 15:11:39,742 - INFO - Image saved: path=f082e9a8-dd7f-4ad0-909e-2b966dc54afb/generated_1744978299_1.png, url=/image/f082e9a8-dd7f-4ad0-909e-2b966dc54afb/generated_1744978299_1.png
+2025-04-18 15:11:40,591 - INFO - Task f082e9a8-dd7f-4ad0-909e-2b966dc54afb status: completed, progress: 100
+2025-04-18 15:12:01,000 - INFO - Requesting pipeline ID from https://api-key.fusionbrain.ai/key/api/v1/pipelines
+2025-04-18 15:12:01,300 - INFO - Successfully retrieved pipeline ID: a17740da-e8a0-4816-876a-74326c5c4cef
+2025-04-18 15:12:01,301 - INFO - Checking service availability for pipeline a17740da-e8a0-4816-876a-74326c5c4cef
+2025-04-18 15:12:01,500 - ERROR - Network error in check_availability: 503 Server Error
+"""
+
+
+def analyze(text):
+    analyzer = LogAnalyzer()
+    for line in text.splitlines(keepends=True):
+        analyzer.feed(line)
+    analyzer.finish()
+    return analyzer.report()
+
+
+def test_legacy_log_is_attributed_to_tasks():
+    report = analyze(LEGACY_LOG)
+
+    assert report["tasks"] == {"completed": 1}
+    stages = report["stages"]
+    assert stages["pipeline"]["count"] == 1
+    assert stages["generation"]["count"] == 1
+    assert abs(stages["generation"]["max"] - 15.873) < 0.5
+    assert stages["save"]["count"] == 1
+    assert report["polls_per_task"]["distribution"] == {"3": 1}
+
+
+def test_upstream_calls_are_counted_without_task_tags():
+    upstream = analyze(LEGACY_LOG)["upstream"]
+
+    assert upstream["pipelines"]["requests"] == 2
+    assert upstream["availability"] == {
+        "requests": 2,
+        "failures": 1,
+        "failure_rate": 0.5,
+    }
+    assert upstream["run"]["requests"] == 1
+    assert upstream["status"]["requests"] == 3
+
+
+def test_tagged_lines_use_task_id():
+    tagged = """\
+2025-04-18 15:11:22,570 - INFO - [task=t1] Job started, waited 0.5s in queue
+2025-04-18 15:11:22,571 - INFO - [task=t1] Requesting pipelines from https://api-key.fusionbrain.ai/key/api/v1/pipelines
+2025-04-18 15:11:23,147 - INFO - [task=t1] Retrieved 1 pipelines: a17740da
+2025-04-18 15:11:30,000 - INFO - [task=t1] Task t1 finished: completed
+"""
+    report = analyze(tagged)
+
+    assert report["tasks"] == {"completed": 1}
+    assert report["unattributed_lines"] == 0
+    assert report["stages"]["queue"]["count"] == 1
+    assert report["upstream"]["pipelines"]["requests"] == 1
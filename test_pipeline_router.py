@@ -0,0 +1,41 @@
+# test_pipeline_router.py
+import pipeline_router
+from pipeline_router import PipelineRouter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_latency_is_time_to_first_done(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(pipeline_router.time, "monotonic", clock)
+    router = PipelineRouter()
+
+    attempt = router.start("kandinsky")
+    # Генерация готова через 12 секунд, но пауза опроса и скачивание
+    # результата в задержку pipeline не входят
+    clock.now += 12
+    attempt.mark_done()
+    clock.now += 20
+    attempt.mark_done()
+    clock.now += 5
+    attempt.finish(True)
+
+    (stats,) = router.stats()
+    assert stats["latency_seconds"] == 12
+    assert stats["in_flight"] == 0
+
+
+def test_cancelled_attempt_is_not_recorded():
+    router = PipelineRouter()
+
+    router.start("kandinsky").finish(None)
+
+    (stats,) = router.stats()
+    assert stats["latency_seconds"] is None
+    assert stats["total"] == 0
@@ -0,0 +1,103 @@
+# test_replay.py
+import base64
+import json
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(256))
+
+# Записанный обмен с FusionBrain: одна генерация с результатом по URL
+CASSETTE = [
+    (
+        "GET /key/api/v1/pipelines",
+        [{"id": "kandinsky", "name": "Kandinsky", "type": "TEXT2IMAGE"}],
+    ),
+    ("GET /key/api/v1/pipeline/kandinsky/availability", {}),
+    ("POST /key/api/v1/pipeline/run", {"uuid": "0ada3017", "status": "INITIAL"}),
+    (
+        "GET /key/api/v1/pipeline/status/0ada3017",
+        {"uuid": "0ada3017", "status": "PROCESSING"},
+    ),
+    (
+        "GET /key/api/v1/pipeline/status/0ada3017",
+        {
+            "uuid": "0ada3017",
+            "status": "DONE",
+            "result": {"files": ["https://cdn.fusionbrain.test/0ada3017/1.png"]},
+        },
+    ),
+]
+
+# Запускает генерацию через /generate и опрашивает /task до завершения
+REPLAY_PROBE = """
+import json, time
+import app
+app.start_background_services()
+client = app.app.test_client()
+task_id = client.post("/generate", json={"prompt": "Закат"}).get_json()["task_id"]
+for _ in range(500):
+    task = client.get(f"/task/{task_id}").get_json()["task"]
+    if task["status"] in ("completed", "error", "no_files", "unavailable"):
+        break
+    time.sleep(0.02)
+image = client.get(task["image_paths"][0]["url"]) if task.get("image_paths") else None
+print(json.dumps({
+    "task": task,
+    "image": image.data.hex() if image is not None else None,
+}))
+"""
+
+
+def write_cassette(path):
+    with open(path, "w", encoding="utf-8") as f:
+        for request, body in CASSETTE:
+            entry = {
+                "request": request,
+                "status": 200,
+                "elapsed": 0,
+                "encoding": "utf-8",
+                "body": json.dumps(body),
+            }
+            f.write(json.dumps(entry) + "\n")
+        entry = {
+            "request": "GET /0ada3017/1.png",
+            "status": 200,
+            "elapsed": 0,
+            "encoding": "base64",
+            "body": base64.b64encode(PNG).decode("ascii"),
+        }
+        f.write(json.dumps(entry) + "\n")
+
+
+def test_generate_and_poll_with_replayed_fusionbrain(tmp_path):
+    write_cassette(tmp_path / "cassette.jsonl")
+    env = {
+        key: value
+        for key, value in os.environ.items()
+        if not key.startswith("FUSIONBRAIN_")
+    }
+    result = subprocess.run(
+        [sys.executable, "-c", REPLAY_PROBE],
+        cwd=tmp_path,
+        env={
+            **env,
+            "PYTHONPATH": REPO_DIR,
+            "ENV_FILE": str(tmp_path / ".env"),
+            "FUSIONBRAIN_TRANSPORT": "replay",
+            "FUSIONBRAIN_CASSETTE": str(tmp_path / "cassette.jsonl"),
+            "FUSIONBRAIN_REPLAY_SPEED": "0",
+        },
+        capture_output=True,
+        text=True,
+        timeout=60,
+        check=True,
+    )
+    probe = json.loads(result.stdout.strip().splitlines()[-1])
+
+    assert probe["task"]["status"] == "completed", probe["task"].get("message")
+    assert len(probe["task"]["image_paths"]) == 1
+    # Изображение скачано через транспорт из кассеты, а не из сети
+    assert bytes.fromhex(probe["image"]) == PNG
@@ -0,0 +1,48 @@
+# test_scheduler.py
+import time
+
+import pytest
+
+from scheduler import BATCH, GenerationScheduler, QueueFullError
+
+
+def noop():
+    pass
+
+
+def test_overdue_task_leaves_queue_when_polled():
+    expired = []
+    # Потоки-исполнители не запущены: задачи остаются в очереди
+    scheduler = GenerationScheduler(on_expired=expired.append)
+    past = time.time() - 1
+    scheduler.submit("task-1", "client", BATCH, noop, deadline=past)
+    scheduler.submit("task-2", "client", BATCH, noop)
+
+    assert scheduler.queue_position("task-1") is None
+    assert expired == ["task-1"]
+    assert scheduler.queue_position("task-2") == 0
+    assert scheduler.stats()["queued"][BATCH] == 1
+
+
+def test_overdue_tasks_do_not_count_toward_client_limit():
+    expired = []
+    scheduler = GenerationScheduler(max_queued_per_client=2, on_expired=expired.append)
+    scheduler.submit("task-1", "client", BATCH, noop, deadline=time.time() + 0.05)
+    scheduler.submit("task-2", "client", BATCH, noop)
+    with pytest.raises(QueueFullError):
+        scheduler.submit("task-3", "client", BATCH, noop)
+
+    time.sleep(0.1)
+    assert scheduler.submit("task-3", "client", BATCH, noop) == 1
+    assert expired == ["task-1"]
+
+
+def test_cancelled_task_is_not_expired_later():
+    expired = []
+    scheduler = GenerationScheduler(on_expired=expired.append)
+    scheduler.submit("task-1", "client", BATCH, noop, deadline=time.time() + 0.05)
+
+    assert scheduler.cancel("task-1")
+    time.sleep(0.1)
+    assert scheduler.expire_overdue() == []
+    assert expired == []
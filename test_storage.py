@@ -0,0 +1,137 @@
+# test_storage.py
+import hashlib
+import io
+import zipfile
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+import storage
+from storage import LocalStorage, S3Storage, stream_zip
+
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 40
+
+
+def read_zip(chunks) -> zipfile.ZipFile:
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(chunks)))
+    assert archive.testzip() is None
+    return archive
+
+
+def test_local_save_and_open(tmp_path):
+    local = LocalStorage(str(tmp_path))
+
+    size, sha256 = local.save("ab/cd/task-1/1.png", io.BytesIO(PNG))
+
+    assert (size, sha256) == (len(PNG), hashlib.sha256(PNG).hexdigest())
+    with local.open("ab/cd/task-1/1.png") as f:
+        assert f.read() == PNG
+
+
+def test_local_delete_prefix_removes_empty_parents(tmp_path):
+    local = LocalStorage(str(tmp_path))
+    local.save("ab/cd/task-1/1.png", io.BytesIO(PNG))
+    local.save("ab/cd/task-1/2.png", io.BytesIO(PNG))
+    local.save("ab/ef/task-2/1.png", io.BytesIO(PNG))
+
+    local.delete_prefix("ab/cd/task-1")
+    assert not (tmp_path / "ab" / "cd").exists()
+    assert (tmp_path / "ab" / "ef" / "task-2" / "1.png").exists()
+
+    local.delete_prefix("ab/ef/task-2")
+    # Корень хранилища остаётся, даже когда в нём ничего нет
+    assert tmp_path.exists() and list(tmp_path.iterdir()) == []
+    # Удаление несуществующего префикса не считается ошибкой
+    local.delete_prefix("ab/cd/task-1")
+
+
+def test_stream_zip_streams_files_and_skips_missing(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "CHUNK_SIZE", 1024)
+    local = LocalStorage(str(tmp_path))
+    local.save("ab/cd/task-1/1.png", io.BytesIO(PNG))
+    local.save("ab/cd/task-1/2.png", io.BytesIO(PNG[::-1]))
+
+    chunks = list(
+        stream_zip(
+            local,
+            [
+                ("task-1/1.png", "ab/cd/task-1/1.png", 1744978299),
+                ("task-1/missing.png", "ab/cd/task-1/missing.png"),
+                ("task-1/2.png", "ab/cd/task-1/2.png"),
+            ],
+        )
+    )
+
+    # Архив отдаётся блоками, а не одним куском в конце
+    assert len([chunk for chunk in chunks if chunk]) > len(PNG) // 1024
+    archive = read_zip(chunks)
+    assert archive.namelist() == ["task-1/1.png", "task-1/2.png"]
+    assert archive.read("task-1/1.png") == PNG
+    assert archive.read("task-1/2.png") == PNG[::-1]
+    assert archive.getinfo("task-1/1.png").compress_type == zipfile.ZIP_STORED
+
+
+@pytest.fixture
+def s3():
+    """S3Storage поверх эмулятора S3 из moto."""
+    pytest.importorskip("boto3")
+    moto = pytest.importorskip("moto")
+    with moto.mock_aws():
+        bucket = S3Storage(
+            "images",
+            region="us-east-1",
+            access_key="testing",
+            secret_key="testing",
+            presign_seconds=60,
+        )
+        bucket._get_client().create_bucket(Bucket="images")
+        yield bucket
+
+
+def test_s3_save_open_and_send(s3):
+    size, sha256 = s3.save("ab/cd/task-1/1.png", io.BytesIO(PNG))
+
+    assert (size, sha256) == (len(PNG), hashlib.sha256(PNG).hexdigest())
+    assert s3.open("ab/cd/task-1/1.png").read() == PNG
+    head = s3._get_client().head_object(Bucket="images", Key="ab/cd/task-1/1.png")
+    assert head["ContentType"] == "image/png"
+
+    response = s3.send("ab/cd/task-1/1.png", download_name="1.png")
+    assert response.status_code == 302
+    url = urlsplit(response.location)
+    assert url.path.endswith("/ab/cd/task-1/1.png")
+    query = parse_qs(url.query)
+    assert query["response-content-disposition"] == ['attachment; filename="1.png"']
+
+
+def test_s3_delete_prefix_pages_through_objects(s3):
+    client = s3._get_client()
+    # Больше 1000 объектов: list_objects_v2 отдаёт их несколькими страницами
+    for i in range(1005):
+        client.put_object(Bucket="images", Key=f"ab/cd/task-1/{i}.png", Body=b"")
+    s3.save("ab/cd/task-10/1.png", io.BytesIO(PNG))
+
+    s3.delete_prefix("ab/cd/task-1")
+
+    keys = [
+        item["Key"]
+        for item in client.list_objects_v2(Bucket="images").get("Contents", [])
+    ]
+    assert keys == ["ab/cd/task-10/1.png"]
+
+
+def test_stream_zip_from_s3(s3):
+    s3.save("ab/cd/task-1/1.png", io.BytesIO(PNG))
+
+    archive = read_zip(
+        stream_zip(
+            s3,
+            [
+                ("task-1/1.png", "ab/cd/task-1/1.png"),
+                ("task-1/2.png", "ab/cd/task-1/2.png"),
+            ],
+        )
+    )
+
+    assert archive.namelist() == ["task-1/1.png"]
+    assert archive.read("task-1/1.png") == PNG
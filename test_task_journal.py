@@ -0,0 +1,42 @@
+# test_task_journal.py
+from task_journal import TaskJournal
+
+PARAMS = {"prompt": "Красивый закат", "width": 512, "height": 512}
+
+
+def make_journal(tmp_path, lease_seconds=60):
+    journal = TaskJournal(str(tmp_path / "tasks.db"), lease_seconds=lease_seconds)
+    journal.create("task-1", PARAMS, "2025-04-18T15:11:22")
+    journal.checkpoint("task-1", "checking_generation", "0ada3017", "key-1")
+    journal.create("task-2", PARAMS, "2025-04-18T15:11:23")
+    return journal
+
+
+def test_restart_with_same_host_and_pid_claims_tasks(tmp_path):
+    # Перезапущенный контейнер: то же имя хоста и тот же PID
+    make_journal(tmp_path, lease_seconds=0)
+    restarted = TaskJournal(str(tmp_path / "tasks.db"), lease_seconds=0)
+
+    claimed = {record["task_id"]: record for record in restarted.claim_unfinished()}
+
+    assert set(claimed) == {"task-1", "task-2"}
+    assert claimed["task-1"]["generation_uuid"] == "0ada3017"
+    assert claimed["task-1"]["key_id"] == "key-1"
+    assert claimed["task-1"]["params"] == PARAMS
+    # Задача достаётся одному процессу
+    assert restarted.claim_unfinished() == []
+
+
+def test_live_lease_is_not_claimed(tmp_path):
+    journal = make_journal(tmp_path)
+    other = TaskJournal(str(tmp_path / "tasks.db"))
+
+    journal.heartbeat()
+    assert other.claim_unfinished() == []
+
+    # После drain задачи освобождаются сразу, не дожидаясь конца аренды
+    journal.release()
+    assert {record["task_id"] for record in other.claim_unfinished()} == {
+        "task-1",
+        "task-2",
+    }
@@ -0,0 +1,104 @@
+# test_webhooks.py
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import webhooks
+from webhooks import UnsafeCallbackUrl, WebhookDispatcher, check_callback_url
+
+real_getaddrinfo = socket.getaddrinfo
+
+
+def fake_dns(monkeypatch, *answers):
+    """
+    Разрешает rebind.test в адреса answers по очереди (последний - дальше).
+
+    Остальные имена и IP-адреса разрешаются как обычно.
+    """
+    calls = []
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        if host != "rebind.test":
+            return real_getaddrinfo(host, port, *args, **kwargs)
+        address = answers[min(len(calls), len(answers) - 1)]
+        calls.append(address)
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (address, port))]
+
+    monkeypatch.setattr(socket, "getaddrinfo", getaddrinfo)
+    return calls
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+
+@pytest.fixture
+def receiver():
+    """Локальный HTTP-сервер, записывающий заголовок Host запросов."""
+    hosts = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            hosts.append(self.headers["Host"])
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server.server_port, hosts
+    server.shutdown()
+
+
+@pytest.mark.parametrize(
+    "address", ["127.0.0.1", "10.0.0.5", "169.254.169.254", "192.168.1.1"]
+)
+def test_host_resolving_to_private_address_is_rejected(monkeypatch, address):
+    fake_dns(monkeypatch, address)
+    with pytest.raises(UnsafeCallbackUrl):
+        check_callback_url("https://rebind.test/hook")
+
+
+def test_private_host_is_dead_lettered_without_request(monkeypatch, tmp_path):
+    fake_dns(monkeypatch, "10.0.0.5")
+    dead_letter = tmp_path / "dead.jsonl"
+    dispatcher = WebhookDispatcher(workers=1, dead_letter_path=str(dead_letter))
+    dispatcher.start()
+    dispatcher.enqueue("task-1", "http://rebind.test/hook", {"status": "completed"})
+
+    assert wait_for(lambda: dispatcher.stats()["dead_lettered"] == 1)
+    dispatcher.shutdown()
+    record = json.loads(dead_letter.read_text(encoding="utf-8"))
+    assert record["attempts"] == 1
+    assert "non-public address 10.0.0.5" in record["error"]
+
+
+def test_delivery_connects_to_checked_address(monkeypatch, tmp_path, receiver):
+    port, hosts = receiver
+    # Тестовый сервер слушает loopback, поэтому для проверки он "публичный";
+    # после проверки DNS-запись хоста меняется на внутренний адрес
+    monkeypatch.setattr(
+        webhooks, "is_public_address", lambda address: str(address) == "127.0.0.1"
+    )
+    calls = fake_dns(monkeypatch, "127.0.0.1", "10.0.0.5")
+    dispatcher = WebhookDispatcher(
+        workers=1, timeout=2, dead_letter_path=str(tmp_path / "dead.jsonl")
+    )
+    dispatcher.start()
+    dispatcher.enqueue("task-1", f"http://rebind.test:{port}/hook", {})
+
+    assert wait_for(lambda: dispatcher.stats()["delivered"] == 1)
+    dispatcher.shutdown()
+    # Имя разрешалось только при проверке, запрос ушёл на проверенный адрес
+    assert calls == ["127.0.0.1"]
+    assert hosts == [f"rebind.test:{port}"]
@@ -0,0 +1,301 @@
+# transport.py
+import base64
+import io
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+import requests.exceptions
+
+logger = logging.getLogger(__name__)
+
+# Запросы, по которым воспроизводятся запуск генерации и опрос её статуса
+RUN_REQUEST = "POST /key/api/v1/pipeline/run"
+STATUS_REQUEST_PREFIX = "GET /key/api/v1/pipeline/status/"
+
+# UUID воспроизведённого запуска в пути запроса (например, в адресе изображения)
+_UUID_RE = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+
+def _request_key(method: str, url: str) -> str:
+    """Ключ запроса в кассете: метод и путь с параметрами без адреса сервера."""
+    parts = urlsplit(url)
+    path = parts.path + (f"?{parts.query}" if parts.query else "")
+    return f"{method.upper()} {path}"
+
+
+class HttpTransport:
+    """Транспорт по умолчанию: запросы к FusionBrain через requests."""
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Выполняет HTTP-запрос."""
+        return requests.request(method, url, **kwargs)
+
+    @contextmanager
+    def download(self, url: str):
+        """
+        Скачивает файл по URL (изображение результата генерации).
+
+        Ответ не загружается в память целиком, а читается потоком.
+
+        Yields:
+            Файловый объект с содержимым ответа.
+
+        Raises:
+            requests.exceptions.RequestException: Если загрузка не удалась.
+        """
+        with self.request("GET", url, stream=True) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            yield response.raw
+
+    def sleep(self, seconds: float, cancel=None) -> None:
+        """
+        Пауза между опросами статуса генерации.
+
+        Args:
+            seconds (float): Длительность паузы.
+            cancel (CancelToken, optional): Отмена задачи прерывает паузу.
+        """
+        if cancel is not None:
+            cancel.wait(seconds)
+        else:
+            time.sleep(seconds)
+
+
+class RecordingTransport(HttpTransport):
+    """
+    Транспорт, записывающий обмен с FusionBrain в кассету.
+
+    Каждый ответ дописывается строкой JSON Lines: метод и путь запроса, код
+    ответа, тело и время ответа. Скачанные по URL изображения записываются
+    так же, по пути без адреса сервера. Заголовки запросов (в них ключи API) и
+    тела запросов не записываются.
+    """
+
+    def __init__(self, cassette_path: str):
+        """
+        Args:
+            cassette_path (str): Файл кассеты.
+        """
+        self.cassette_path = cassette_path
+        self._lock = threading.Lock()
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        started = time.monotonic()
+        response = super().request(method, url, **kwargs)
+        elapsed = time.monotonic() - started
+        try:
+            body, encoding = response.content.decode("utf-8"), "utf-8"
+        except UnicodeDecodeError:
+            body = base64.b64encode(response.content).decode("ascii")
+            encoding = "base64"
+        entry = {
+            "request": _request_key(method, url),
+            "status": response.status_code,
+            "elapsed": round(elapsed, 4),
+            "encoding": encoding,
+            "body": body,
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.cassette_path, "a", encoding="utf-8") as f:
+                f.write(line)
+        return response
+
+    @contextmanager
+    def download(self, url: str):
+        """Скачивает файл по URL, записывая его в кассету целиком."""
+        response = self.request("GET", url)
+        response.raise_for_status()
+        yield io.BytesIO(response.content)
+
+
+class ReplayResponse:
+    """Ответ из кассеты с интерфейсом requests.Response, нужным клиенту."""
+
+    def __init__(self, url: str, status_code: int, content: bytes):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self) -> None:
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(
+                f"{self.status_code} Error for url: {self.url}", response=self
+            )
+
+
+class ReplayTransport:
+    """
+    Транспорт, воспроизводящий записанную кассету без сети и ключей API.
+
+    Ответы на одинаковые запросы выдаются в порядке записи; когда записанные
+    ответы заканчиваются, последовательность начинается сначала. Каждый
+    воспроизведённый запуск генерации получает новый UUID со своим курсором
+    по записанной цепочке статусов исходного UUID, поэтому одновременные и
+    повторные генерации проходят её независимо; после последнего статуса
+    повторяется последний. Адреса изображений с UUID запуска отдаются по
+    записи для исходного UUID. Задержки ответов и паузы между опросами делятся
+    на speed; при speed=0 ответы выдаются сразу.
+    """
+
+    def __init__(self, cassette_path: str, speed: float = 1.0, max_runs: int = 10000):
+        """
+        Args:
+            cassette_path (str): Файл кассеты.
+            speed (float): Ускорение воспроизведения.
+            max_runs (int): Сколько последних запусков помнить для опроса
+                статуса.
+
+        Raises:
+            OSError: Если файл кассеты не удалось прочитать.
+        """
+        self.speed = speed
+        self.max_runs = max_runs
+        self._entries = defaultdict(list)
+        self._cursors = defaultdict(int)
+        # UUID воспроизведённого запуска -> [UUID из кассеты, курсор статусов]
+        self._runs = OrderedDict()
+        self._lock = threading.Lock()
+        with open(cassette_path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries[entry["request"]].append(entry)
+        logger.info(
+            f"Replaying {sum(map(len, self._entries.values()))} recorded "
+            f"responses from {cassette_path} at speed {speed}"
+        )
+
+    def _wait(self, seconds: float, cancel=None) -> None:
+        if self.speed <= 0:
+            return
+        if cancel is not None:
+            cancel.wait(seconds / self.speed)
+        else:
+            time.sleep(seconds / self.speed)
+
+    def request(self, method: str, url: str, **kwargs) -> ReplayResponse:
+        """
+        Возвращает следующий записанный ответ на запрос.
+
+        Raises:
+            requests.exceptions.ConnectionError: Если запрос не записан.
+        """
+        key = _request_key(method, url)
+        with self._lock:
+            run_uuid = recorded_uuid = None
+            run = None
+            if key.startswith(STATUS_REQUEST_PREFIX):
+                run_uuid = key[len(STATUS_REQUEST_PREFIX) :]
+                run = self._runs.get(run_uuid)
+            if run is not None:
+                recorded_uuid = run[0]
+                entries = self._entries.get(STATUS_REQUEST_PREFIX + recorded_uuid)
+                entry = entries[min(run[1], len(entries) - 1)]
+                run[1] += 1
+            else:
+                if key not in self._entries:
+                    # Адрес из ответа запуска: UUID запуска -> UUID из кассеты
+                    key = _UUID_RE.sub(self._recorded_uuid, key)
+                entries = self._entries.get(key)
+                if not entries:
+                    raise requests.exceptions.ConnectionError(
+                        f"No recorded response for {key}"
+                    )
+                entry = entries[self._cursors[key] % len(entries)]
+                self._cursors[key] += 1
+        self._wait(entry["elapsed"])
+        if entry["encoding"] == "base64":
+            content = base64.b64decode(entry["body"])
+        else:
+            content = entry["body"].encode("utf-8")
+        if key == RUN_REQUEST and entry["status"] < 400:
+            run_uuid, recorded_uuid = self._start_run(content)
+        if recorded_uuid:
+            # В ответах вместо UUID из кассеты - UUID этого запуска
+            content = content.replace(recorded_uuid.encode(), run_uuid.encode())
+        return ReplayResponse(url, entry["status"], content)
+
+    def _recorded_uuid(self, match) -> str:
+        run = self._runs.get(match.group(0))
+        return run[0] if run is not None else match.group(0)
+
+    def _start_run(self, content: bytes) -> tuple:
+        """
+        Регистрирует воспроизведённый запуск генерации под новым UUID.
+
+        Returns:
+            tuple: (новый UUID, UUID из кассеты) или (None, None), если
+            записанный ответ не содержит UUID или цепочки его статусов.
+        """
+        try:
+            recorded_uuid = json.loads(content)["uuid"]
+        except (ValueError, KeyError, TypeError):
+            return None, None
+        if not self._entries.get(STATUS_REQUEST_PREFIX + recorded_uuid):
+            return None, None
+        run_uuid = str(uuid.uuid4())
+        with self._lock:
+            self._runs[run_uuid] = [recorded_uuid, 0]
+            while len(self._runs) > self.max_runs:
+                self._runs.popitem(last=False)
+        return run_uuid, recorded_uuid
+
+    @contextmanager
+    def download(self, url: str):
+        """
+        Возвращает записанное содержимое файла по URL.
+
+        Raises:
+            requests.exceptions.RequestException: Если загрузка не записана
+                или записана с ошибкой.
+        """
+        response = self.request("GET", url)
+        response.raise_for_status()
+        yield io.BytesIO(response.content)
+
+    def sleep(self, seconds: float, cancel=None) -> None:
+        """Пауза между опросами статуса с учётом ускорения."""
+        self._wait(seconds, cancel)
+
+
+def create_transport(config):
+    """
+    Создаёт транспорт FusionBrain по значению FUSIONBRAIN_TRANSPORT.
+
+    Поддерживаются значения "http" (по умолчанию), "record" и "replay".
+
+    Args:
+        config (AppConfig): Снимок конфигурации.
+
+    Returns:
+        HttpTransport | RecordingTransport | ReplayTransport: Транспорт.
+
+    Raises:
+        ValueError: Если указан неизвестный транспорт.
+    """
+    mode = config.fusionbrain_transport
+    if mode == "http":
+        return HttpTransport()
+    if mode == "record":
+        logger.info(f"Recording FusionBrain responses to {config.fusionbrain_cassette}")
+        return RecordingTransport(config.fusionbrain_cassette)
+    if mode == "replay":
+        return ReplayTransport(config.fusionbrain_cassette, config.replay_speed)
+    raise ValueError(f"Unknown FusionBrain transport: {mode}")
@@ -0,0 +1,421 @@
+# webhooks.py
+import hashlib
+import heapq
+import hmac
+import ipaddress
+import itertools
+import json
+import logging
+import socket
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from datetime import datetime
+from random import uniform
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+class Delivery:
+    """Уведомление, ожидающее отправки на callback_url клиента."""
+
+    __slots__ = ("task_id", "url", "host", "body", "secret", "attempts", "last_error")
+
+    def __init__(self, task_id, url, body, secret=None):
+        self.task_id = task_id
+        self.url = url
+        self.host = urlsplit(url).hostname
+        self.body = body
+        self.secret = secret
+        self.attempts = 0
+        self.last_error = None
+
+
+def sign(body: bytes, secret: str) -> str:
+    """
+    Вычисляет подпись тела уведомления для заголовка X-Signature.
+
+    Args:
+        body (bytes): Тело запроса.
+        secret (str): Секрет клиента.
+
+    Returns:
+        str: Подпись вида "sha256=<hex>".
+    """
+    digest = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return f"sha256={digest}"
+
+
+class UnsafeCallbackUrl(ValueError):
+    """callback_url указывает на адрес, куда сервер не должен обращаться."""
+
+
+def is_public_address(address) -> bool:
+    """Проверяет, что IP-адрес глобальный и не групповой."""
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return address.is_global and not address.is_multicast
+
+
+def check_callback_url(url: str) -> str:
+    """
+    Проверяет, что callback_url ведёт во внешнюю сеть.
+
+    Имя хоста разрешается, и все его адреса должны быть глобальными:
+    loopback, link-local, частные и зарезервированные адреса запрещены,
+    чтобы через уведомления нельзя было обратиться к внутренним сервисам.
+
+    Args:
+        url (str): Адрес callback клиента.
+
+    Returns:
+        str: Проверенный IP-адрес, с которым нужно соединяться.
+
+    Raises:
+        UnsafeCallbackUrl: Если адрес не http(s) или хост разрешается во
+            внутренний адрес.
+        OSError: Если имя хоста не удалось разрешить.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise UnsafeCallbackUrl(f"Invalid callback URL: {url}")
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+    except ValueError as e:
+        raise UnsafeCallbackUrl(f"Invalid callback URL: {url}") from e
+    addresses = [
+        ipaddress.ip_address(sockaddr[0].partition("%")[0])
+        for *_, sockaddr in socket.getaddrinfo(
+            parts.hostname, port, proto=socket.IPPROTO_TCP
+        )
+    ]
+    for address in addresses:
+        if not is_public_address(address):
+            raise UnsafeCallbackUrl(
+                f"Callback host {parts.hostname} resolves to non-public address {address}"
+            )
+    return str(addresses[0])
+
+
+def post_pinned(url: str, address: str, **kwargs):
+    """
+    Отправляет POST на url, соединяясь с заранее проверенным адресом.
+
+    Имя хоста повторно не разрешается, поэтому хост, сменивший DNS-запись
+    после проверки (DNS rebinding), не перенаправит запрос во внутреннюю
+    сеть. Исходное имя остаётся в заголовке Host, а для HTTPS - в SNI и при
+    проверке сертификата. Прокси из окружения не используются.
+
+    Args:
+        url (str): Адрес callback клиента.
+        address (str): IP-адрес из check_callback_url.
+        **kwargs: Параметры requests.Session.post.
+
+    Returns:
+        requests.Response: Ответ сервера.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    parts = urlsplit(url)
+    userinfo, _, host = parts.netloc.rpartition("@")
+    literal = f"[{address}]" if ":" in address else address
+    netloc = literal if parts.port is None else f"{literal}:{parts.port}"
+    if userinfo:
+        netloc = f"{userinfo}@{netloc}"
+    headers = {**kwargs.pop("headers", {}), "Host": host}
+
+    with requests.Session() as session:
+        session.trust_env = False
+        if parts.scheme == "https":
+            adapter = HTTPAdapter()
+            adapter.poolmanager.connection_pool_kw.update(
+                server_hostname=parts.hostname, assert_hostname=parts.hostname
+            )
+            session.mount("https://", adapter)
+        return session.post(
+            parts._replace(netloc=netloc).geturl(), headers=headers, **kwargs
+        )
+
+
+class WebhookDispatcher:
+    """
+    Доставка уведомлений о завершении задач на callback_url клиентов.
+
+    Уведомления отправляет пул из workers потоков, поэтому потоки генерации
+    только ставят их в очередь и никогда не ждут сети. Одному хосту
+    одновременно отправляется не больше max_per_host уведомлений, остальные
+    ждут своей очереди, так что медленный адрес занимает не больше
+    max_per_host потоков и не задерживает доставку другим клиентам.
+    Перед каждой попыткой адрес проверяется check_callback_url, а
+    перенаправления не выполняются. Неудачные попытки повторяются с
+    экспоненциальной задержкой; уведомления, которые не удалось доставить за
+    max_attempts попыток или на запрещённый адрес, записываются в
+    dead-letter файл в формате JSON Lines.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 6,
+        base_delay: float = 2,
+        max_delay: float = 300,
+        timeout: float = 10,
+        dead_letter_path: str = "webhooks_dead.jsonl",
+        workers: int = 4,
+        max_per_host: int = 2,
+    ):
+        """
+        Args:
+            max_attempts (int): Максимальное число попыток доставки.
+            base_delay (float): Задержка перед первым повтором в секундах.
+            max_delay (float): Максимальная задержка между попытками.
+            timeout (float): Таймаут HTTP-запроса в секундах.
+            dead_letter_path (str): Файл для недоставленных уведомлений.
+            workers (int): Число потоков доставки.
+            max_per_host (int): Сколько уведомлений одному хосту
+                отправляется одновременно.
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.dead_letter_path = dead_letter_path
+        self.workers = workers
+        self.max_per_host = max_per_host
+
+        # Куча (время отправки, порядковый номер, Delivery)
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        # Отправляемые сейчас уведомления по хостам и готовые к отправке
+        # уведомления, ждущие освобождения своего хоста
+        self._in_flight = Counter()
+        self._parked = defaultdict(deque)
+        self._threads = []
+        self._stopping = False
+        self._delivered = 0
+        self._failed = 0
+
+    def start(self) -> None:
+        """Запускает потоки доставки."""
+        with self._cond:
+            self._stopping = False
+            self._threads = [t for t in self._threads if t.is_alive()]
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._run, name=f"webhook-dispatcher-{i}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+        logger.info(f"Webhook dispatcher started with {self.workers} workers")
+
+    def enqueue(self, task_id: str, url: str, payload: dict, secret=None) -> None:
+        """
+        Ставит уведомление в очередь на отправку. Не блокирует вызывающий поток.
+
+        Args:
+            task_id (str): Идентификатор задачи.
+            url (str): Адрес callback клиента.
+            payload (dict): Данные уведомления.
+            secret (str, optional): Секрет для подписи HMAC.
+        """
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        delivery = Delivery(task_id, url, body, secret)
+        with self._cond:
+            heapq.heappush(
+                self._heap, (time.monotonic(), next(self._counter), delivery)
+            )
+            self._cond.notify()
+
+    def discard(self, task_id: str, url: str, payload: dict, reason: str) -> None:
+        """
+        Записывает уведомление в dead-letter файл, не отправляя его.
+
+        Args:
+            task_id (str): Идентификатор задачи.
+            url (str): Адрес callback клиента.
+            payload (dict): Данные уведомления.
+            reason (str): Почему уведомление не отправлено.
+        """
+        delivery = Delivery(task_id, url, json.dumps(payload).encode("utf-8"))
+        delivery.last_error = reason
+        self._dead_letter(delivery)
+
+    def _next_due(self):
+        """Возвращает следующее готовое к отправке уведомление. Под self._cond."""
+        while True:
+            if self._heap:
+                due = self._heap[0][0]
+                wait = due - time.monotonic()
+                if wait <= 0:
+                    delivery = heapq.heappop(self._heap)[2]
+                    if self._in_flight[delivery.host] >= self.max_per_host:
+                        self._parked[delivery.host].append(delivery)
+                        continue
+                    self._in_flight[delivery.host] += 1
+                    return delivery
+                # При остановке отложенные повторы уже не ждём
+                if self._stopping:
+                    return None
+                self._cond.wait(wait)
+            else:
+                if self._stopping:
+                    return None
+                self._cond.wait()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                delivery = self._next_due()
+            if delivery is None:
+                return
+            try:
+                self._attempt(delivery)
+            finally:
+                self._release_host(delivery.host)
+
+    def _release_host(self, host) -> None:
+        """Освобождает место хоста и отдаёт в очередь его ждущее уведомление."""
+        with self._cond:
+            self._in_flight[host] -= 1
+            if self._in_flight[host] <= 0:
+                del self._in_flight[host]
+            parked = self._parked.get(host)
+            if parked:
+                heapq.heappush(
+                    self._heap,
+                    (time.monotonic(), next(self._counter), parked.popleft()),
+                )
+                if not parked:
+                    del self._parked[host]
+                self._cond.notify()
+
+    def _attempt(self, delivery: Delivery) -> None:
+        # requests нужен только для доставки, поэтому импортируется здесь
+        import requests
+
+        delivery.attempts += 1
+        headers = {
+            "Content-Type": "application/json",
+            "X-Webhook-Task-Id": delivery.task_id,
+            "X-Webhook-Attempt": str(delivery.attempts),
+        }
+        if delivery.secret:
+            headers["X-Signature"] = sign(delivery.body, delivery.secret)
+
+        try:
+            # Адрес проверяется и при отправке: DNS хоста мог измениться
+            # после приёма задачи
+            address = check_callback_url(delivery.url)
+        except UnsafeCallbackUrl as e:
+            delivery.last_error = str(e)
+            self._dead_letter(delivery)
+            return
+        except OSError as e:
+            delivery.last_error = f"DNS error: {e}"
+        else:
+            try:
+                response = post_pinned(
+                    delivery.url,
+                    address,
+                    data=delivery.body,
+                    headers=headers,
+                    timeout=self.timeout,
+                    allow_redirects=False,
+                )
+                if 200 <= response.status_code < 300:
+                    with self._cond:
+                        self._delivered += 1
+                    logger.info(
+                        f"Webhook for task {delivery.task_id} delivered "
+                        f"(attempt {delivery.attempts})"
+                    )
+                    return
+                delivery.last_error = f"HTTP {response.status_code}"
+            except requests.exceptions.RequestException as e:
+                delivery.last_error = str(e)
+
+        if delivery.attempts >= self.max_attempts:
+            self._dead_letter(delivery)
+            return
+
+        delay = min(self.base_delay * 2 ** (delivery.attempts - 1), self.max_delay)
+        delay += uniform(0, delay / 2)
+        logger.warning(
+            f"Webhook for task {delivery.task_id} failed: {delivery.last_error}, "
+            f"retry in {delay:.0f}s"
+        )
+        with self._cond:
+            heapq.heappush(
+                self._heap,
+                (time.monotonic() + delay, next(self._counter), delivery),
+            )
+            self._cond.notify()
+
+    def _dead_letter(self, delivery: Delivery) -> None:
+        with self._cond:
+            self._failed += 1
+        logger.error(
+            f"Webhook for task {delivery.task_id} dropped after "
+            f"{delivery.attempts} attempts: {delivery.last_error}"
+        )
+        # Секрет в файл не пишется, а из адреса убираются логин и пароль
+        parts = urlsplit(delivery.url)
+        url = delivery.url
+        if parts.username or parts.password:
+            netloc = parts.netloc.rpartition("@")[2]
+            url = parts._replace(netloc=f"***@{netloc}").geturl()
+        record = {
+            "task_id": delivery.task_id,
+            "url": url,
+            "attempts": delivery.attempts,
+            "error": delivery.last_error,
+            "failed_at": datetime.now().isoformat(),
+            "payload": json.loads(delivery.body),
+        }
+        try:
+            with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.error(f"Failed to write webhook dead letter: {e}")
+
+    def shutdown(self, timeout: float = 10) -> None:
+        """
+        Останавливает потоки доставки.
+
+        Уже готовые к отправке уведомления отправляются, пока не истечёт
+        timeout; отложенные повторы и всё, что не успело уйти, записывается в
+        dead-letter файл.
+
+        Args:
+            timeout (float): Максимальное время ожидания в секундах.
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            threads = list(self._threads)
+        deadline = time.monotonic() + timeout
+        for thread in threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        with self._cond:
+            pending = [item[2] for item in self._heap]
+            self._heap.clear()
+            for parked in self._parked.values():
+                pending.extend(parked)
+            self._parked.clear()
+        for delivery in pending:
+            delivery.last_error = delivery.last_error or "shutdown"
+            self._dead_letter(delivery)
+
+    def stats(self) -> dict:
+        """Возвращает счётчики доставки."""
+        with self._cond:
+            return {
+                "pending": len(self._heap) + sum(map(len, self._parked.values())),
+                "in_flight": sum(self._in_flight.values()),
+                "delivered": self._delivered,
+                "dead_lettered": self._failed,
+            }